@@ -5,10 +5,12 @@ This script download a URL to a local destination
 import argparse
 import logging
 import os
+import tempfile
 
 import wandb
 
 from wandb_utils.log_artifact import log_artifact
+from wandb_utils.dataset_io import dataset_format, read_dataset, write_dataset
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -20,14 +22,33 @@ def go(args):
     run.config.update(args)
 
     logger.info(f"Returning sample {args.sample}")
-    logger.info(f"Uploading {args.artifact_name} to Weights & Biases")
-    log_artifact(
-        args.artifact_name,
-        args.artifact_type,
-        args.artifact_description,
-        os.path.join("data", args.sample),
-        run,
-    )
+    sample_path = os.path.join("data", args.sample)
+
+    if dataset_format(args.artifact_name) == dataset_format(sample_path):
+        logger.info(f"Uploading {args.artifact_name} to Weights & Biases")
+        log_artifact(
+            args.artifact_name,
+            args.artifact_type,
+            args.artifact_description,
+            sample_path,
+            run,
+        )
+        return
+
+    # The requested artifact format differs from the sample on disk: convert it first
+    logger.info(f"Converting {args.sample} to {dataset_format(args.artifact_name)}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        converted_path = os.path.join(tmp_dir, args.artifact_name)
+        write_dataset(read_dataset(sample_path), converted_path)
+
+        logger.info(f"Uploading {args.artifact_name} to Weights & Biases")
+        log_artifact(
+            args.artifact_name,
+            args.artifact_type,
+            args.artifact_description,
+            converted_path,
+            run,
+        )
 
 
 if __name__ == "__main__":
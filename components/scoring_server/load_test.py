@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Load test of the scoring server: concurrent clients send single-listing requests taken from a dataset,
+and the client-side latency percentiles and throughput are reported with the server metrics
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from wandb_utils.dataset_io import read_dataset
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+async def _request(reader, writer, host, method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def _client(url, listings, latencies, errors):
+    # One keep-alive connection sending its listings one request at a time
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+    try:
+        for listing in listings:
+            start = time.perf_counter()
+            status, _ = await _request(reader, writer, parts.netloc, "POST", "/predict", listing)
+            latencies.append(time.perf_counter() - start)
+            errors[0] += int(status != 200)
+    finally:
+        writer.close()
+
+
+async def load_test(url, listings, concurrency):
+    """
+    Send every listing as its own request, from concurrency concurrent clients
+
+    :param url: base URL of the scoring server
+    :param listings: list of dicts {column: value}
+    :param concurrency: number of concurrent clients
+    :return: dict of client-side metrics, with the server metrics under "server"
+    """
+    latencies, errors = [], [0]
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _client(url, listings[i::concurrency], latencies, errors) for i in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+    _, server_metrics = await _request(reader, writer, parts.netloc, "GET", "/metrics")
+    writer.close()
+
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": len(latencies) / elapsed,
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p99_ms": float(np.percentile(latencies, 99)),
+        "server": server_metrics,
+    }
+
+
+def go(args):
+    df = read_dataset(args.dataset)
+    df = df.drop(columns=["price"], errors="ignore").head(args.n_requests)
+    # JSON has no NaN: missing values are sent as nulls
+    listings = json.loads(df.to_json(orient="records"))
+    listings = (listings * (args.n_requests // len(listings) + 1))[:args.n_requests]
+
+    logger.info(f"Sending {len(listings)} requests from {args.concurrency} clients to {args.url}")
+    results = asyncio.run(load_test(args.url, listings, args.concurrency))
+    logger.info(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Load test the scoring server")
+
+    parser.add_argument("--url", type=str, help="Base URL of the scoring server", default="http://127.0.0.1:8080")
+
+    parser.add_argument(
+        "--dataset", type=str, help="Local path of a dataset the listings are taken from", required=True
+    )
+
+    parser.add_argument("--n_requests", type=int, help="Total number of requests", default=2000)
+
+    parser.add_argument("--concurrency", type=int, help="Number of concurrent clients", default=32)
+
+    args = parser.parse_args()
+
+    go(args)
@@ -0,0 +1,114 @@
+"""
+Cache of the predictions of the scoring server, keyed by a stable hash of the columns the model uses and
+the version of the model. Re-scoring an unchanged listing then skips the preprocessing and the model
+"""
+import collections
+import hashlib
+import json
+import math
+import time
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of predictions, whose entries also expire ttl_s seconds after being stored.
+
+    Keys include the model version, and set_version drops every entry when a different model is
+    loaded, so a prediction is never served by a model other than the one that computed it
+
+    :param max_entries: maximum number of cached predictions (0 disables the cache)
+    :param ttl_s: time to live of an entry in seconds (0 for no expiration)
+    :param columns: columns of a listing the prediction depends on (all columns if None)
+    """
+
+    def __init__(self, max_entries=100000, ttl_s=0.0, columns=None):
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+        self.columns = sorted(columns) if columns else None
+        self.version = None
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def set_version(self, version, columns=None):
+        """
+        Use the cache for a model version (and its feature columns), dropping the entries of any other
+        version
+
+        :return: True if the cache was invalidated
+        """
+        if columns:
+            self.columns = sorted(columns)
+        if version == self.version:
+            return False
+
+        invalidated = self.version is not None
+        if invalidated:
+            self.invalidations += 1
+        self.version = version
+        self._entries.clear()
+        return invalidated
+
+    def key(self, record):
+        """
+        Stable key of a listing: the hash of its normalized model-relevant columns and the model
+        version. Missing columns, None and NaN are all the same null, and whole floats equal ints
+        """
+        columns = self.columns if self.columns is not None else sorted(record)
+        values = [_normalize(record.get(column)) for column in columns]
+        payload = json.dumps([self.version, columns, values], separators=(",", ":"), default=str)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def get(self, key):
+        """
+        Cached prediction for key, or None
+        """
+        if not self.max_entries:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl and time.monotonic() > entry[1]:
+            del self._entries[key]
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, prediction):
+        if not self.max_entries:
+            return
+
+        self._entries[key] = (prediction, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "model_version": self.version,
+        }
+
+
+def _normalize(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
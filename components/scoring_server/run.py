@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+This step serves an exported model over a local HTTP API, predicting the incoming listings in
+micro-batches (see server.py). It runs until interrupted
+"""
+import argparse
+import asyncio
+import functools
+import logging
+
+import mlflow
+import wandb
+
+from prediction_cache import PredictionCache
+from server import LatencyStats, MicroBatcher, ScoringServer
+from wandb_utils.artifact_cache import resolve_artifact, use_artifact
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def load_model(run, artifact_name, current_version=None):
+    """
+    Load the model of an artifact, unless its version is already the one being served
+
+    :param run: current Weights & Biases run
+    :param artifact_name: name of the model artifact, with version or alias (e.g. "random_forest_export:prod")
+    :param current_version: version currently served
+    :return: (pyfunc model or None if the version did not change, version). The version is the
+             digest of the artifact
+    """
+    version = resolve_artifact(run, artifact_name).digest
+    if version == current_version:
+        return None, version
+
+    logger.info(f"Loading {artifact_name} (version {version})")
+    return mlflow.pyfunc.load_model(use_artifact(run, artifact_name)), version
+
+
+def go(args):
+
+    run = wandb.init(job_type="scoring_server")
+    run.config.update(args)
+
+    # The model is loaded once, and again only when the artifact (e.g. the prod alias) changes
+    model, version = load_model(run, args.mlflow_model)
+
+    stats = LatencyStats()
+    cache = PredictionCache(args.cache_size, args.cache_ttl_s) if args.cache_size > 0 else None
+    batcher = MicroBatcher(model, args.max_batch_rows, args.max_wait_ms, stats, cache, version)
+    server = ScoringServer(
+        batcher, args.host, args.port,
+        reload_fn=functools.partial(load_model, run, args.mlflow_model),
+        reload_interval_s=args.reload_interval_s,
+    )
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        snapshot = server.snapshot()
+        logger.info(f"Served {snapshot['requests']} requests ({snapshot['rows']} listings)")
+        for key, value in snapshot.items():
+            run.summary[key] = value
+        run.finish()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve the provided model over a local HTTP API")
+
+    parser.add_argument(
+        "--mlflow_model",
+        type=str,
+        help="Input MLFlow model",
+        required=True
+    )
+
+    parser.add_argument(
+        "--host",
+        type=str,
+        help="Interface to listen on",
+        default="127.0.0.1"
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Port to listen on",
+        default=8080
+    )
+
+    parser.add_argument(
+        "--max_batch_rows",
+        type=int,
+        help="Maximum number of listings predicted at once",
+        default=256
+    )
+
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        help="Maximum time (in milliseconds) a request waits for others to join its micro-batch",
+        default=5.0
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        help="Maximum number of cached predictions (0 disables the prediction cache)",
+        default=100000
+    )
+
+    parser.add_argument(
+        "--cache_ttl_s",
+        type=float,
+        help="Time to live of a cached prediction in seconds (0 for no expiration)",
+        default=3600.0
+    )
+
+    parser.add_argument(
+        "--reload_interval_s",
+        type=float,
+        help="Check for a new version of the model artifact every this many seconds (0 only reloads on "
+             "POST /reload)",
+        default=60.0
+    )
+
+    args = parser.parse_args()
+
+    go(args)
@@ -0,0 +1,387 @@
+"""
+Local HTTP scoring server on top of asyncio. Incoming requests are queued and grouped into micro-batches,
+bounded by a number of rows and a maximum wait, so the model predicts many listings per call instead of
+one: the preprocessing and the tree traversals are vectorized over the whole batch.
+
+Endpoints:
+
+    POST /predict  body: a listing (JSON object) or {"instances": [listing, ...]}
+                   returns {"predictions": [...]}
+    POST /reload   load the model again if its artifact changed (see ScoringServer)
+    GET /metrics   latency percentiles, throughput, batching and prediction cache counters
+    GET /health    {"status": "ok"}
+
+Predictions of listings already scored by the same model are served from a PredictionCache
+"""
+import asyncio
+import collections
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# MLflow schema types cast to numpy dtypes when building the batch DataFrame. JSON numbers would
+# otherwise come out as int64 for whole values and object for columns with only nulls
+_SCHEMA_DTYPES = {"double": "float64", "float": "float32"}
+
+
+class LatencyStats:
+    """
+    Serving counters, with the latency percentiles computed over the last window requests
+
+    :param window: number of recent requests kept for the percentiles and the recent throughput
+    """
+
+    def __init__(self, window=10000):
+        self.started = time.perf_counter()
+        self.latencies = collections.deque(maxlen=window)
+        self.finished = collections.deque(maxlen=window)
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.batches = 0
+        self.batch_rows = 0
+
+    def record_request(self, latency, n_rows, error=False):
+        self.requests += 1
+        self.rows += n_rows
+        self.errors += int(error)
+        self.latencies.append(latency)
+        self.finished.append(time.perf_counter())
+
+    def record_batch(self, n_rows):
+        self.batches += 1
+        self.batch_rows += n_rows
+
+    def snapshot(self):
+        """
+        Current counters, as a JSON-serializable dict (latencies in milliseconds)
+        """
+        uptime = time.perf_counter() - self.started
+        latencies = np.asarray(self.latencies) * 1000
+        stats = {
+            "uptime_s": uptime,
+            "requests": self.requests,
+            "rows": self.rows,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_rows": self.batch_rows / self.batches if self.batches else 0.0,
+            "throughput_rps": self.requests / uptime if uptime > 0 else 0.0,
+        }
+        if len(latencies):
+            stats.update({
+                "latency_p50_ms": float(np.percentile(latencies, 50)),
+                "latency_p99_ms": float(np.percentile(latencies, 99)),
+                "latency_max_ms": float(latencies.max()),
+            })
+        if len(self.finished) > 1 and self.finished[-1] > self.finished[0]:
+            # Throughput over the recent window, which tracks the current load better than the average
+            stats["recent_throughput_rps"] = (len(self.finished) - 1) / (self.finished[-1] - self.finished[0])
+        return stats
+
+
+class MicroBatcher:
+    """
+    Queue of prediction requests served in micro-batches: a batch is sent to the model as soon as it
+    has max_batch_rows rows, or max_wait_ms after its first request
+
+    :param model: MLflow pyfunc model
+    :param max_batch_rows: maximum number of rows predicted at once
+    :param max_wait_ms: maximum time a request waits for other requests to join its batch
+    :param stats: LatencyStats updated with every batch
+    :param cache: optional PredictionCache consulted before queueing the listings
+    :param version: version of the model (e.g. the digest of its artifact), part of the cache keys
+    """
+
+    def __init__(self, model, max_batch_rows=256, max_wait_ms=5.0, stats=None, cache=None, version=None):
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats or LatencyStats()
+        self.cache = cache
+        self.queue = asyncio.Queue()
+        self.set_model(model, version)
+
+    def set_model(self, model, version=None):
+        """
+        Serve another model. The prediction cache is invalidated if the version changed
+        """
+        # A single attribute, so a batch in flight reads either the old or the new model with its schema
+        self._serving = (model, _input_dtypes(model))
+        self.version = version
+        if self.cache is not None:
+            self.cache.set_version(version, _feature_columns(model))
+
+    async def predict(self, records):
+        """
+        Predict a list of listings: the ones in the prediction cache are answered from it, the others
+        are queued and their predictions cached
+
+        :param records: list of dicts {column: value}
+        :return: list of predictions, in the same order
+        """
+        if self.cache is None:
+            return await self._queue(records)
+
+        version = self.version
+        keys = [self.cache.key(record) for record in records]
+        predictions = [self.cache.get(key) for key in keys]
+        missing = [i for i, prediction in enumerate(predictions) if prediction is None]
+        if missing:
+            for i, prediction in zip(missing, await self._queue([records[i] for i in missing])):
+                predictions[i] = prediction
+                # Predictions computed while the model was being replaced are not cached
+                if self.version == version:
+                    self.cache.put(keys[i], prediction)
+        return predictions
+
+    async def _queue(self, records):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((records, future))
+        return await future
+
+    async def run(self):
+        """
+        Serve the queue forever (run it as a task)
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            n_rows = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while n_rows < self.max_batch_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+
+            self.stats.record_batch(n_rows)
+            # The model runs in a worker thread, so the event loop keeps accepting requests meanwhile
+            results = await loop.run_in_executor(None, self._predict_batch, [records for records, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _predict_batch(self, requests):
+        # Predict all the requests at once. If that fails (e.g. one malformed listing), predict them
+        # one by one so only the faulty requests get an error. The whole batch is predicted by the
+        # model being served when it starts, even if set_model is called meanwhile
+        serving = self._serving
+        try:
+            predictions = self._predict(serving, [record for records in requests for record in records])
+        except Exception:
+            return [self._predict_or_error(serving, records) for records in requests]
+
+        results, start = [], 0
+        for records in requests:
+            results.append(predictions[start:start + len(records)])
+            start += len(records)
+        return results
+
+    def _predict_or_error(self, serving, records):
+        try:
+            return self._predict(serving, records)
+        except Exception as e:
+            return e
+
+    @staticmethod
+    def _predict(serving, records):
+        model, schema = serving
+        df = pd.DataFrame.from_records(records)
+        # JSON nulls come as None, while the imputers of the pipeline (as read_csv) use NaN
+        text_columns = df.columns[df.dtypes == object]
+        df[text_columns] = df[text_columns].fillna(np.nan)
+        for column, dtype in schema.items():
+            if column in df.columns:
+                df[column] = df[column].astype(dtype)
+        return np.asarray(model.predict(df), dtype=np.float64).ravel().tolist()
+
+
+def _input_dtypes(model):
+    # {column: dtype} of the floating point inputs of the model signature
+    schema = model.metadata.get_input_schema() if model.metadata is not None else None
+    if schema is None or not schema.has_input_names():
+        return {}
+    return {
+        name: _SCHEMA_DTYPES[dtype.name]
+        for name, dtype in zip(schema.input_names(), schema.input_types())
+        if dtype.name in _SCHEMA_DTYPES
+    }
+
+
+def _feature_columns(model):
+    # Columns the model uses, recorded by the training step in the metadata of the MLmodel
+    metadata = getattr(model.metadata, "metadata", None) or {}
+    return metadata.get("feature_columns")
+
+
+class ScoringServer:
+    """
+    Minimal HTTP/1.1 server (keep-alive, JSON bodies) in front of a MicroBatcher
+
+    :param batcher: MicroBatcher predicting the requests
+    :param host: interface to listen on
+    :param port: port to listen on
+    :param reload_fn: optional function taking the current model version and returning (model, version)
+                      of the latest model, or (None, version) if it did not change. Called on POST
+                      /reload and every reload_interval_s seconds
+    :param reload_interval_s: interval between two checks for a new model (0 only reloads on request)
+    """
+
+    def __init__(self, batcher, host="127.0.0.1", port=8080, reload_fn=None, reload_interval_s=0.0):
+        self.batcher = batcher
+        self.stats = batcher.stats
+        self.host = host
+        self.port = port
+        self.reload_fn = reload_fn
+        self.reload_interval = reload_interval_s
+
+    async def serve(self):
+        """
+        Serve until cancelled
+        """
+        tasks = [asyncio.create_task(self.batcher.run())]
+        if self.reload_fn is not None and self.reload_interval > 0:
+            tasks.append(asyncio.create_task(self._poll_model()))
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Scoring server listening on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def snapshot(self):
+        stats = self.stats.snapshot()
+        if self.batcher.cache is not None:
+            stats["cache"] = self.batcher.cache.stats()
+        return stats
+
+    async def reload(self):
+        """
+        Load the latest model if it changed, which also invalidates the prediction cache
+
+        :return: {"version": ..., "reloaded": ...}
+        """
+        if self.reload_fn is None:
+            return {"version": self.batcher.version, "reloaded": False}
+
+        loop = asyncio.get_running_loop()
+        # Downloading and loading the model can take a while, keep serving the current one meanwhile
+        model, version = await loop.run_in_executor(None, self.reload_fn, self.batcher.version)
+        if model is None:
+            return {"version": version, "reloaded": False}
+
+        logger.info(f"Serving model version {version}")
+        self.batcher.set_model(model, version)
+        return {"version": version, "reloaded": True}
+
+    async def _poll_model(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.warning(f"Could not check for a new model: {e}")
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self._route(method, path, body)
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/metrics":
+            return 200, self.snapshot()
+        if method == "POST" and path == "/reload":
+            try:
+                return 200, await self.reload()
+            except Exception as e:
+                return 500, {"error": str(e)}
+        if method == "POST" and path == "/predict":
+            return await self._predict(body)
+        return 404, {"error": f"Not found: {method} {path}"}
+
+    async def _predict(self, body):
+        start = time.perf_counter()
+        try:
+            payload = json.loads(body)
+            records = payload["instances"] if isinstance(payload, dict) and "instances" in payload else payload
+            records = [records] if isinstance(records, dict) else records
+            if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+                raise ValueError("Expected a listing or {\"instances\": [listing, ...]}")
+        except (ValueError, KeyError) as e:
+            self.stats.record_request(time.perf_counter() - start, 0, error=True)
+            return 400, {"error": str(e)}
+
+        try:
+            predictions = await self.batcher.predict(records)
+        except Exception as e:
+            self.stats.record_request(time.perf_counter() - start, len(records), error=True)
+            return 422, {"error": str(e)}
+
+        self.stats.record_request(time.perf_counter() - start, len(records))
+        return 200, {"predictions": predictions}
+
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 422: "Unprocessable Entity", 500: "Internal Server Error",
+}
+
+
+async def _read_request(reader):
+    # (method, path, lowercase headers, body) of the next request, or None once the client is done
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path.split("?")[0], headers, body
+
+
+def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode()
+    head = (
+        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode() + body)
@@ -0,0 +1,88 @@
+import pytest
+
+import prediction_cache
+from prediction_cache import PredictionCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Clock of the cache, moved forward by the tests
+    now = [1000.0]
+    monkeypatch.setattr(prediction_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", 1.0)
+    cache.put("b", 2.0)
+
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == 1.0
+    cache.put("c", 3.0)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1.0, 3.0)
+    assert cache.stats()["entries"] == 2 and cache.evictions == 1
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = PredictionCache(ttl_s=10)
+    cache.put("a", 1.0)
+
+    clock[0] += 9
+    assert cache.get("a") == 1.0
+    # Reading an entry does not extend its life
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert cache.expirations == 1 and cache.stats()["entries"] == 0
+
+    # Storing it again does
+    cache.put("a", 2.0)
+    clock[0] += 9
+    assert cache.get("a") == 2.0
+
+
+def test_entries_never_expire_without_a_ttl(clock):
+    cache = PredictionCache(ttl_s=0)
+    cache.put("a", 1.0)
+
+    clock[0] += 1e9
+
+    assert cache.get("a") == 1.0
+
+
+def test_disabled_cache():
+    cache = PredictionCache(max_entries=0)
+    cache.put("a", 1.0)
+
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_new_model_version_invalidates_the_cache():
+    cache = PredictionCache()
+    assert not cache.set_version("v1")
+    key = cache.key({"x": 1})
+    cache.put(key, 1.0)
+
+    # Same version: the entries are kept
+    assert not cache.set_version("v1")
+    assert cache.get(key) == 1.0
+
+    assert cache.set_version("v2")
+    assert cache.get(key) is None
+    # The keys depend on the version too
+    assert cache.key({"x": 1}) != key
+    assert cache.invalidations == 1
+
+
+def test_keys_only_depend_on_the_feature_columns():
+    cache = PredictionCache(columns=["x", "y"])
+
+    key = cache.key({"x": 1, "y": "a", "id": 1})
+    # Other columns, missing values (None, NaN or no column) and whole floats are normalized
+    assert cache.key({"y": "a", "x": 1.0, "id": 2}) == key
+    assert cache.key({"x": None}) == cache.key({"x": float("nan"), "y": None}) == cache.key({})
+    assert cache.key({"x": 1.5, "y": "a"}) != key
+    assert cache.key({"x": 1, "y": "b"}) != key
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import types
+
+import pytest
+from mlflow.types import ColSpec, Schema
+
+from prediction_cache import PredictionCache
+from server import MicroBatcher
+
+
+class _Model:
+    """
+    Stand-in for a pyfunc model predicting twice the "x" column, which records the size of every batch
+    """
+
+    metadata = None
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, df):
+        self.batches.append(len(df))
+        if df["x"].isna().any():
+            raise ValueError("missing x")
+        return df["x"] * 2.0
+
+
+async def _serve(batcher, *requests):
+    # Send the requests concurrently to a running batcher
+    task = asyncio.create_task(batcher.run())
+    try:
+        return await asyncio.gather(*(batcher.predict(records) for records in requests), return_exceptions=True)
+    finally:
+        task.cancel()
+
+
+def test_concurrent_requests_share_a_batch():
+    model = _Model()
+    batcher = MicroBatcher(model, max_batch_rows=100, max_wait_ms=50)
+
+    results = asyncio.run(_serve(batcher, [{"x": 1}], [{"x": 2}, {"x": 3}], [{"x": 4}]))
+
+    assert results == [[2.0], [4.0, 6.0], [8.0]]
+    assert model.batches == [4]
+    assert batcher.stats.batches == 1 and batcher.stats.batch_rows == 4
+
+
+def test_batches_are_bounded_by_max_batch_rows():
+    model = _Model()
+    batcher = MicroBatcher(model, max_batch_rows=3, max_wait_ms=50)
+
+    results = asyncio.run(_serve(batcher, *([{"x": i}, {"x": i}] for i in range(4))))
+
+    assert results == [[2.0 * i, 2.0 * i] for i in range(4)]
+    # A batch is closed as soon as it reaches max_batch_rows
+    assert model.batches == [4, 4]
+
+
+def test_a_faulty_request_does_not_fail_its_batch():
+    model = _Model()
+    batcher = MicroBatcher(model, max_batch_rows=100, max_wait_ms=50)
+
+    ok, faulty = asyncio.run(_serve(batcher, [{"x": 1}], [{"x": None}]))
+
+    assert ok == [2.0]
+    assert isinstance(faulty, ValueError)
+
+
+def test_cached_predictions_skip_the_model():
+    model = _Model()
+    cache = PredictionCache()
+    batcher = MicroBatcher(model, max_batch_rows=100, max_wait_ms=1, cache=cache, version="v1")
+
+    async def requests():
+        # The queue of the batcher belongs to the event loop serving it, so everything runs in one loop
+        task = asyncio.create_task(batcher.run())
+        try:
+            first = await batcher.predict([{"x": 1}, {"x": 2}])
+            # Only the listing not scored yet goes to the model
+            second = await batcher.predict([{"x": 2}, {"x": 3}])
+            # Another model version: the cache is invalidated and the listing is scored again
+            batcher.set_model(model, "v2")
+            third = await batcher.predict([{"x": 2}])
+            return first, second, third
+        finally:
+            task.cancel()
+
+    assert asyncio.run(requests()) == ([2.0, 4.0], [4.0, 6.0], [4.0])
+    assert model.batches == [2, 1, 1]
+    assert cache.hits == 1 and cache.invalidations == 1
+
+
+@pytest.mark.parametrize("max_wait_ms", [1, 20])
+def test_a_lone_request_waits_at_most_max_wait(max_wait_ms):
+    batcher = MicroBatcher(_Model(), max_batch_rows=100, max_wait_ms=max_wait_ms)
+
+    async def timed_request():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await _serve(batcher, [{"x": 1}])
+        return loop.time() - start
+
+    assert asyncio.run(timed_request()) < max_wait_ms / 1000 + 0.5
+
+
+def test_reload_during_a_batch():
+    old = _Model()
+    # The new model predicts ten times x, and its signature casts x to float64
+    new = _Model()
+    new.predict = lambda df: df["x"] * 10.0
+    new.metadata = types.SimpleNamespace(get_input_schema=lambda: Schema([ColSpec("double", "x")]), metadata={})
+    batcher = MicroBatcher(old, max_batch_rows=100, max_wait_ms=50, version="v1")
+
+    # The prediction of the whole batch fails (one listing has no x) and blocks until the reload is done
+    in_flight, reloaded = threading.Event(), threading.Event()
+    predict = old.predict
+
+    def blocking_predict(df):
+        if len(df) > 1:
+            in_flight.set()
+            reloaded.wait(5)
+        old.dtypes.append(df["x"].dtype.name)
+        return predict(df)
+
+    old.predict, old.dtypes = blocking_predict, []
+
+    async def requests():
+        task = asyncio.create_task(batcher.run())
+        try:
+            batch = asyncio.gather(batcher.predict([{"x": 1}]), batcher.predict([{"x": None}]), return_exceptions=True)
+            await asyncio.get_running_loop().run_in_executor(None, in_flight.wait, 5)
+            batcher.set_model(new, "v2")
+            reloaded.set()
+            return await batch, await batcher.predict([{"x": 1}])
+        finally:
+            task.cancel()
+
+    (ok, faulty), after = asyncio.run(requests())
+
+    # The requests of the batch are retried one by one with the model (and schema) the batch started with
+    assert ok == [2.0] and isinstance(faulty, ValueError)
+    # Without a schema the listing with x keeps its int64 dtype, the new signature would cast it to float64
+    assert len(old.batches) == 3 and old.dtypes[1] == "int64"
+    assert after == [10.0]
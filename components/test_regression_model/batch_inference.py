@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Batch inference with an exported MLflow model: the dataset is read and predicted in fixed-size batches,
+so memory is bounded by the batch size, and every metric is computed from the single prediction pass
+"""
+import argparse
+import json
+import logging
+
+import mlflow
+import numpy as np
+
+from wandb_utils.dataset_io import iter_dataset, untyped
+from wandb_utils.metrics import evaluate, timed
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+# Columns the metrics are broken down by
+GROUP_COLUMNS = ["neighbourhood_group", "room_type"]
+
+
+def predict_batches(model, dataset_path, batch_size, target="price", group_columns=GROUP_COLUMNS):
+    """
+    Predict a dataset in batches of batch_size rows
+
+    :param model: MLflow pyfunc model
+    :param dataset_path: local path of the dataset (CSV or Parquet)
+    :param batch_size: number of rows predicted at once
+    :param target: column of the target, if present in the dataset. It is not passed to the model
+    :param group_columns: columns kept (as strings) alongside the predictions
+    :return: (predictions, target values or None, dict {column: values} of the group columns present)
+    """
+    y_pred, y_true = [], []
+    groups = {column: [] for column in group_columns}
+    for batch in iter_dataset(dataset_path, batch_size):
+        if target in batch.columns:
+            y_true.append(batch.pop(target).to_numpy())
+        for column in groups:
+            if column in batch.columns:
+                groups[column].append(batch[column].astype(str).to_numpy())
+        # pyfunc enforces the input signature, which has the dates and categories of Parquet datasets as strings
+        y_pred.append(np.asarray(model.predict(untyped(batch)), dtype=np.float64).ravel())
+
+    y_pred = np.concatenate(y_pred) if y_pred else np.empty(0)
+    y_true = np.concatenate(y_true) if y_true else None
+    groups = {column: np.concatenate(values) for column, values in groups.items() if values}
+    return y_pred, y_true, groups
+
+
+def score_dataset(model_path, dataset_path, batch_size, target="price", group_columns=GROUP_COLUMNS):
+    """
+    Load an MLflow model and compute its metrics on a dataset (see wandb_utils.metrics.evaluate)
+
+    :param model_path: local path of the MLflow model
+    :param dataset_path: local path of the dataset, with the target column
+    :param batch_size: number of rows predicted at once
+    :return: (metrics, predictions)
+    """
+    timings = {}
+    with timed(timings, "load"):
+        model = mlflow.pyfunc.load_model(model_path)
+
+    with timed(timings, "predict"):
+        y_pred, y_true, groups = predict_batches(model, dataset_path, batch_size, target, group_columns)
+    if y_true is None:
+        raise ValueError(f"Column {target} not found in {dataset_path}")
+
+    logger.info(
+        f"Predicted {len(y_pred)} rows in {timings['predict_s']:.2f}s (model loaded in {timings['load_s']:.2f}s)"
+    )
+    metrics = {**evaluate(y_true, y_pred, groups), **timings}
+    return metrics, y_pred
+
+
+def go(args):
+    metrics, y_pred = score_dataset(args.mlflow_model, args.dataset, args.batch_size, args.target)
+    logger.info(f"r2: {metrics['r2']}, MAE: {metrics['mae']}, RMSE: {metrics['rmse']}")
+
+    with open(args.output_metrics, "w") as fp:
+        json.dump(metrics, fp, indent=2)
+    logger.info(f"Metrics written to {args.output_metrics}")
+
+    if args.output_predictions != "none":
+        np.savetxt(args.output_predictions, y_pred, header="prediction", comments="")
+        logger.info(f"Predictions written to {args.output_predictions}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Score a dataset with an exported MLflow model")
+
+    parser.add_argument("--mlflow_model", type=str, help="Local path of the MLflow model", required=True)
+
+    parser.add_argument("--dataset", type=str, help="Local path of the dataset (CSV or Parquet)", required=True)
+
+    parser.add_argument("--batch_size", type=int, help="Number of rows predicted at once", default=10000)
+
+    parser.add_argument("--target", type=str, help="Column of the target", default="price")
+
+    parser.add_argument(
+        "--output_metrics", type=str, help="Path of the JSON file the metrics are written to", default="metrics.json"
+    )
+
+    parser.add_argument(
+        "--output_predictions",
+        type=str,
+        help="Path of the file the predictions are written to, or 'none'",
+        default="none",
+    )
+
+    args = parser.parse_args()
+
+    go(args)
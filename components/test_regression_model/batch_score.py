@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Streaming batch scoring with an exported MLflow model: the input dataset is read in chunks, the chunks
+are predicted on a pool of worker processes (each loading the model once) and the predictions are written
+in input order as they complete, so memory stays flat whatever the size of the input
+"""
+import argparse
+import collections
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import mlflow
+import numpy as np
+
+from wandb_utils.dataset_io import DatasetWriter, iter_dataset, untyped
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+# Model of the current worker process, loaded once by _init_worker
+_worker_model = None
+
+
+def _init_worker(model_path):
+    global _worker_model
+    _worker_model = mlflow.pyfunc.load_model(model_path)
+
+
+def _score_chunk(chunk, keep_columns, target=None):
+    # The kept columns of the chunk, with the predictions of the worker model
+    features = chunk.drop(columns=[target]) if target in chunk.columns else chunk
+    scored = chunk[[column for column in keep_columns if column in chunk.columns]].copy()
+    scored["prediction"] = np.asarray(_worker_model.predict(untyped(features)), dtype=np.float64).ravel()
+    return scored
+
+
+def score_chunks(model_path, chunks, keep_columns, n_workers=1, target="price"):
+    """
+    Score an iterable of DataFrames, yielding the scored chunks in input order. With n_workers > 1 the
+    chunks are scored in parallel on a process pool, with at most 2 * n_workers chunks in flight
+
+    :param model_path: local path of the MLflow model
+    :param chunks: iterable of DataFrames
+    :param keep_columns: columns of the input copied to the output (e.g. the listing id)
+    :param n_workers: number of worker processes
+    :param target: column removed from the chunks before predicting, if present
+    :return: iterator of DataFrames with the kept columns and a prediction column
+    """
+    if n_workers <= 1:
+        _init_worker(model_path)
+        for chunk in chunks:
+            yield _score_chunk(chunk, keep_columns, target)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        in_flight = collections.deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(_score_chunk, chunk, keep_columns, target))
+            if len(in_flight) >= 2 * n_workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def go(args):
+    n_workers = args.n_workers if args.n_workers >= 1 else os.cpu_count()
+    keep_columns = [column for column in args.keep_columns.split(",") if column]
+
+    logger.info(f"Scoring {args.dataset} in chunks of {args.chunksize} rows with {n_workers} worker(s)")
+    start = time.perf_counter()
+    n_rows = 0
+    with DatasetWriter(args.output) as writer:
+        for scored in score_chunks(
+            args.mlflow_model, iter_dataset(args.dataset, args.chunksize), keep_columns, n_workers, args.target
+        ):
+            writer.write(scored)
+            n_rows += len(scored)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Scored {n_rows} rows in {elapsed:.1f}s ({n_rows / elapsed:.0f} rows/s) into {args.output}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Score a dataset in chunks with an exported MLflow model")
+
+    parser.add_argument("--mlflow_model", type=str, help="Local path of the MLflow model", required=True)
+
+    parser.add_argument("--dataset", type=str, help="Local path of the input dataset (CSV or Parquet)", required=True)
+
+    parser.add_argument(
+        "--output", type=str, help="Path of the scored dataset (CSV or Parquet, from the extension)", required=True
+    )
+
+    parser.add_argument("--chunksize", type=int, help="Number of rows per chunk", default=50000)
+
+    parser.add_argument(
+        "--n_workers", type=int, help="Number of worker processes (-1 for all available cores)", default=-1
+    )
+
+    parser.add_argument(
+        "--keep_columns",
+        type=str,
+        help="Comma-separated columns of the input copied to the output next to the predictions",
+        default="id",
+    )
+
+    parser.add_argument(
+        "--target", type=str, help="Column of the target, not passed to the model if present", default="price"
+    )
+
+    args = parser.parse_args()
+
+    go(args)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Memory benchmark of the processes serving an exported MLflow model: n_workers processes load the model
+at the same time and predict a sample of a dataset, and the memory of every worker is recorded before
+loading, after loading and after predicting.
+
+RSS counts the shared pages (e.g. a memory-mapped forest, see CompactForest) in full in every process,
+so the benchmark also reports PSS (shared pages divided among the processes using them) and USS (pages
+private to the process), which is what each additional worker actually costs
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+
+import mlflow
+import numpy as np
+
+from wandb_utils.dataset_io import read_dataset, untyped
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def memory_usage():
+    """
+    Memory of the current process in MB: {"rss": ..., "pss": ..., "uss": ...}. PSS and USS are only
+    available on Linux
+    """
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as fp:
+            for line in fp:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                    usage[name] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+
+        return {"rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+    return {"rss": usage["Rss"], "pss": usage["Pss"], "uss": usage["Private_Clean"] + usage["Private_Dirty"]}
+
+
+def _worker(model_path, model_config, sample, barrier, results):
+    before = memory_usage()
+    model = mlflow.pyfunc.load_model(model_path, model_config=model_config or None)
+    loaded = memory_usage()
+    model.predict(sample)
+    # Measure once every worker holds the model, so the shared pages are divided among all of them
+    barrier.wait()
+    predicted = memory_usage()
+    results.put({"before": before, "loaded": loaded, "predicted": predicted})
+    barrier.wait()
+
+
+def run_benchmark(model_path, sample, n_workers, model_config=None):
+    """
+    Load the model in n_workers concurrent processes and record their memory
+
+    :param model_path: local path of the MLflow model
+    :param sample: DataFrame predicted by every worker
+    :param n_workers: number of worker processes
+    :param model_config: optional model_config passed to mlflow.pyfunc.load_model
+    :return: list of {"before", "loaded", "predicted"} memory usages (see memory_usage), one per worker
+    """
+    # Spawned workers start from a fresh interpreter, so nothing is shared through fork
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(n_workers)
+    results = context.Queue()
+    workers = [
+        context.Process(target=_worker, args=(model_path, model_config, sample, barrier, results))
+        for _ in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    measures = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return measures
+
+
+def go(args):
+    sample = untyped(read_dataset(args.dataset).drop(columns=["price"], errors="ignore").head(args.sample_size))
+    model_config = json.loads(args.model_config)
+
+    logger.info(f"Loading {args.mlflow_model} in {args.n_workers} worker(s) (model_config={model_config})")
+    measures = run_benchmark(args.mlflow_model, sample, args.n_workers, model_config)
+
+    for i, measure in enumerate(measures):
+        logger.info(
+            f"Worker {i}: " + ", ".join(
+                f"{stage} " + " ".join(f"{name}={value:.0f}MB" for name, value in usage.items())
+                for stage, usage in measure.items()
+            )
+        )
+
+    summary = {
+        f"{stage}_{name}_mb": float(np.mean([measure[stage][name] for measure in measures]))
+        for stage in ("before", "predicted") for name in measures[0][stage]
+    }
+    summary["total_pss_mb"] = float(sum(measure["predicted"].get("pss", np.nan) for measure in measures))
+    logger.info(f"Mean per worker and total: {json.dumps(summary)}")
+
+    if args.output != "none":
+        with open(args.output, "w") as fp:
+            json.dump({"workers": measures, "summary": summary}, fp, indent=2)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Memory benchmark of the processes serving a model")
+
+    parser.add_argument("--mlflow_model", type=str, help="Local path of the MLflow model", required=True)
+
+    parser.add_argument(
+        "--dataset", type=str, help="Local path of a dataset the predicted sample is taken from", required=True
+    )
+
+    parser.add_argument("--n_workers", type=int, help="Number of worker processes", default=4)
+
+    parser.add_argument("--sample_size", type=int, help="Number of rows predicted by every worker", default=1000)
+
+    parser.add_argument(
+        "--model_config",
+        type=str,
+        help="JSON model_config passed when loading the model, e.g. '{\"mmap\": false}' for the compact "
+             "forest to read its arrays in memory",
+        default="{}",
+    )
+
+    parser.add_argument("--output", type=str, help="Path of the JSON results, or 'none'", default="none")
+
+    args = parser.parse_args()
+
+    go(args)
@@ -5,11 +5,10 @@ This step takes the best model, tagged with the "prod" tag, and tests it against
 import argparse
 import logging
 import wandb
-import mlflow
-import pandas as pd
-from sklearn.metrics import mean_absolute_error
 
-from wandb_utils.log_artifact import log_artifact
+from batch_inference import GROUP_COLUMNS, score_dataset
+from wandb_utils.artifact_cache import use_artifact, use_artifact_file
+from wandb_utils.metrics import metrics_table
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
@@ -24,30 +23,29 @@ def go(args):
     logger.info("Downloading artifacts")
     # Download input artifact. This will also log that this script is using this
     # particular version of the artifact
-    model_local_path = run.use_artifact(args.mlflow_model).download()
+    model_local_path = use_artifact(run, args.mlflow_model)
 
     # Download test dataset
-    test_dataset_path = run.use_artifact(args.test_dataset).file()
-
-    # Read test dataset
-    X_test = pd.read_csv(test_dataset_path)
-    y_test = X_test.pop("price")
+    test_dataset_path = use_artifact_file(run, args.test_dataset)
 
     logger.info("Loading model and performing inference on test set")
-    sk_pipe = mlflow.sklearn.load_model(model_local_path)
-    y_pred = sk_pipe.predict(X_test)
-
-    logger.info("Scoring")
-    r_squared = sk_pipe.score(X_test, y_test)
-
-    mae = mean_absolute_error(y_test, y_pred)
+    # One prediction pass in batches of batch_size rows, every metric is computed from it. The pyfunc
+    # flavor loads both the scikit-learn pipeline and the compact forest export
+    metrics, _ = score_dataset(model_local_path, test_dataset_path, args.batch_size)
 
-    logger.info(f"Score: {r_squared}")
-    logger.info(f"MAE: {mae}")
+    logger.info(f"Score: {metrics['r2']}")
+    logger.info(f"MAE: {metrics['mae']}")
+    logger.info(f"RMSE: {metrics['rmse']}")
 
-    # Log MAE and r2
-    run.summary['r2'] = r_squared
-    run.summary['mae'] = mae
+    # Log MAE, r2 and RMSE, with their breakdown by neighbourhood group and room type
+    run.summary['r2'] = metrics['r2']
+    run.summary['mae'] = metrics['mae']
+    run.summary['rmse'] = metrics['rmse']
+    run.summary['predict_time_s'] = metrics['predict_s']
+    for column in GROUP_COLUMNS:
+        if f"by_{column}" in metrics:
+            names, rows = metrics_table(metrics, column)
+            run.log({f"metrics_by_{column}": wandb.Table(columns=names, data=rows)})
 
 
 if __name__ == "__main__":
@@ -56,18 +54,25 @@ if __name__ == "__main__":
 
     parser.add_argument(
         "--mlflow_model",
-        type=str, 
+        type=str,
         help="Input MLFlow model",
         required=True
     )
 
     parser.add_argument(
         "--test_dataset",
-        type=str, 
+        type=str,
         help="Test dataset",
         required=True
     )
 
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Number of test rows predicted at once",
+        default=10000,
+    )
+
     args = parser.parse_args()
 
     go(args)
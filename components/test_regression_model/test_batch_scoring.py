@@ -0,0 +1,83 @@
+"""
+Scoring of a model trained by the train_random_forest step, on CSV and Parquet datasets
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import step_runner
+from batch_inference import score_dataset
+from batch_score import score_chunks
+from wandb_utils.dataset_io import iter_dataset, read_dataset, write_dataset
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+TRAIN_STEP_DIR = os.path.join(ROOT, "src", "train_random_forest")
+CLEAN_SAMPLE = os.path.join(ROOT, "src", "basic_cleaning", "clean_sample.csv")
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    # The same test set in both formats. In Parquet, last_review is a datetime column and the
+    # neighbourhood group and room type are categories
+    df = read_dataset(CLEAN_SAMPLE).head(3000)
+    assert df["last_review"].isna().any()
+    paths = {}
+    for fmt in ("csv", "parquet"):
+        paths[fmt] = str(tmp_path / f"test_data.{fmt}")
+        write_dataset(df, paths[fmt])
+    return paths
+
+
+@pytest.fixture(params=["sklearn", "compact"])
+def model_path(request, local_store, datasets, tmp_path):
+    # Trained on the Parquet dataset, so the pipeline saw the typed columns
+    local_store.log_artifact("trainval_data.parquet", [datasets["parquet"]])
+    step_dir = shutil.copytree(
+        TRAIN_STEP_DIR, tmp_path / "train_random_forest", ignore=shutil.ignore_patterns("__pycache__")
+    )
+    rf_config = tmp_path / "rf_config.json"
+    rf_config.write_text(json.dumps({"n_estimators": 10, "max_depth": 6, "n_jobs": 1}))
+
+    step_runner.run_step("train_random_forest", str(step_dir), {
+        "trainval_artifact": "trainval_data.parquet:latest",
+        "val_size": 0.2,
+        "random_seed": 42,
+        "stratify_by": "neighbourhood_group",
+        "rf_config": str(rf_config),
+        "engine": "random_forest",
+        "hgb_config": "none",
+        "max_tfidf_features": 5,
+        "dtype": "float64",
+        "n_estimators_step": 0,
+        "patience": 0,
+        "tol": 0.0,
+        "sweep_config": "none",
+        "export_format": request.param,
+        "latency_budget_config": "none",
+        "output_artifact": "random_forest_export",
+    })
+    return str(step_dir / "random_forest_dir")
+
+
+def test_score_dataset_from_parquet(model_path, datasets):
+    csv_metrics, csv_pred = score_dataset(model_path, datasets["csv"], batch_size=1000)
+    parquet_metrics, parquet_pred = score_dataset(model_path, datasets["parquet"], batch_size=1000)
+
+    np.testing.assert_allclose(parquet_pred, csv_pred)
+    assert parquet_metrics["mae"] == pytest.approx(csv_metrics["mae"])
+    assert set(parquet_metrics["by_room_type"]) == set(csv_metrics["by_room_type"])
+
+
+def test_score_chunks_from_parquet(model_path, datasets):
+    scored = {
+        fmt: pd.concat(score_chunks(model_path, iter_dataset(path, 1000), ["id"]), ignore_index=True)
+        for fmt, path in datasets.items()
+    }
+
+    pd.testing.assert_frame_equal(scored["parquet"], scored["csv"])
+    assert np.isfinite(scored["parquet"]["prediction"]).all()
@@ -4,11 +4,13 @@ This script splits the provided dataframe in test and remainder
 """
 import argparse
 import logging
-import pandas as pd
+import os
 import wandb
 import tempfile
 from sklearn.model_selection import train_test_split
 from wandb_utils.log_artifact import log_artifact
+from wandb_utils.artifact_cache import use_artifact_file
+from wandb_utils.dataset_io import dataset_format, read_dataset, write_dataset
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -22,9 +24,12 @@ def go(args):
     # Download input artifact. This will also note that this script is using this
     # particular version of the artifact
     logger.info(f"Fetching artifact {args.input}")
-    artifact_local_path = run.use_artifact(args.input).file()
+    artifact_local_path = use_artifact_file(run, args.input)
 
-    df = pd.read_csv(artifact_local_path)
+    df = read_dataset(artifact_local_path)
+
+    # The splits are written in the same format as the input artifact
+    fmt = dataset_format(artifact_local_path)
 
     logger.info("Splitting trainval and test")
     trainval, test = train_test_split(
@@ -36,16 +41,17 @@ def go(args):
 
     # Save to output files
     for df, k in zip([trainval, test], ['trainval', 'test']):
-        logger.info(f"Uploading {k}_data.csv dataset")
-        with tempfile.NamedTemporaryFile("w") as fp:
+        logger.info(f"Uploading {k}_data.{fmt} dataset")
+        with tempfile.TemporaryDirectory() as tmp_dir:
 
-            df.to_csv(fp.name, index=False)
+            split_path = os.path.join(tmp_dir, f"{k}_data.{fmt}")
+            write_dataset(df, split_path)
 
             log_artifact(
-                f"{k}_data.csv",
+                f"{k}_data.{fmt}",
                 f"{k}_data",
                 f"{k} split of dataset",
-                fp.name,
+                split_path,
                 run,
             )
 
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from wandb_utils.sanitize_path import sanitize_path
+
+
+logger = logging.getLogger(__name__)
+
+# Default location and size limit of the local cache. Both can be overridden through the environment,
+# which is read when the cache is created (main.py sets it after importing this module)
+CACHE_DIR_ENV = "WANDB_UTILS_CACHE_DIR"
+CACHE_SIZE_ENV = "WANDB_UTILS_CACHE_SIZE"
+DEFAULT_CACHE_DIR = "~/.cache/wandb_utils/artifacts"
+DEFAULT_CACHE_SIZE = 10 * 1024 ** 3
+
+# When set, artifacts are resolved against this local directory instead of the W&B service
+LOCAL_STORE_ENV = "WANDB_UTILS_ARTIFACT_STORE"
+
+
+def _dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files
+    )
+
+
+def _list_files(path):
+    return sorted(
+        os.path.join(root, f) for root, _, files in os.walk(path) for f in files
+    )
+
+
+class ArtifactCache:
+    """
+    Local content-addressed cache of downloaded artifacts. Every entry is a directory named after the
+    artifact digest, so the same content is downloaded once no matter how many steps (or versions and
+    aliases) refer to it. When the cache grows beyond max_size bytes the least recently used entries
+    are evicted.
+
+    :param cache_dir: directory holding the cache entries (from the environment if None)
+    :param max_size: maximum size of the cache in bytes (from the environment if None)
+    """
+
+    def __init__(self, cache_dir=None, max_size=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+        if max_size is None:
+            max_size = int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE))
+        self.cache_dir = sanitize_path(cache_dir)
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry(self, digest):
+        return os.path.join(self.cache_dir, digest)
+
+    def get(self, digest):
+        """
+        Return the path of the cached entry for digest (or None on a miss), marking it as recently used
+        """
+        path = self._entry(digest)
+        if not os.path.isdir(path):
+            return None
+        # The modification time of the entry tracks its last use for the LRU eviction
+        os.utime(path)
+        return path
+
+    def put(self, digest, download_fn):
+        """
+        Populate the entry for digest by calling download_fn(root), which must write the artifact
+        content into the directory root. The entry is published atomically, so concurrent steps
+        never see a partial download.
+
+        :return: path of the cached entry
+        """
+        path = self._entry(digest)
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            download_fn(tmp_dir)
+            os.rename(tmp_dir, path)
+        except OSError:
+            # Another process published the same digest first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self.evict(keep=digest)
+        return path
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits in max_size. The entry
+        named keep (the one just added) is never removed.
+        """
+        entries = [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if not name.startswith(".")
+        ]
+        sizes = {entry: _dir_size(entry) for entry in entries}
+        total = sum(sizes.values())
+
+        for entry in sorted(entries, key=os.path.getmtime):
+            if total <= self.max_size:
+                break
+            if os.path.basename(entry) == keep:
+                continue
+            logger.info(f"Evicting {os.path.basename(entry)} from the artifact cache")
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= sizes[entry]
+
+
+class LocalArtifact:
+    """
+    Stand-in for a W&B artifact stored in a LocalArtifactStore. It exposes the subset of the
+    wandb.Artifact interface used by the pipeline (digest, download and file)
+    """
+
+    def __init__(self, path, digest):
+        self.path = path
+        self.digest = digest
+
+    def download(self, root=None):
+        if root is None:
+            return self.path
+        shutil.copytree(self.path, root, dirs_exist_ok=True)
+        return root
+
+    def file(self, root=None):
+        files = _list_files(self.download(root))
+        if len(files) != 1:
+            raise ValueError("This method can only be called on artifacts containing exactly one file")
+        return files[0]
+
+
+class LocalArtifactStore:
+    """
+    Directory-backed stand-in for the W&B artifact service, usable offline and in tests. Artifacts
+    are stored as <root>/<name>/v<N>/ with aliases recorded in <root>/<name>/aliases.json.
+
+    It can be passed wherever the pipeline expects a wandb run for resolving artifacts.
+
+    :param root: directory of the store
+    """
+
+    def __init__(self, root):
+        self.root = sanitize_path(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _aliases(self, name):
+        aliases_path = os.path.join(self.root, name, "aliases.json")
+        if not os.path.exists(aliases_path):
+            return {}
+        with open(aliases_path) as fp:
+            return json.load(fp)
+
+    def log_artifact(self, name, paths, aliases=("latest",)):
+        """
+        Store the provided files as a new version of the artifact name
+
+        :param name: name of the artifact
+        :param paths: list of local files to include in the artifact
+        :param aliases: aliases pointing to the new version
+        :return: the new version (e.g. "v0")
+        """
+        artifact_dir = os.path.join(self.root, name)
+        os.makedirs(artifact_dir, exist_ok=True)
+        version = f"v{sum(v.startswith('v') for v in os.listdir(artifact_dir))}"
+        version_dir = os.path.join(artifact_dir, version)
+        os.makedirs(version_dir)
+        for path in paths:
+            shutil.copy(path, version_dir)
+
+        all_aliases = self._aliases(name)
+        all_aliases.update({alias: version for alias in aliases})
+        with open(os.path.join(self.root, name, "aliases.json"), "w") as fp:
+            json.dump(all_aliases, fp)
+
+        return version
+
+    def use_artifact(self, artifact_name):
+        """
+        Resolve a name in the form "name:version" or "name:alias" (default alias: latest)
+        """
+        name, _, ref = artifact_name.partition(":")
+        version = self._aliases(name).get(ref or "latest", ref)
+        path = os.path.join(self.root, name, version)
+        if not os.path.isdir(path):
+            raise ValueError(f"Artifact {artifact_name} not found in {self.root}")
+
+        md5 = hashlib.md5()
+        for f in _list_files(path):
+            md5.update(os.path.relpath(f, path).encode())
+            with open(f, "rb") as fp:
+                for block in iter(lambda: fp.read(1 << 20), b""):
+                    md5.update(block)
+
+        return LocalArtifact(path, md5.hexdigest())
+
+
+_default_cache = None
+
+
+def get_cache():
+    """
+    Return the process-wide artifact cache, configured from the environment. The cache is created on
+    first use, and again if the environment points it to another location since
+    """
+    global _default_cache
+    if _default_cache is None or (
+        CACHE_DIR_ENV in os.environ and sanitize_path(os.environ[CACHE_DIR_ENV]) != _default_cache.cache_dir
+    ):
+        _default_cache = ArtifactCache()
+    return _default_cache
+
+
+def resolve_artifact(wandb_run, artifact_name):
+    """
+    Declare the use of an artifact in the current run and return it, without downloading its content.
+    If the environment variable WANDB_UTILS_ARTIFACT_STORE is set, the artifact is resolved from that
+    local store instead of W&B
+
+    :param wandb_run: current Weights & Biases run (or a LocalArtifactStore)
+    :param artifact_name: name of the artifact, including version or alias (e.g. "sample.csv:latest")
+    :return: the artifact (wandb.Artifact or LocalArtifact)
+    """
+    if os.environ.get(LOCAL_STORE_ENV):
+        wandb_run = LocalArtifactStore(os.environ[LOCAL_STORE_ENV])
+
+    # This also records in W&B that this run used this particular version of the artifact
+    return wandb_run.use_artifact(artifact_name)
+
+
+def use_artifact(wandb_run, artifact_name, cache=None):
+    """
+    Declare the use of an artifact in the current run and return the local directory holding its
+    content. The artifact is downloaded only if its digest is not already in the local cache.
+
+    If the environment variable WANDB_UTILS_ARTIFACT_STORE is set, the artifact is resolved from that
+    local store instead of W&B
+
+    :param wandb_run: current Weights & Biases run (or a LocalArtifactStore)
+    :param artifact_name: name of the artifact, including version or alias (e.g. "sample.csv:latest")
+    :param cache: ArtifactCache to use (the process-wide cache if None)
+    :return: path to the directory containing the artifact files
+    """
+    cache = cache or get_cache()
+    artifact = resolve_artifact(wandb_run, artifact_name)
+
+    path = cache.get(artifact.digest)
+    if path is None:
+        logger.info(f"Downloading {artifact_name} into the artifact cache")
+        path = cache.put(artifact.digest, lambda root: artifact.download(root=root))
+    else:
+        logger.info(f"Using cached copy of {artifact_name}")
+
+    return path
+
+
+def use_artifact_file(wandb_run, artifact_name, cache=None):
+    """
+    Same as use_artifact, for artifacts containing a single file
+
+    :return: path to the artifact file
+    """
+    files = _list_files(use_artifact(wandb_run, artifact_name, cache))
+    if len(files) != 1:
+        raise ValueError(f"Artifact {artifact_name} contains {len(files)} files, expected exactly one")
+    return files[0]
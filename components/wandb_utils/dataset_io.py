@@ -0,0 +1,268 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Supported on-disk formats for the datasets exchanged between pipeline steps
+FORMATS = ("csv", "parquet")
+
+# Columns kept with a typed representation in the columnar format
+CATEGORICAL_COLUMNS = ["neighbourhood_group", "room_type"]
+DATE_COLUMNS = ["last_review"]
+
+# Compact in-memory dtypes used by read_dataset(downcast=True): counts as int32 (float32 if they have
+# missing values), the other numeric features as float32 and the low-cardinality strings as categories
+COUNT_COLUMNS = ["minimum_nights", "number_of_reviews", "calculated_host_listings_count", "availability_365"]
+FLOAT_COLUMNS = ["reviews_per_month", "latitude", "longitude"]
+
+# DataFrames written in this process, keyed by the digest of the file they were written to. Only
+# populated when the steps run in-process (see share_in_memory)
+_shared_frames = None
+
+
+def share_in_memory(enabled=True):
+    """
+    Keep every dataset written in this process in memory, so that a later step reading the same file
+    content (e.g. through the artifact cache) gets the DataFrame without parsing the file again
+
+    :param enabled: whether to share DataFrames between steps
+    :return: None
+    """
+    global _shared_frames
+    _shared_frames = {} if enabled else None
+
+
+def _file_digest(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def dataset_format(path):
+    """
+    Detect the format of a dataset from its file extension
+
+    :param path: path (or artifact name) of the dataset
+    :return: one of FORMATS
+    """
+    ext = os.path.splitext(path.split(":")[0])[1].lstrip(".").lower()
+    if ext in ("parquet", "pq", "arrow"):
+        return "parquet"
+    return "csv"
+
+
+def dataset_columns(path):
+    """
+    Return the column names of a dataset without loading its content
+
+    :param path: local path of the dataset
+    :return: list of column names, in file order
+    """
+    if dataset_format(path) == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path).names
+
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_dataset(path, columns=None, dtype=None, downcast=False):
+    """
+    Read a dataset written by one of the pipeline steps, detecting the format from the file extension
+
+    :param path: local path of the dataset
+    :param columns: optional list of columns to load (all columns if None)
+    :param dtype: optional dtype (or dict of dtypes per column) to load CSV columns with. Parquet
+                  columns keep the dtype stored in the file
+    :param downcast: load the known feature columns with compact dtypes (see COUNT_COLUMNS and
+                     FLOAT_COLUMNS), roughly halving the memory taken by the numeric columns
+    :return: pandas DataFrame
+    """
+    if _shared_frames is not None:
+        df = _shared_frames.get(_file_digest(path))
+        if df is not None:
+            # Steps modify their input in place, so each of them gets its own copy
+            df = (df if columns is None else df[columns]).copy()
+            return _downcast(df) if downcast else df
+
+    if dataset_format(path) == "parquet":
+        df = _normalize_missing(pd.read_parquet(path, columns=columns))
+    else:
+        if downcast and dtype is None:
+            # Parse the floats and the categories directly into their compact dtypes
+            dtype = {
+                **{col: "float32" for col in FLOAT_COLUMNS},
+                **{col: "category" for col in CATEGORICAL_COLUMNS},
+            }
+        df = pd.read_csv(path, usecols=columns, dtype=dtype)
+
+    return _downcast(df) if downcast else df
+
+
+def write_dataset(df, path):
+    """
+    Write a dataset in the format given by the extension of path. In the columnar format the
+    date columns are stored as datetime and the categorical columns as categories, so that the
+    consumers do not have to parse them again
+
+    :param df: pandas DataFrame to write
+    :param path: local destination path
+    :return: None
+    """
+    if dataset_format(path) == "parquet":
+        df = _typed(df)
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+    if _shared_frames is not None:
+        _shared_frames[_file_digest(path)] = df.reset_index(drop=True)
+
+
+def iter_dataset(path, chunksize, columns=None):
+    """
+    Iterate over a dataset in chunks of at most chunksize rows, so that memory usage is bounded by
+    the chunk size instead of the dataset size.
+
+    For CSV files the dtypes of the numeric columns are resolved over the whole file first (reading
+    only those columns), so every chunk gets the dtypes a full read_csv would produce
+
+    :param path: local path of the dataset
+    :param chunksize: number of rows per chunk
+    :param columns: optional list of columns to load (all columns if None)
+    :return: iterator of pandas DataFrames
+    """
+    if dataset_format(path) == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield _normalize_missing(batch.to_pandas())
+        return
+
+    dtypes = _csv_dtypes(path, chunksize, columns)
+    yield from pd.read_csv(path, chunksize=chunksize, usecols=columns, dtype=dtypes)
+
+
+class DatasetWriter:
+    """
+    Write a dataset incrementally, one chunk at a time, in the format given by the extension of path.
+    Use it as a context manager:
+
+        with DatasetWriter("clean_sample.csv") as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+
+    :param path: local destination path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet_writer = None
+        self._schema = None
+        self._first = True
+
+    def write(self, df):
+        if dataset_format(self.path) == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(_typed(df), schema=self._schema, preserve_index=False)
+            if self._parquet_writer is None:
+                self._schema = table.schema
+                self._parquet_writer = pq.ParquetWriter(self.path, self._schema)
+            self._parquet_writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def untyped(df):
+    """
+    Representation of the typed columns of the columnar format as in the CSV format: dates as
+    YYYY-MM-DD strings and categories as strings, missing values as NaN. This is what the input
+    signature of the exported models expects, whatever the format of the training dataset
+
+    :param df: pandas DataFrame read from either format
+    :return: pandas DataFrame (df itself if it has no typed column)
+    """
+    typed = [
+        col for col in df.columns
+        if isinstance(df[col].dtype, pd.CategoricalDtype) or pd.api.types.is_datetime64_any_dtype(df[col])
+    ]
+    if not typed:
+        return df
+
+    df = df.copy(deep=False)
+    for col in typed:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+        else:
+            df[col] = df[col].dt.strftime("%Y-%m-%d")
+    return _normalize_missing(df)
+
+
+def _typed(df):
+    # Typed representation of the date and categorical columns used in the columnar format
+    df = df.copy(deep=False)
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def _downcast(df):
+    for col in df.columns:
+        if col in COUNT_COLUMNS:
+            df[col] = df[col].astype("int32" if df[col].notna().all() else "float32")
+        elif col in FLOAT_COLUMNS:
+            df[col] = df[col].astype("float32")
+        elif col in CATEGORICAL_COLUMNS:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def _normalize_missing(df):
+    # Arrow returns missing strings as None, while read_csv (and the sklearn imputers) use NaN
+    text_columns = df.columns[df.dtypes == object]
+    df[text_columns] = df[text_columns].fillna(np.nan)
+    return df
+
+
+def _csv_dtypes(path, chunksize, columns=None):
+    # Chunks are parsed independently, so a chunk without missing values would read as int64 a
+    # column that is float64 in the whole file (and be written back differently). Resolve the
+    # dtype of every numeric column over the whole file, reading only those columns
+    head = pd.read_csv(path, nrows=chunksize, usecols=columns)
+    numeric = [col for col in head.columns if pd.api.types.is_numeric_dtype(head[col])]
+    if not numeric:
+        return None
+
+    dtypes = {}
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=numeric):
+        for col in numeric:
+            dtype = chunk[col].dtype
+            if col not in dtypes or dtypes[col] == dtype:
+                dtypes[col] = dtype
+            elif pd.api.types.is_numeric_dtype(dtype) and pd.api.types.is_numeric_dtype(dtypes[col]):
+                dtypes[col] = np.result_type(dtypes[col], dtype)
+            else:
+                dtypes[col] = np.dtype(object)
+    return dtypes
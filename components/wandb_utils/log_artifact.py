@@ -1,8 +1,12 @@
+import os
+
 import wandb
 import mlflow
 
+from wandb_utils.artifact_cache import LOCAL_STORE_ENV, LocalArtifactStore
+
 
-def log_artifact(artifact_name, artifact_type, artifact_description, filename, wandb_run):
+def log_artifact(artifact_name, artifact_type, artifact_description, filename, wandb_run, aliases=None):
     """
     Log the provided filename as an artifact in W&B, and add the artifact path to the MLFlow run
     so it can be retrieved by subsequent steps in a pipeline
@@ -10,18 +14,28 @@ def log_artifact(artifact_name, artifact_type, artifact_description, filename, w
     :param artifact_name: name for the artifact
     :param artifact_type: type for the artifact (just a string like "raw_data", "clean_data" and so on)
     :param artifact_description: a brief description of the artifact
-    :param filename: local filename for the artifact
+    :param filename: local filename for the artifact, or a directory whose files are all logged
     :param wandb_run: current Weights & Biases run
+    :param aliases: aliases of the new version (default: latest)
     :return: None
     """
+    # Offline mode: store the artifact in the local stand-in store instead of W&B
+    if os.environ.get(LOCAL_STORE_ENV):
+        paths = sorted(os.path.join(filename, f) for f in os.listdir(filename)) if os.path.isdir(filename) else [filename]
+        LocalArtifactStore(os.environ[LOCAL_STORE_ENV]).log_artifact(artifact_name, paths, aliases or ("latest",))
+        return
+
     # Log to W&B
     artifact = wandb.Artifact(
         artifact_name,
         type=artifact_type,
         description=artifact_description,
     )
-    artifact.add_file(filename)
-    wandb_run.log_artifact(artifact)
+    if os.path.isdir(filename):
+        artifact.add_dir(filename)
+    else:
+        artifact.add_file(filename)
+    wandb_run.log_artifact(artifact, aliases=aliases)
     # We need to call this .wait() method before we can use the
     # version below. This will wait until the artifact is loaded into W&B and a
     # version is assigned
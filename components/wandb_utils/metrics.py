@@ -0,0 +1,86 @@
+import contextlib
+import time
+
+import numpy as np
+import pandas as pd
+
+
+@contextlib.contextmanager
+def timed(timings, stage):
+    """
+    Context manager adding the wall time of its block to timings[f"{stage}_s"]
+
+    :param timings: dict of timings, updated in place
+    :param stage: name of the stage (e.g. "preprocess" or "predict")
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[f"{stage}_s"] = timings.get(f"{stage}_s", 0.0) + time.perf_counter() - start
+
+
+def regression_metrics(y_true, y_pred):
+    """
+    Compute the regression metrics of a vector of predictions
+
+    :param y_true: true values of the target
+    :param y_pred: predicted values, in the same order
+    :return: dict with n, r2, mae, rmse and bias (mean residual, y_pred - y_true)
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    residuals = np.asarray(y_pred, dtype=np.float64) - y_true
+
+    ss_tot = np.sum((y_true - y_true.mean()) ** 2)
+    return {
+        "n": int(len(y_true)),
+        "r2": float(1 - np.sum(residuals ** 2) / ss_tot) if ss_tot > 0 else float("nan"),
+        "mae": float(np.mean(np.abs(residuals))),
+        "rmse": float(np.sqrt(np.mean(residuals ** 2))),
+        "bias": float(residuals.mean()),
+    }
+
+
+def grouped_metrics(y_true, y_pred, groups):
+    """
+    Compute the regression metrics (see regression_metrics) of every group of rows
+
+    :param y_true: true values of the target
+    :param y_pred: predicted values, in the same order
+    :param groups: group label of every row (e.g. the neighbourhood_group column)
+    :return: dict {group: metrics}, sorted by group
+    """
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    codes, labels = pd.factorize(pd.Series(groups).astype(str), sort=True)
+
+    return {
+        label: regression_metrics(y_true[codes == i], y_pred[codes == i]) for i, label in enumerate(labels)
+    }
+
+
+def evaluate(y_true, y_pred, groups=None):
+    """
+    Compute the regression metrics of a single prediction vector, overall and broken down by groups
+
+    :param y_true: true values of the target
+    :param y_pred: predicted values, in the same order
+    :param groups: optional dict {column name: group label of every row}
+    :return: dict of the overall metrics, with a "by_<column>" entry per grouping column (see
+             grouped_metrics)
+    """
+    metrics = regression_metrics(y_true, y_pred)
+    for column, values in (groups or {}).items():
+        metrics[f"by_{column}"] = grouped_metrics(y_true, y_pred, values)
+    return metrics
+
+
+def metrics_table(metrics, column):
+    """
+    Rows of the breakdown of metrics (see evaluate) by one grouping column, for a W&B table
+
+    :return: (column names, list of rows)
+    """
+    names = [column, "n", "r2", "mae", "rmse", "bias"]
+    rows = [[group] + [values[name] for name in names[1:]] for group, values in metrics[f"by_{column}"].items()]
+    return names, rows
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from wandb_utils import artifact_cache
+from wandb_utils.artifact_cache import ArtifactCache, LocalArtifactStore, use_artifact_file
+
+
+def _writer(content):
+    def download(root):
+        with open(os.path.join(root, "data.csv"), "w") as fp:
+            fp.write(content)
+    return download
+
+
+def _age(cache, digest, seconds_ago):
+    # Pretend the entry was last used seconds_ago
+    path = os.path.join(cache.cache_dir, digest)
+    mtime = os.path.getmtime(path) - seconds_ago
+    os.utime(path, (mtime, mtime))
+
+
+def test_put_and_get(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+
+    assert cache.get("abc") is None
+    path = cache.put("abc", _writer("x,y\n"))
+
+    assert cache.get("abc") == path
+    with open(os.path.join(path, "data.csv")) as fp:
+        assert fp.read() == "x,y\n"
+    # No partial download is left behind
+    assert sorted(os.listdir(tmp_path)) == ["abc"]
+
+
+def test_failed_download_leaves_no_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+
+    def download(root):
+        raise RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError):
+        cache.put("abc", download)
+    assert os.listdir(tmp_path) == []
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # Room for two entries of 100 bytes
+    cache = ArtifactCache(str(tmp_path), max_size=250)
+    cache.put("a", _writer("a" * 100))
+    cache.put("b", _writer("b" * 100))
+    _age(cache, "a", 20)
+    _age(cache, "b", 10)
+
+    # Using a makes b the least recently used entry
+    cache.get("a")
+    cache.put("c", _writer("c" * 100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_never_evicts_the_new_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_size=50)
+    cache.put("a", _writer("a" * 10))
+    _age(cache, "a", 10)
+
+    cache.put("b", _writer("b" * 100))
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+
+
+def test_local_store_aliases_and_digests(tmp_path):
+    store = LocalArtifactStore(str(tmp_path / "store"))
+    data = tmp_path / "data.csv"
+
+    data.write_text("x\n1\n")
+    assert store.log_artifact("data.csv", [str(data)]) == "v0"
+    data.write_text("x\n2\n")
+    assert store.log_artifact("data.csv", [str(data)], aliases=("latest", "reference")) == "v1"
+
+    latest = store.use_artifact("data.csv")
+    assert latest.path == store.use_artifact("data.csv:v1").path == store.use_artifact("data.csv:reference").path
+    assert store.use_artifact("data.csv:v0").digest != latest.digest
+
+    with pytest.raises(ValueError):
+        store.use_artifact("data.csv:v2")
+
+
+def test_use_artifact_file_downloads_each_digest_once(tmp_path):
+    store = LocalArtifactStore(str(tmp_path / "store"))
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    data = tmp_path / "data.csv"
+    data.write_text("x\n1\n")
+    store.log_artifact("data.csv", [str(data)])
+    # The same content under another name has the same digest
+    store.log_artifact("copy.csv", [str(data)])
+
+    path = use_artifact_file(store, "data.csv:latest", cache)
+
+    assert use_artifact_file(store, "copy.csv:v0", cache) == path
+    assert os.listdir(cache.cache_dir) == [store.use_artifact("data.csv").digest]
+
+
+def test_cache_is_configured_from_the_environment_when_first_used(tmp_path, monkeypatch):
+    # As main.py does: the environment is set after the module was imported
+    monkeypatch.setattr(artifact_cache, "_default_cache", None)
+    monkeypatch.setenv(artifact_cache.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    monkeypatch.setenv(artifact_cache.CACHE_SIZE_ENV, "1024")
+
+    cache = artifact_cache.get_cache()
+    assert cache.cache_dir == str(tmp_path / "cache") and cache.max_size == 1024
+    assert artifact_cache.get_cache() is cache
+
+    # Another configuration in the same process, e.g. a second pipeline run
+    monkeypatch.setenv(artifact_cache.CACHE_DIR_ENV, str(tmp_path / "other"))
+    assert artifact_cache.get_cache().cache_dir == str(tmp_path / "other")
@@ -0,0 +1,20 @@
+# Unit tests of the pipeline, run with `pytest` from the root of the repository. The data tests of
+# data_check need the artifacts of a pipeline run, so they only run as part of that step
+import pytest
+
+from wandb_utils import artifact_cache
+
+
+collect_ignore = ["src/data_check/test_data.py"]
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    """
+    LocalArtifactStore standing in for W&B (which is disabled), with an empty artifact cache
+    """
+    monkeypatch.setenv("WANDB_MODE", "disabled")
+    monkeypatch.setenv(artifact_cache.LOCAL_STORE_ENV, str(tmp_path / "store"))
+    monkeypatch.setenv(artifact_cache.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    monkeypatch.setattr(artifact_cache, "_default_cache", None)
+    return artifact_cache.LocalArtifactStore(str(tmp_path / "store"))
@@ -1,10 +1,16 @@
 import json
+import logging
 import mlflow
 import tempfile
 import os
 import wandb
 import hydra
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
+
+import scheduler
+import step_cache
+
+logger = logging.getLogger()
 
 _steps = [
     "download",
@@ -15,6 +21,127 @@ _steps = [
     "test_regression_model",
 ]
 
+# Steps each step needs the outputs of. Independent steps run in parallel
+_dependencies = {
+    "download": [],
+    "basic_cleaning": ["download"],
+    "data_check": ["basic_cleaning"],
+    "data_split": ["basic_cleaning"],
+    "train_random_forest": ["data_split"],
+    "test_regression_model": ["data_split", "train_random_forest"],
+}
+
+# Steps that must succeed for the result of a step to be accepted. With main.speculative_steps the
+# gated step starts without waiting for them, and it is cancelled if one of them fails. Until they
+# succeeded, its outputs are logged under staging names (see _staging_name and _promote_step)
+_gates = {
+    "train_random_forest": ["data_check"],
+}
+
+# Local directory of each step, used when the steps run in-process
+_step_dirs = {
+    "download": os.path.join("components", "get_data"),
+    "basic_cleaning": os.path.join("src", "basic_cleaning"),
+    "data_check": os.path.join("src", "data_check"),
+    "data_split": os.path.join("components", "train_val_test_split"),
+    "train_random_forest": os.path.join("src", "train_random_forest"),
+    "test_regression_model": os.path.join("components", "test_regression_model"),
+}
+
+
+def _execute_step(config, step, uri, parameters, **kwargs):
+    """
+    Run a step either isolated (its own MLflow project and conda environment) or, when
+    main.execution_mode is "local", by calling its go function in this process
+    """
+    if config["main"]["execution_mode"] != "local":
+        return mlflow.run(uri, "main", parameters=parameters, **kwargs)
+
+    # Imported here so that the isolated mode does not need the step dependencies
+    import step_runner
+
+    step_dir = os.path.join(hydra.utils.get_original_cwd(), _step_dirs[step])
+    if step == "data_check":
+        # The unit tests next to the data tests are not part of the step
+        step_runner.run_pytest_step(step, step_dir, parameters, "test_data.py")
+    else:
+        step_runner.run_step(step, step_dir, parameters)
+
+
+def _staging_name(name):
+    """
+    Name of the artifact a staged step logs its output artifact name under
+    """
+    base, ext = os.path.splitext(name)
+    return f"{base}_staging{ext}"
+
+
+def _run_step(config, step, uri, parameters, inputs=(), outputs=(), staged=False, **kwargs):
+    """
+    Run a step, unless it already ran successfully with the same code, parameters and input
+    artifacts (see step_cache). In that case the outputs of that run are reused
+
+    A staged step (running ahead of its gates, see scheduler) logs its outputs under staging names and
+    does not touch the step cache: _promote_step publishes its outputs once its gates succeeded
+
+    :param inputs: names of the input artifacts of the step (with version or alias)
+    :param outputs: names of the output artifacts of the step
+    :param staged: whether the step runs staged
+    :return: for a staged step, the promotion of its outputs: {"fingerprint": step cache fingerprint
+             or None, "staged": outputs logged under their staging name, "reused": {output: version}
+             reused from a previous run}
+    """
+    cache, fingerprint = None, None
+    if config["main"]["step_cache"]:
+        if config["main"]["execution_mode"] == "local":
+            code_location = os.path.join(hydra.utils.get_original_cwd(), _step_dirs[step])
+        else:
+            code_location = f"{uri}@{kwargs['version']}" if "version" in kwargs else uri
+
+        cache = step_cache.StepCache(config["main"]["step_cache_file"])
+        fingerprint = cache.fingerprint(step, code_location, parameters, inputs)
+
+        force_par = config["main"]["force_steps"]
+        forced = force_par == "all" or step in force_par.split(",")
+        reused = None if forced else cache.lookup(step, fingerprint)
+        if reused is not None:
+            logger.info(f"Skipping {step}: it already ran with the same code, parameters and inputs")
+            if staged:
+                return {"fingerprint": fingerprint, "staged": [], "reused": reused}
+            cache.restore(step, reused)
+            return None
+
+    if staged:
+        staging = {name: _staging_name(name) for name in outputs}
+        parameters = {key: staging.get(value, value) for key, value in parameters.items()}
+
+    result = _execute_step(config, step, uri, parameters, **kwargs)
+    if staged:
+        return {"fingerprint": fingerprint, "staged": list(outputs), "reused": {}}
+    if cache is not None:
+        cache.record(step, fingerprint, outputs)
+    return result
+
+
+def _promote_step(config, step, promotion):
+    """
+    Publish the outputs of a staged step once its gates succeeded: the staging artifacts it logged
+    become the latest version of its outputs (or the outputs it reused become it again), and the run
+    is recorded in the step cache
+
+    :param promotion: value returned by _run_step for the staged step
+    """
+    resolver = step_cache.ArtifactResolver()
+    for name in promotion["staged"]:
+        version = resolver.publish(_staging_name(name), name)
+        logger.info(f"Published {_staging_name(name)} as {name}:{version}")
+
+    if promotion["fingerprint"] is not None:
+        cache = step_cache.StepCache(config["main"]["step_cache_file"])
+        cache.restore(step, promotion["reused"])
+        cache.record(step, promotion["fingerprint"], promotion["staged"] + list(promotion["reused"]))
+
+
 # This automatically reads in the configuration
 @hydra.main(config_name="config")
 def go(config: DictConfig):
@@ -23,64 +150,103 @@ def go(config: DictConfig):
     os.environ["WANDB_PROJECT"] = config["main"]["project_name"]
     os.environ["WANDB_RUN_GROUP"] = config["main"]["experiment_name"]
 
+    # Configure the artifact cache used by wandb_utils in every step
+    os.environ["WANDB_UTILS_CACHE_DIR"] = config["main"]["artifact_cache_dir"]
+    os.environ["WANDB_UTILS_CACHE_SIZE"] = str(int(config["main"]["artifact_cache_size_mb"]) * 1024 ** 2)
+
     # Steps to execute
     steps_par = config["main"]["steps"]
     active_steps = steps_par.split(",") if steps_par != "all" else _steps
 
+    # Extension of the datasets exchanged between steps. Every step detects the format
+    # from the artifact file name, so CSV and Parquet artifacts can live side by side
+    fmt = config["etl"]["artifact_format"]
+
+    if config["main"]["execution_mode"] == "local":
+        import step_runner
+        step_runner.enable_in_memory_datasets()
+
+    dag = scheduler.StepGraph(_dependencies, _gates)
+
     # Move to a temporary directory
     with tempfile.TemporaryDirectory() as tmp_dir:
 
         if "download" in active_steps:
-            _ = mlflow.run(
+            dag.add(
+                "download",
+                _run_step,
+                config,
+                "download",
                 f"{config['main']['components_repository']}/get_data",
-                "main",
                 version="main",
                 env_manager="conda",
                 parameters={
                     "sample": config["etl"]["sample"],
-                    "artifact_name": "sample.csv",
+                    "artifact_name": f"sample.{fmt}",
                     "artifact_type": "raw_data",
                     "artifact_description": "Raw file as downloaded",
                 },
+                outputs=[f"sample.{fmt}"],
             )
 
         if "basic_cleaning" in active_steps:
-            _ = mlflow.run(
+            dag.add(
+                "basic_cleaning",
+                _run_step,
+                config,
+                "basic_cleaning",
                 os.path.join(hydra.utils.get_original_cwd(), "src", "basic_cleaning"),
-                "main",
                 parameters={
-                    "input_artifact": "sample.csv:latest",
-                    "output_artifact": "clean_sample.csv",
+                    "input_artifact": f"sample.{fmt}:latest",
+                    "output_artifact": f"clean_sample.{fmt}",
                     "output_type": "clean_sample",
                     "output_description": "Data with outliers and null values removed",
                     "min_price": config["etl"]["min_price"],
                     "max_price": config["etl"]["max_price"],
+                    "chunksize": config["etl"]["chunksize"],
+                    "n_workers": config["etl"]["n_workers"],
                 },
+                inputs=[f"sample.{fmt}:latest"],
+                outputs=[f"clean_sample.{fmt}"],
             )
 
         if "data_check" in active_steps:
-            _ = mlflow.run(
+            drift_config = os.path.abspath("drift_config.json")
+            with open(drift_config, "w+") as fp:
+                json.dump(OmegaConf.to_container(config["data_check"]["drift"]), fp)
+
+            dag.add(
+                "data_check",
+                _run_step,
+                config,
+                "data_check",
                 os.path.join(hydra.utils.get_original_cwd(), "src", "data_check"),
-                "main",
                 parameters={
-                    "csv": "clean_sample.csv:latest",
-                    "ref": "clean_sample.csv:reference",
+                    "csv": f"clean_sample.{fmt}:latest",
+                    "ref": f"clean_sample.{fmt}:reference",
                     "kl_threshold": config["data_check"]["kl_threshold"],
                     "min_price": config["etl"]["min_price"],
                     "max_price": config["etl"]["max_price"],
+                    "drift_config": drift_config,
                 },
+                inputs=[f"clean_sample.{fmt}:latest", f"clean_sample.{fmt}:reference"],
             )
 
         if "data_split" in active_steps:
-            _ = mlflow.run(
+            dag.add(
+                "data_split",
+                _run_step,
+                config,
+                "data_split",
                 f"{config['main']['components_repository']}/train_val_test_split",
-                "main",
                 parameters={
-                    "input": "clean_sample.csv:latest",
+                    "input": f"clean_sample.{fmt}:latest",
                     "test_size": config["modeling"]["test_size"],
                     "random_seed": config["modeling"]["random_seed"],
                     "stratify_by": config["modeling"]["stratify_by"],
                 },
+                inputs=[f"clean_sample.{fmt}:latest"],
+                outputs=[f"trainval_data.{fmt}", f"test_data.{fmt}"],
             )
 
         if "train_random_forest" in active_steps:
@@ -88,30 +254,67 @@ def go(config: DictConfig):
             with open(rf_config, "w+") as fp:
                 json.dump(dict(config["modeling"]["random_forest"].items()), fp)
 
-            _ = mlflow.run(
+            hgb_config = os.path.abspath("hgb_config.json")
+            with open(hgb_config, "w+") as fp:
+                json.dump(dict(config["modeling"]["hist_gradient_boosting"].items()), fp)
+
+            sweep_config = os.path.abspath("sweep_config.json")
+            with open(sweep_config, "w+") as fp:
+                json.dump(OmegaConf.to_container(config["modeling"]["sweep"]), fp)
+
+            latency_budget_config = os.path.abspath("latency_budget_config.json")
+            with open(latency_budget_config, "w+") as fp:
+                json.dump(OmegaConf.to_container(config["modeling"]["latency_budget"]), fp)
+
+            dag.add(
+                "train_random_forest",
+                _run_step,
+                config,
+                "train_random_forest",
                 os.path.join(hydra.utils.get_original_cwd(), "src", "train_random_forest"),
-                "main",
                 parameters={
-                    "trainval_artifact": "trainval_data.csv:latest",
+                    "trainval_artifact": f"trainval_data.{fmt}:latest",
                     "val_size": config["modeling"]["val_size"],
                     "random_seed": config["modeling"]["random_seed"],
                     "stratify_by": config["modeling"]["stratify_by"],
                     "rf_config": rf_config,
+                    "engine": config["modeling"]["engine"],
+                    "hgb_config": hgb_config,
                     "max_tfidf_features": config["modeling"]["max_tfidf_features"],
+                    "dtype": config["modeling"]["dtype"],
+                    "n_estimators_step": config["modeling"]["warm_start"]["n_estimators_step"],
+                    "patience": config["modeling"]["warm_start"]["patience"],
+                    "tol": config["modeling"]["warm_start"]["tol"],
+                    "sweep_config": sweep_config,
+                    "export_format": config["modeling"]["export_format"],
+                    "latency_budget_config": latency_budget_config,
                     "output_artifact": "random_forest_export",
                 },
+                inputs=[f"trainval_data.{fmt}:latest"],
+                outputs=["random_forest_export"],
             )
 
         if "test_regression_model" in active_steps:
-            _ = mlflow.run(
+            dag.add(
+                "test_regression_model",
+                _run_step,
+                config,
+                "test_regression_model",
                 os.path.join(hydra.utils.get_original_cwd(), "components", "test_regression_model"),
-                "main",
                 parameters={
                     "mlflow_model": "random_forest_export:prod",
-                    "test_dataset": "test_data.csv:latest",
+                    "test_dataset": f"test_data.{fmt}:latest",
+                    "batch_size": config["modeling"]["inference_batch_size"],
                 },
+                inputs=["random_forest_export:prod", f"test_data.{fmt}:latest"],
             )
 
+        dag.run(
+            max_workers=config["main"]["max_parallel_steps"],
+            speculative=config["main"]["speculative_steps"],
+            promote=lambda step, promotion: _promote_step(config, step, promotion),
+        )
+
 
 if __name__ == "__main__":
     go()
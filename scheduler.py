@@ -0,0 +1,203 @@
+"""
+Dependency-aware scheduler for the pipeline steps. Steps whose dependencies are satisfied start in
+parallel, each in its own worker process.
+
+A step can also be gated on other steps: it starts as soon as its dependencies succeed, without waiting
+for its gates, and it is cancelled if one of its gates fails. Its dependents only start once both the
+step and its gates succeeded.
+
+A step that starts before its gates succeeded runs staged: its target is called with staged=True and
+must keep its outputs unpublished (e.g. under staging artifact names), returning what promote needs
+to publish them. The scheduler calls promote(name, result) once the gates succeeded, so the outputs of
+a step whose gate fails after it finished are never published
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+
+
+logger = logging.getLogger(__name__)
+
+
+def _worker(target, args, kwargs, conn=None):
+    # Run in a new process group, so that cancelling the step also stops the processes it started
+    # (e.g. the conda environment spawned by mlflow.run)
+    os.setpgrp()
+    result = target(*args, **kwargs)
+    # Staged steps hand their result (a small picklable value) back for the promotion
+    if conn is not None:
+        conn.send(result)
+
+
+class StepGraph:
+    """
+    DAG of pipeline steps
+
+    :param dependencies: dict mapping each step to the list of steps it needs
+    :param gates: dict mapping a step to the list of steps that must succeed for its result to be
+                  accepted, but that it does not need to wait for
+    """
+
+    def __init__(self, dependencies, gates=None):
+        self.dependencies = dependencies
+        self.gates = gates or {}
+        self.steps = {}
+
+    def add(self, name, target, *args, **kwargs):
+        """
+        Add a step to the graph. The step runs target(*args, **kwargs)
+        """
+        self.steps[name] = (target, args, kwargs)
+
+    def _requirements(self, name, speculative):
+        # Dependencies and gates on steps that are not part of this run are considered satisfied
+        deps = [d for d in self.dependencies.get(name, []) if d in self.steps]
+        gates = [g for g in self.gates.get(name, []) if g in self.steps]
+        if not speculative:
+            return deps + gates, []
+        return deps, gates
+
+    def _order(self):
+        order, seen = [], set()
+
+        def visit(name, path=()):
+            if name in path:
+                raise ValueError(f"Cycle in the step graph: {' -> '.join(path + (name,))}")
+            if name in seen:
+                return
+            for dep in self.dependencies.get(name, []) + self.gates.get(name, []):
+                if dep in self.steps:
+                    visit(dep, path + (name,))
+            seen.add(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name)
+        return order
+
+    def run(self, max_workers=1, speculative=True, promote=None):
+        """
+        Execute the steps. With max_workers=1 the steps run one after the other in this process, in
+        dependency order; otherwise each step runs in its own process, up to max_workers at a time
+
+        :param max_workers: maximum number of steps running at the same time
+        :param speculative: whether gated steps may start before their gates finish
+        :param promote: called in this process as promote(name, result) once a staged step and its
+                        gates succeeded, with the value returned by the step target. Required when
+                        speculative
+        :return: None
+        """
+        order = self._order()
+
+        if max_workers <= 1:
+            for name in order:
+                target, args, kwargs = self.steps[name]
+                target(*args, **kwargs)
+            return
+
+        requirements = {name: self._requirements(name, speculative) for name in order}
+        pending = list(order)
+        running = {}
+        staged = {}        # staged step -> connection its result is received from, then the result
+        finished = set()   # exited successfully, possibly still waiting for its gates
+        succeeded = set()  # finished and all its gates succeeded
+        failed = set()
+
+        def descendants(names):
+            # Steps that can no longer succeed once the steps in names failed
+            result = set(names)
+            changed = True
+            while changed:
+                changed = False
+                for step, (deps, gates) in requirements.items():
+                    if step not in result and result.intersection(deps + gates):
+                        result.add(step)
+                        changed = True
+            return result
+
+        def fail(name):
+            doomed = descendants({name}) - {name}
+            failed.add(name)
+            for step in doomed:
+                if step in running:
+                    logger.warning(f"Cancelling {step} because {name} failed")
+                    process = running.pop(step)
+                    try:
+                        os.killpg(process.pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        # The worker did not create its process group yet
+                        process.terminate()
+                    process.join()
+                elif step in pending:
+                    logger.warning(f"Skipping {step} because {name} failed")
+                    pending.remove(step)
+                finished.discard(step)
+                failed.add(step)
+                if step in staged:
+                    logger.warning(f"Discarding the staged outputs of {step}")
+                    staged.pop(step)
+
+        while pending or running or (finished - succeeded - failed):
+            # Confirm the steps that finished and whose gates all succeeded, publishing the staged ones
+            for name in sorted(finished - succeeded - failed):
+                if not set(requirements[name][1]) <= succeeded:
+                    continue
+                if name in staged:
+                    logger.info(f"Promoting the staged outputs of {name}")
+                    try:
+                        promote(name, staged.pop(name))
+                    except Exception:
+                        logger.exception(f"Promoting the outputs of {name} failed")
+                        fail(name)
+                        continue
+                succeeded.add(name)
+
+            # Start every step whose dependencies succeeded
+            for name in list(pending):
+                if len(running) >= max_workers:
+                    break
+                deps, gates = requirements[name]
+                if set(deps) <= succeeded:
+                    target, args, kwargs = self.steps[name]
+                    conn = None
+                    if not set(gates) <= succeeded:
+                        logger.info(f"Starting step {name} staged, ahead of {sorted(set(gates) - succeeded)}")
+                        staged[name], conn = multiprocessing.Pipe(duplex=False)
+                        kwargs = {**kwargs, "staged": True}
+                    else:
+                        logger.info(f"Starting step {name}")
+                    process = multiprocessing.Process(
+                        target=_worker, args=(target, args, kwargs, conn), name=name
+                    )
+                    process.start()
+                    if conn is not None:
+                        conn.close()
+                    running[name] = process
+                    pending.remove(name)
+
+            if not running:
+                if pending and not (finished - succeeded - failed):
+                    raise RuntimeError(f"Steps {pending} cannot be scheduled")
+                continue
+
+            multiprocessing.connection.wait([p.sentinel for p in running.values()])
+
+            for name, process in list(running.items()):
+                # Skip the steps still running, or cancelled while handling another failure
+                if name not in running or process.exitcode is None:
+                    continue
+                running.pop(name)
+                process.join()
+                if process.exitcode == 0:
+                    logger.info(f"Step {name} finished")
+                    if name in staged:
+                        staged[name] = staged[name].recv()
+                    finished.add(name)
+                else:
+                    logger.error(f"Step {name} failed with exit code {process.exitcode}")
+                    fail(name)
+
+        if failed:
+            raise RuntimeError(f"The following steps failed or were cancelled: {sorted(failed)}")
@@ -3,68 +3,121 @@
 Download from W&B the raw dataset and apply some basic data cleaning, exporting the result to a new artifact
 """
 import argparse
+import collections
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import wandb
 import pandas as pd
 import numpy as np
 
+from wandb_utils.artifact_cache import use_artifact_file
+from wandb_utils.dataset_io import DatasetWriter, iter_dataset, read_dataset, write_dataset
+
 # DO NOT MODIFY
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
-# DO NOT MODIFY
-def go(args):
-    logger.info("Starting wandb run.")
-    run = wandb.init(
-        project="nyc_airbnb",
-        group="basic_cleaning",
-        job_type="basic_cleaning",
-    )
-    run.config.update(args)
-
-    # Download input artifact
-    logger.info("Fetching raw dataset.")
-    local_path = wandb.use_artifact(args.input_artifact).file()
-    df = pd.read_csv(local_path)
-
-    # Data Cleaning
-    logger.info("Cleaning data.")
+def clean_data(df, min_price, max_price):
+    """
+    Apply the price, geographical and date cleaning to a DataFrame. The rows are independent, so this
+    works the same on a full dataset and on a chunk of it
 
+    :param df: raw data (full dataset or chunk)
+    :param min_price: minimum price to keep
+    :param max_price: maximum price to keep
+    :return: cleaned DataFrame
+    """
     # Filter by price range
-    logger.info("Filtering data by price range.")
-    idx_price = df["price"].between(float(args.min_price), float(args.max_price))
+    idx_price = df["price"].between(min_price, max_price)
     if np.sum(~idx_price) > 0:
         logger.warning(f"Found {np.sum(~idx_price)} rows outside the price range.")
-    df = df[idx_price].copy()
-
-    # Convert `last_review` to datetime
-    logger.info("Converting `last_review` to datetime format.")
-    df["last_review"] = pd.to_datetime(df["last_review"], errors="coerce")
 
     # Filter by geographical boundaries
-    logger.info("Filtering data for valid geographical boundaries.")
     idx_geo = df["longitude"].between(-74.25, -73.50) & df["latitude"].between(40.5, 41.2)
-    
+
     # Debug invalid rows
-    invalid_rows = df.loc[~idx_geo, ["id", "longitude", "latitude"]]
+    invalid_rows = df.loc[idx_price & ~idx_geo, ["id", "longitude", "latitude"]]
     if not invalid_rows.empty:
         logger.warning(f"Found {len(invalid_rows)} rows outside geographical boundaries:")
         logger.warning(invalid_rows)
 
-    # Drop invalid rows
-    df = df[idx_geo].copy()
+    # Drop invalid rows. This is the only copy of the data made by the cleaning
+    df = df[idx_price & idx_geo].copy()
+
+    # Convert `last_review` to datetime
+    df["last_review"] = pd.to_datetime(df["last_review"], errors="coerce")
+
+    return df
+
+
+def clean_chunks(chunks, min_price, max_price, n_workers=1):
+    """
+    Clean an iterable of DataFrames, yielding the cleaned chunks in input order. With n_workers > 1
+    the chunks are cleaned in parallel on a process pool, with at most 2 * n_workers chunks in flight
+    so that memory stays bounded
+
+    :param chunks: iterable of DataFrames
+    :param min_price: minimum price to keep
+    :param max_price: maximum price to keep
+    :param n_workers: number of worker processes
+    :return: iterator of cleaned DataFrames
+    """
+    if n_workers <= 1:
+        for chunk in chunks:
+            yield clean_data(chunk, min_price, max_price)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        in_flight = collections.deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(clean_data, chunk, min_price, max_price))
+            if len(in_flight) >= 2 * n_workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
 
-    # Final Validation: Check if all rows are valid
-    logger.info("Validating that all rows are within valid boundaries.")
-    final_invalid_geo = df[~(df["longitude"].between(-74.25, -73.50) & df["latitude"].between(40.5, 41.2))]
-    if not final_invalid_geo.empty:
-        logger.error("Rows still outside valid geographical boundaries after filtering:")
-        logger.error(final_invalid_geo)
-        raise ValueError("Filtering failed to remove all invalid geographical entries.")
+def go(args):
+    logger.info("Starting wandb run.")
+    run = wandb.init(
+        project="nyc_airbnb",
+        group="basic_cleaning",
+        job_type="basic_cleaning",
+    )
+    run.config.update(args)
 
-    # Save the cleaned data
-    logger.info("Saving and exporting cleaned data.")
-    df.to_csv("clean_sample.csv", index=False)
+    # Download input artifact
+    logger.info("Fetching raw dataset.")
+    local_path = use_artifact_file(run, args.input_artifact)
+
+    min_price, max_price = float(args.min_price), float(args.max_price)
+    chunksize = args.chunksize
+    # Here -1 (or 0) means all available cores
+    n_workers = args.n_workers if args.n_workers >= 1 else os.cpu_count()
+
+    # Save the cleaned data (the format follows the extension of the output artifact name)
+    if chunksize > 0:
+        # Streaming mode: memory is bounded by the chunk size
+        logger.info(f"Cleaning data in chunks of {chunksize} rows with {n_workers} worker(s).")
+        with DatasetWriter(args.output_artifact) as writer:
+            for chunk in clean_chunks(iter_dataset(local_path, chunksize), min_price, max_price, n_workers):
+                writer.write(chunk)
+    else:
+        df = read_dataset(local_path)
+
+        logger.info(f"Cleaning data with {n_workers} worker(s).")
+        if n_workers > 1:
+            # Split in one row block per worker and put the cleaned blocks back together in order
+            block = -(-len(df) // n_workers)
+            blocks = [df.iloc[i:i + block] for i in range(0, len(df), block)]
+            df = pd.concat(clean_chunks(blocks, min_price, max_price, n_workers))
+        else:
+            df = clean_data(df, min_price, max_price)
+
+        logger.info("Saving and exporting cleaned data.")
+        write_dataset(df, args.output_artifact)
 
     # Log the cleaned data artifact to W&B
     artifact = wandb.Artifact(
@@ -72,7 +125,7 @@ def go(args):
         type=args.output_type,
         description=args.output_description,
     )
-    artifact.add_file("clean_sample.csv")
+    artifact.add_file(args.output_artifact)
     run.log_artifact(artifact)
 
     logger.info("Cleaning step completed.")
@@ -123,6 +176,22 @@ if __name__ == "__main__":
         required=True,
     )
 
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Number of rows to clean at a time (0 loads the whole dataset in memory)",
+        default=0,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        help="Number of processes cleaning the data in parallel (-1 means all available cores)",
+        default=1,
+        required=False,
+    )
+
     args = parser.parse_args()
 
     go(args)
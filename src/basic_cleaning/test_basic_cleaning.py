@@ -0,0 +1,55 @@
+"""
+Runs of the cleaning step in-process, against a local artifact store
+"""
+import logging
+import os
+import shutil
+
+import pytest
+
+import step_runner
+
+
+STEP_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE = os.path.join(STEP_DIR, "..", "..", "components", "get_data", "data", "sample1.csv")
+
+
+@pytest.fixture
+def step_dir(tmp_path, local_store):
+    local_store.log_artifact("sample.csv", [SAMPLE])
+    # The step writes the cleaned dataset in its own directory
+    return shutil.copytree(STEP_DIR, tmp_path / "basic_cleaning", ignore=shutil.ignore_patterns("__pycache__"))
+
+
+def clean(step_dir, output_artifact, **parameters):
+    step_runner.run_step("basic_cleaning", str(step_dir), {
+        "input_artifact": "sample.csv:latest",
+        "output_artifact": output_artifact,
+        "output_type": "clean_sample",
+        "output_description": "Data with outliers and null values removed",
+        "min_price": 10,
+        "max_price": 350,
+        **parameters,
+    })
+    with open(os.path.join(step_dir, output_artifact), "rb") as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize("chunksize", [0, 5000])
+def test_parallel_cleaning_in_process(step_dir, chunksize):
+    serial = clean(step_dir, "serial.csv", chunksize=chunksize, n_workers=1)
+    parallel = clean(step_dir, "parallel.csv", chunksize=chunksize, n_workers=2)
+
+    assert parallel == serial
+    # Header, and some rows were dropped by the cleaning
+    assert 1 < serial.count(b"\n") < 20075
+
+
+@pytest.mark.parametrize("n_workers", [0, -1])
+def test_all_cores(step_dir, caplog, monkeypatch, n_workers):
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    serial = clean(step_dir, "serial.csv", chunksize=0, n_workers=1)
+
+    with caplog.at_level(logging.INFO):
+        assert clean(step_dir, "all_cores.csv", chunksize=0, n_workers=n_workers) == serial
+    assert "Cleaning data with 2 worker(s)." in caplog.messages
@@ -1,7 +1,17 @@
+import json
+import os
+import tempfile
+
 import pytest
-import pandas as pd
 import wandb
 
+from wandb_utils.artifact_cache import use_artifact_file
+
+from data_stats import compute_stats, load_check_data
+from drift import compute_drift
+from reference_profile import get_reference_profile
+from wandb_utils.log_artifact import log_artifact
+
 
 def pytest_addoption(parser):
     parser.addoption("--csv", action="store")
@@ -9,38 +19,79 @@ def pytest_addoption(parser):
     parser.addoption("--kl_threshold", action="store")
     parser.addoption("--min_price", action="store")
     parser.addoption("--max_price", action="store")
+    parser.addoption("--drift_config", action="store")
 
 
 @pytest.fixture(scope='session')
-def data(request):
-    run = wandb.init(job_type="data_tests", resume=True)
+def run():
+    return wandb.init(job_type="data_tests", resume=True)
 
-    # Download input artifact. This will also note that this script is using this
-    # particular version of the artifact
-    data_path = run.use_artifact(request.config.option.csv).file()
 
-    if data_path is None:
+@pytest.fixture(scope='session')
+def data(request, run):
+    """
+    Column names and the columns used by the tests of the dataset under test, loaded once per session
+    """
+    if request.config.option.csv is None:
         pytest.fail("You must provide the --csv option on the command line")
 
-    df = pd.read_csv(data_path)
+    # Download input artifact. This will also note that this script is using this
+    # particular version of the artifact
+    data_path = use_artifact_file(run, request.config.option.csv)
 
-    return df
+    return load_check_data(data_path)
 
 
 @pytest.fixture(scope='session')
-def ref_data(request):
-    run = wandb.init(job_type="data_tests", resume=True)
+def data_stats(data):
+    """
+    Statistics of the dataset under test, computed in a single pass over the data
+    """
+    return compute_stats(*data)
 
-    # Download input artifact. This will also note that this script is using this
-    # particular version of the artifact
-    data_path = run.use_artifact(request.config.option.ref).file()
 
-    if data_path is None:
+@pytest.fixture(scope='session')
+def ref_profile(request, run):
+    """
+    Profile of the reference dataset (see reference_profile.py). It is built from the reference
+    dataset only the first time a given reference is used
+    """
+    if request.config.option.ref is None:
         pytest.fail("You must provide the --ref option on the command line")
 
-    df = pd.read_csv(data_path)
+    return get_reference_profile(run, request.config.option.ref)
+
 
-    return df
+@pytest.fixture(scope='session')
+def drift_report(request, run, data, ref_profile):
+    """
+    Drift metrics of every profiled column against the reference profile. The report is also
+    logged as the drift_report.json artifact
+    """
+    drift_config = request.config.option.drift_config
+
+    if drift_config is None:
+        pytest.fail("You must provide the --drift_config option on the command line")
+
+    with open(drift_config) as fp:
+        thresholds = json.load(fp)
+
+    report = compute_drift(data[1], ref_profile, thresholds)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report_path = os.path.join(tmp_dir, "drift_report.json")
+        with open(report_path, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+        log_artifact(
+            "drift_report.json",
+            "drift_report",
+            f"Drift of {request.config.option.csv} against {request.config.option.ref}",
+            report_path,
+            run,
+        )
+
+    return report
 
 
 @pytest.fixture(scope='session')
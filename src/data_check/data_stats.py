@@ -0,0 +1,75 @@
+"""
+Compute in one pass every statistic the data tests need, so that each dataset is loaded once per
+test session (and only the columns the tests use, with compact dtypes)
+"""
+import numpy as np
+
+from wandb_utils.dataset_io import dataset_columns, read_dataset
+
+
+# NYC boundaries used by test_proper_boundaries
+LONGITUDE_RANGE = (-74.25, -73.50)
+LATITUDE_RANGE = (40.5, 41.2)
+
+# Columns needed by the tests (statistics and drift) and the compact dtypes used to load them from CSV
+CHECK_DTYPES = {
+    "neighbourhood_group": "category",
+    "room_type": "category",
+    "longitude": "float64",
+    "latitude": "float64",
+    "price": "float64",
+    "minimum_nights": "float32",
+    "number_of_reviews": "float32",
+    "reviews_per_month": "float32",
+    "calculated_host_listings_count": "float32",
+    "availability_365": "float32",
+}
+
+
+def load_check_data(path):
+    """
+    Load the columns needed by the data tests, with compact dtypes
+
+    :param path: local path of the dataset (CSV or Parquet)
+    :return: (list of all the column names of the dataset, DataFrame with the needed columns)
+    """
+    columns = dataset_columns(path)
+    df = read_dataset(path, columns=[col for col in CHECK_DTYPES if col in columns], dtype=CHECK_DTYPES)
+    return columns, df
+
+
+def compute_stats(columns, df):
+    """
+    Compute the statistics used by the data tests
+
+    :param columns: column names of the dataset
+    :param df: DataFrame returned by load_check_data
+    :return: dict with the keys
+             columns: list of column names, in file order
+             n_rows: number of rows
+             neighbourhood_group_counts: pd.Series of counts per neighbourhood group, sorted by name
+             n_outside_boundaries: number of rows with longitude/latitude outside of NYC
+             price_min, price_max: price range
+             n_missing_price: number of rows without a price
+    """
+    longitude = df["longitude"].to_numpy()
+    latitude = df["latitude"].to_numpy()
+    inside = (
+        (longitude >= LONGITUDE_RANGE[0]) & (longitude <= LONGITUDE_RANGE[1])
+        & (latitude >= LATITUDE_RANGE[0]) & (latitude <= LATITUDE_RANGE[1])
+    )
+
+    counts = df["neighbourhood_group"].value_counts().sort_index()
+
+    price = df["price"].to_numpy()
+    missing_price = np.isnan(price)
+
+    return {
+        "columns": list(columns),
+        "n_rows": len(df),
+        "neighbourhood_group_counts": counts[counts > 0],
+        "n_outside_boundaries": int(np.sum(~inside)),
+        "price_min": float(np.nanmin(price)) if len(price) else np.nan,
+        "price_max": float(np.nanmax(price)) if len(price) else np.nan,
+        "n_missing_price": int(np.sum(missing_price)),
+    }
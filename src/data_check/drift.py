@@ -0,0 +1,129 @@
+"""
+Drift metrics (KL divergence, PSI and two-sample KS) between the data under test and the reference
+profile, for every column profiled in reference_profile.py.
+
+The data is binned on the reference bins (histogram bins for KL/PSI, quantile sketch for KS) and the
+counts of all the numeric columns are computed with a single np.bincount over the stacked bin indices,
+so the cost is one vectorized pass over the data whatever the number of columns
+"""
+import numpy as np
+import pandas as pd
+
+from reference_profile import CATEGORICAL_COLUMNS, NUMERIC_COLUMNS
+
+
+# Smoothing of empty bins, so that KL and PSI stay finite
+EPSILON = 1e-6
+
+METRICS = ("kl", "psi", "ks")
+
+
+def _bin_indices(values, edges, side):
+    # Index of the bin of each value. Values outside the reference range go to the first/last bin,
+    # NaNs are flagged with -1
+    idx = np.searchsorted(edges[1:-1], values, side=side)
+    idx[np.isnan(values)] = -1
+    return idx
+
+
+def _batched_counts(df, specs):
+    """
+    Count the values of every column in its bins with one bincount over all the columns
+
+    :param df: data
+    :param specs: list of (column, bin edges, side). With side="right" the bins are [a, b) like
+                  np.histogram, with side="left" they are (a, b] like a right-continuous CDF
+    :return: list of count arrays, one per spec
+    """
+    n_bins = np.array([max(len(edges) - 1, 1) for _, edges, _ in specs])
+    offsets = np.concatenate([[0], np.cumsum(n_bins)[:-1]])
+
+    indices = np.empty((len(df), len(specs)), dtype=np.int64)
+    for j, (col, edges, side) in enumerate(specs):
+        values = df[col].to_numpy(dtype=np.float64)
+        if len(edges) > 1:
+            indices[:, j] = _bin_indices(values, np.asarray(edges), side)
+        else:
+            indices[:, j] = np.where(np.isnan(values), -1, 0)
+
+    valid = indices >= 0
+    flat = (indices + offsets)[valid]
+    counts = np.bincount(flat, minlength=int(n_bins.sum()))
+    return [counts[o:o + n] for o, n in zip(offsets, n_bins)]
+
+
+def _kl_psi(p_counts, q_counts):
+    p = p_counts / max(p_counts.sum(), 1) + EPSILON
+    q = q_counts / max(q_counts.sum(), 1) + EPSILON
+    p, q = p / p.sum(), q / q.sum()
+    log_ratio = np.log(p / q)
+    return float(np.sum(p * log_ratio) / np.log(2)), float(np.sum((p - q) * log_ratio))
+
+
+def _ks(p_counts, q_counts):
+    p_cdf = np.cumsum(p_counts) / max(p_counts.sum(), 1)
+    q_cdf = np.cumsum(q_counts) / max(q_counts.sum(), 1)
+    return float(np.max(np.abs(p_cdf - q_cdf)))
+
+
+def compute_drift(df, profile, thresholds):
+    """
+    Compute the drift metrics of every profiled column
+
+    :param df: data under test (needs the profiled columns)
+    :param profile: reference profile (see reference_profile.build_profile)
+    :param thresholds: dict {"default": {metric: threshold}, "columns": {column: {metric: threshold}}}
+    :return: report dict {column: {metric: {"value": v, "threshold": t, "drift": bool}}}
+    """
+    columns = profile["columns"]
+    numeric = [col for col in NUMERIC_COLUMNS if col in columns]
+
+    # Histogram bins for KL/PSI and quantile sketch bins for KS, all counted in one batch
+    sketch_edges = [np.unique(columns[col]["quantiles"]) for col in numeric]
+    counts = _batched_counts(
+        df,
+        [(col, columns[col]["bin_edges"], "right") for col in numeric]
+        + [(col, edges, "left") for col, edges in zip(numeric, sketch_edges)],
+    )
+    hist_counts, sketch_counts = counts[:len(numeric)], counts[len(numeric):]
+
+    values = {}
+    for col, edges, p_hist, p_sketch in zip(numeric, sketch_edges, hist_counts, sketch_counts):
+        kl, psi = _kl_psi(p_hist, np.asarray(columns[col]["counts"], dtype=np.float64))
+        # Reference CDF at the sketch points
+        quantiles = np.asarray(columns[col]["quantiles"])
+        q_cdf = np.asarray(columns[col]["cdf"])[np.searchsorted(quantiles, edges, side="right") - 1]
+        q_sketch = np.diff(np.concatenate([[0], q_cdf[1:-1], [1]]))
+        values[col] = {"kl": kl, "psi": psi, "ks": _ks(p_sketch, q_sketch)}
+
+    for col in [c for c in CATEGORICAL_COLUMNS if c in columns]:
+        ref_counts = pd.Series(columns[col]["counts"], dtype=np.float64)
+        data_counts = df[col].value_counts()
+        # Categories unknown to the reference are pooled in one extra bucket
+        p = np.append(data_counts.reindex(ref_counts.index, fill_value=0).to_numpy(dtype=np.float64),
+                      data_counts[~data_counts.index.isin(ref_counts.index)].sum())
+        q = np.append(ref_counts.to_numpy(), 0)
+        kl, psi = _kl_psi(p, q)
+        values[col] = {"kl": kl, "psi": psi, "ks": _ks(p, q)}
+
+    report = {}
+    for col, metrics in values.items():
+        col_thresholds = {**thresholds.get("default", {}), **thresholds.get("columns", {}).get(col, {})}
+        report[col] = {
+            metric: {
+                "value": value,
+                "threshold": col_thresholds.get(metric),
+                "drift": col_thresholds.get(metric) is not None and value > col_thresholds[metric],
+            }
+            for metric, value in metrics.items()
+        }
+    return report
+
+
+def drifted_columns(report):
+    """
+    Return the list of (column, metric) pairs above their threshold
+    """
+    return [
+        (col, metric) for col, metrics in report.items() for metric, result in metrics.items() if result["drift"]
+    ]
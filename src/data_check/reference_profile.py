@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Build the profile of a reference dataset: row count, category counts for the categorical columns and
+histograms plus quantile sketches for the numeric columns. The drift tests compare the data under test
+with this small JSON artifact instead of downloading and parsing the whole reference dataset
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+import wandb
+
+from data_stats import CHECK_DTYPES
+from wandb_utils.artifact_cache import resolve_artifact, use_artifact_file
+from wandb_utils.dataset_io import read_dataset
+from wandb_utils.log_artifact import log_artifact
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+CATEGORICAL_COLUMNS = ["neighbourhood_group", "room_type"]
+NUMERIC_COLUMNS = [
+    "price",
+    "minimum_nights",
+    "number_of_reviews",
+    "reviews_per_month",
+    "calculated_host_listings_count",
+    "availability_365",
+    "latitude",
+    "longitude",
+]
+
+# Number of quantile bins of the numeric histograms, and resolution of the quantile sketches
+N_BINS = 20
+QUANTILES = np.linspace(0, 1, 101)
+
+# Version of the profile layout. Profiles written with another version are rebuilt
+PROFILE_VERSION = 3
+
+
+def profile_artifact_name(artifact_name):
+    """
+    Name of the profile artifact of a dataset artifact (e.g. clean_sample.csv:reference ->
+    clean_sample_profile.json)
+    """
+    base = artifact_name.split(":")[0]
+    return f"{os.path.splitext(base)[0]}_profile.json"
+
+
+def build_profile(path, source_digest=None):
+    """
+    Compute the profile of a dataset
+
+    :param path: local path of the dataset (CSV or Parquet)
+    :param source_digest: digest of the artifact the dataset comes from, used to detect stale profiles
+    :return: JSON-serializable dict
+    """
+    # Parsed with the dtypes of the data under test (see data_stats.load_check_data): a float32 value
+    # and its float64 parse can fall on both sides of a bin edge
+    df = read_dataset(path, columns=CATEGORICAL_COLUMNS + NUMERIC_COLUMNS, dtype=CHECK_DTYPES)
+
+    profile = {"version": PROFILE_VERSION, "source_digest": source_digest, "n_rows": len(df), "columns": {}}
+
+    for col in CATEGORICAL_COLUMNS:
+        counts = df[col].value_counts().sort_index()
+        profile["columns"][col] = {
+            "kind": "categorical",
+            "counts": {str(k): int(v) for k, v in counts.items() if v > 0},
+            "n_missing": int(df[col].isna().sum()),
+        }
+
+    for col in NUMERIC_COLUMNS:
+        values = df[col].to_numpy(dtype=np.float64)
+        valid = values[~np.isnan(values)]
+        # Quantile bin edges, so that every bin holds a similar share of the reference data
+        edges = np.unique(np.quantile(valid, np.linspace(0, 1, N_BINS + 1))) if len(valid) else np.array([])
+        counts = np.histogram(valid, bins=edges)[0] if len(edges) > 1 else np.array([len(valid)])
+        # Quantile sketch, with the exact fraction of values at or below each quantile (they differ
+        # from the quantile levels when the column has ties, e.g. integer counts)
+        quantiles = np.quantile(valid, QUANTILES) if len(valid) else np.array([])
+        cdf = np.searchsorted(np.sort(valid), quantiles, side="right") / max(len(valid), 1)
+        profile["columns"][col] = {
+            "kind": "numeric",
+            "bin_edges": edges.tolist(),
+            "counts": counts.tolist(),
+            "quantiles": quantiles.tolist(),
+            "cdf": cdf.tolist(),
+            "n_missing": int(len(values) - len(valid)),
+        }
+
+    return profile
+
+
+def load_profile(path):
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def get_reference_profile(run, ref):
+    """
+    Return the profile of the reference artifact ref. The profile artifact is reused if it was built
+    from the current content of ref; otherwise (e.g. a new dataset was tagged as reference) it is
+    built from the reference dataset and logged
+
+    :param run: current Weights & Biases run
+    :param ref: name of the reference artifact, including version or alias
+    :return: profile dict
+    """
+    ref_digest = resolve_artifact(run, ref).digest
+    profile_name = profile_artifact_name(ref)
+
+    try:
+        profile = load_profile(use_artifact_file(run, f"{profile_name}:latest"))
+        if profile.get("version") == PROFILE_VERSION and profile["source_digest"] == ref_digest:
+            return profile
+        logger.info(f"{profile_name} is stale, rebuilding it")
+    except (wandb.errors.CommError, ValueError):
+        logger.info(f"{profile_name} does not exist yet, building it")
+
+    return create_profile(run, ref)
+
+
+def create_profile(run, ref):
+    """
+    Build the profile of the reference artifact ref and log it as an artifact
+    """
+    profile = build_profile(use_artifact_file(run, ref), source_digest=resolve_artifact(run, ref).digest)
+
+    profile_name = profile_artifact_name(ref)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profile_path = os.path.join(tmp_dir, profile_name)
+        with open(profile_path, "w") as fp:
+            json.dump(profile, fp)
+
+        log_artifact(
+            profile_name,
+            "reference_profile",
+            f"Profile of {ref} used by the drift tests",
+            profile_path,
+            run,
+        )
+    return profile
+
+
+def go(args):
+    run = wandb.init(job_type="reference_profile")
+    run.config.update(args)
+
+    logger.info(f"Building the profile of {args.ref}")
+    create_profile(run, args.ref)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the profile of the reference dataset")
+
+    parser.add_argument("--ref", type=str, help="Reference artifact to profile", required=True)
+
+    args = parser.parse_args()
+
+    go(args)
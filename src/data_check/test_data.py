@@ -1,9 +1,10 @@
 import pandas as pd
-import numpy as np
 import scipy.stats
 
+from drift import drifted_columns
 
-def test_column_names(data):
+
+def test_column_names(data_stats):
     expected_colums = [
         "id",
         "name",
@@ -23,54 +24,61 @@ def test_column_names(data):
         "availability_365",
     ]
 
-    these_columns = data.columns.values
+    these_columns = data_stats["columns"]
 
     # This also enforces the same order
     assert list(expected_colums) == list(these_columns)
 
 
-def test_neighborhood_names(data):
+def test_neighborhood_names(data_stats):
     known_names = ["Bronx", "Brooklyn", "Manhattan", "Queens", "Staten Island"]
 
-    neigh = set(data['neighbourhood_group'].unique())
+    neigh = set(data_stats["neighbourhood_group_counts"].index)
 
     # Unordered check
     assert set(known_names) == set(neigh)
 
 
-def test_proper_boundaries(data: pd.DataFrame):
+def test_proper_boundaries(data_stats):
     """
     Test proper longitude and latitude boundaries for properties in and around NYC
     """
-    idx = data['longitude'].between(-74.25, -73.50) & data['latitude'].between(40.5, 41.2)
-
-    assert np.sum(~idx) == 0
+    assert data_stats["n_outside_boundaries"] == 0
 
 
-def test_similar_neigh_distrib(data: pd.DataFrame, ref_data: pd.DataFrame, kl_threshold: float):
+def test_similar_neigh_distrib(data_stats, ref_profile, kl_threshold: float):
     """
     Apply a threshold on the KL divergence to detect if the distribution of the new data is
     significantly different than that of the reference dataset
     """
-    dist1 = data['neighbourhood_group'].value_counts().sort_index()
-    dist2 = ref_data['neighbourhood_group'].value_counts().sort_index()
+    dist1 = data_stats["neighbourhood_group_counts"]
+    # Groups missing from the reference have a count of zero (infinite divergence)
+    dist2 = pd.Series(ref_profile["columns"]["neighbourhood_group"]["counts"]).reindex(dist1.index, fill_value=0)
 
     assert scipy.stats.entropy(dist1, dist2, base=2) < kl_threshold
 
 
+def test_no_drift(drift_report):
+    """
+    Apply the per-column thresholds of KL divergence, PSI and KS statistic to every profiled column
+    """
+    assert drifted_columns(drift_report) == []
+
+
 ########################################################
 # Implement here test_row_count and test_price_range   #
 ########################################################
 
-def test_row_count(data: pd.DataFrame):
+def test_row_count(data_stats):
     """
     Test to ensure the dataset has a reasonable number of rows.
     """
-    assert 15000 < data.shape[0] < 1000000
+    assert 15000 < data_stats["n_rows"] < 1000000
 
 
-def test_price_range(data: pd.DataFrame, min_price: float, max_price: float):
+def test_price_range(data_stats, min_price: float, max_price: float):
     """
     Test to ensure all prices are within the specified range.
     """
-    assert data['price'].between(min_price, max_price).all()
+    assert data_stats["n_missing_price"] == 0
+    assert min_price <= data_stats["price_min"] and data_stats["price_max"] <= max_price
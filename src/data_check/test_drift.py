@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_stats import load_check_data
+from drift import _batched_counts, compute_drift, drifted_columns
+from reference_profile import build_profile
+from wandb_utils.dataset_io import read_dataset, write_dataset
+
+
+CLEAN_SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "basic_cleaning", "clean_sample.csv")
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def dataset(request, tmp_path):
+    path = str(tmp_path / f"clean_sample.{request.param}")
+    write_dataset(read_dataset(CLEAN_SAMPLE), path)
+    return path
+
+
+def test_dataset_does_not_drift_from_its_own_profile(dataset):
+    _, df = load_check_data(dataset)
+
+    report = compute_drift(df, build_profile(dataset), {})
+
+    values = {(col, metric): result["value"] for col, metrics in report.items() for metric, result in metrics.items()}
+    assert values == {key: 0.0 for key in values}
+
+
+def test_batched_counts_match_numpy_histograms():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"a": rng.normal(size=1000), "b": rng.exponential(size=1000)})
+    df.loc[::10, "b"] = np.nan
+    edges_a = np.linspace(-1, 1, 6)
+    edges_b = np.array([0.0, 0.5, 1.0, 2.0])
+
+    counts_a, counts_b = _batched_counts(df, [("a", edges_a, "right"), ("b", edges_b, "right")])
+
+    # Values outside the reference range fall in the first and last bins, NaNs are not counted
+    a = np.clip(df["a"], edges_a[0], edges_a[-1])
+    b = np.clip(df["b"].dropna(), edges_b[0], edges_b[-1])
+    assert counts_a.tolist() == np.histogram(a, bins=edges_a)[0].tolist()
+    assert counts_b.tolist() == np.histogram(b, bins=edges_b)[0].tolist()
+
+
+def test_shifted_column_drifts(dataset):
+    _, df = load_check_data(dataset)
+    profile = build_profile(dataset)
+    df["price"] = df["price"] * 1.5
+
+    report = compute_drift(df, profile, {"default": {"kl": 0.2, "psi": 0.2, "ks": 0.1}})
+
+    assert ("price", "ks") in drifted_columns(report)
+    assert {col for col, _ in drifted_columns(report)} == {"price"}
+
+
+def test_per_column_thresholds(dataset):
+    _, df = load_check_data(dataset)
+    profile = build_profile(dataset)
+    df["price"] = df["price"] + 5
+
+    thresholds = {"default": {"ks": 0.5}, "columns": {"price": {"ks": 0.01}}}
+    report = compute_drift(df, profile, thresholds)
+
+    assert report["price"]["ks"]["threshold"] == 0.01
+    assert report["minimum_nights"]["ks"]["threshold"] == 0.5
+    # Metrics without a threshold are reported but never drift
+    assert report["price"]["kl"]["threshold"] is None and not report["price"]["kl"]["drift"]
+    assert drifted_columns(report) == [("price", "ks")]
+
+
+def test_unknown_categories_are_pooled(dataset):
+    _, df = load_check_data(dataset)
+    profile = build_profile(dataset)
+    df["room_type"] = df["room_type"].cat.add_categories("Castle")
+    df.loc[df.index[:2000], "room_type"] = "Castle"
+
+    report = compute_drift(df, profile, {})
+
+    kl = report["room_type"]["kl"]["value"]
+    assert np.isfinite(kl) and kl > 0
+    # The pooled bucket comes last, so the CDFs differ the most just before it
+    assert report["room_type"]["ks"]["value"] == pytest.approx(2000 / len(df))
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+import pytest
+
+from reference_profile import N_BINS, build_profile, get_reference_profile, profile_artifact_name
+from wandb_utils.dataset_io import read_dataset
+
+
+CLEAN_SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "basic_cleaning", "clean_sample.csv")
+
+
+@pytest.fixture(scope="module")
+def profile():
+    return build_profile(CLEAN_SAMPLE, source_digest="abc")
+
+
+def test_profile_artifact_name():
+    assert profile_artifact_name("clean_sample.csv:reference") == "clean_sample_profile.json"
+    assert profile_artifact_name("clean_sample.parquet") == "clean_sample_profile.json"
+
+
+def test_categorical_counts(profile):
+    df = read_dataset(CLEAN_SAMPLE)
+
+    room_type = profile["columns"]["room_type"]
+    assert room_type["counts"] == df["room_type"].value_counts().to_dict()
+    assert room_type["n_missing"] == 0
+    assert profile["n_rows"] == len(df)
+    assert profile["source_digest"] == "abc"
+
+
+def test_numeric_histograms(profile):
+    df = read_dataset(CLEAN_SAMPLE)
+
+    for col in ["price", "reviews_per_month", "minimum_nights"]:
+        column = profile["columns"][col]
+        edges = np.asarray(column["bin_edges"])
+        # Quantile bins: at most N_BINS, strictly increasing, covering the whole range
+        assert 1 < len(edges) <= N_BINS + 1
+        assert np.all(np.diff(edges) > 0)
+        assert edges[0] == pytest.approx(df[col].min()) and edges[-1] == pytest.approx(df[col].max())
+        assert column["n_missing"] == df[col].isna().sum()
+        assert sum(column["counts"]) + column["n_missing"] == len(df)
+        # The sketch CDF is non-decreasing and reaches 1 at the maximum
+        assert np.all(np.diff(column["cdf"]) >= 0) and column["cdf"][-1] == 1
+
+
+def test_reference_profile_is_built_once_per_reference(local_store, tmp_path):
+    local_store.log_artifact("clean_sample.csv", [CLEAN_SAMPLE], aliases=("latest", "reference"))
+
+    profile = get_reference_profile(local_store, "clean_sample.csv:reference")
+    assert profile["source_digest"] == local_store.use_artifact("clean_sample.csv:reference").digest
+    assert local_store.use_artifact("clean_sample_profile.json").path.endswith("v0")
+
+    # Same reference: the logged profile is reused
+    assert get_reference_profile(local_store, "clean_sample.csv:reference") == profile
+    assert local_store.use_artifact("clean_sample_profile.json").path.endswith("v0")
+
+    # A new reference: the profile is rebuilt
+    new_reference = tmp_path / "clean_sample.csv"
+    read_dataset(CLEAN_SAMPLE).head(1000).to_csv(new_reference, index=False)
+    local_store.log_artifact("clean_sample.csv", [str(new_reference)], aliases=("latest", "reference"))
+
+    assert get_reference_profile(local_store, "clean_sample.csv:reference")["n_rows"] == 1000
+    assert local_store.use_artifact("clean_sample_profile.json").path.endswith("v1")
@@ -0,0 +1,41 @@
+"""
+Model engines of the training step. The engine is the last step of the inference pipeline, after the
+shared preprocessor (see preprocessing.py)
+"""
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+
+
+ENGINES = ("random_forest", "hist_gradient_boosting")
+
+# Engines accepting a sparse feature matrix. The others get a dense preprocessor output
+SPARSE_ENGINES = ("random_forest",)
+
+# Positions in the preprocessor output of the ordinal codes of room_type and neighbourhood_group.
+# HistGradientBoostingRegressor splits on them natively as categories (sets of values) instead of
+# treating the arbitrary code order as meaningful
+CATEGORICAL_FEATURES = [0, 1]
+
+
+def get_model(engine, model_config):
+    """
+    Build the (unfitted) model of an engine
+
+    :param engine: one of ENGINES
+    :param model_config: dict of parameters passed to the constructor of the model
+    :return: scikit-learn regressor
+    """
+    if engine == "random_forest":
+        return RandomForestRegressor(**model_config)
+    if engine == "hist_gradient_boosting":
+        return HistGradientBoostingRegressor(categorical_features=CATEGORICAL_FEATURES, **model_config)
+
+    raise ValueError(f"Unknown model engine {engine}, expected one of {ENGINES}")
+
+
+def feature_importances(model):
+    """
+    Impurity-based feature importances of the model, or None if the engine does not provide them
+    """
+    importances = getattr(model, "feature_importances_", None)
+    return None if importances is None else np.asarray(importances)
@@ -0,0 +1,40 @@
+"""
+Validation of the trained inference pipeline: a single prediction pass over the validation set, timed
+stage by stage, from which every metric is computed (see wandb_utils.metrics)
+"""
+from wandb_utils.metrics import evaluate, timed
+
+
+# Columns the validation residuals are broken down by
+GROUP_COLUMNS = ["room_type", "neighbourhood_group"]
+
+
+def evaluate_pipeline(sk_pipe, X_val, y_val, group_columns=GROUP_COLUMNS):
+    """
+    Predict the validation set once and compute the metrics from that prediction
+
+    :param sk_pipe: fitted inference pipeline (preprocessor and model)
+    :param X_val: validation DataFrame
+    :param y_val: validation target
+    :param group_columns: columns of X_val the metrics are broken down by
+    :return: (predictions, metrics, timings {"preprocess_s": ..., "predict_s": ...})
+    """
+    timings = {}
+    # The preprocessor always transforms the raw frame, even when the validation features are in the
+    # feature cache (see preprocessing.load_fold), so that preprocess_s measures the preprocessing
+    with timed(timings, "preprocess"):
+        features = sk_pipe["preprocessor"].transform(X_val)
+
+    with timed(timings, "predict"):
+        y_pred = sk_pipe[-1].predict(features)
+
+    return y_pred, prediction_metrics(y_pred, X_val, y_val, group_columns), timings
+
+
+def prediction_metrics(y_pred, X_val, y_val, group_columns=GROUP_COLUMNS):
+    """
+    Metrics of validation predictions, overall and broken down by group_columns (see
+    wandb_utils.metrics.evaluate)
+    """
+    groups = {column: X_val[column].to_numpy() for column in group_columns if column in X_val.columns}
+    return evaluate(y_val, y_pred, groups)
@@ -1,5 +1,81 @@
 import pandas as pd
 import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+
+
+def parse_dates(dates, date_format="ISO8601"):
+    """
+    Parse a 1d or 2d array of dates into a 2d ``datetime64[D]`` array in a single vectorized pass.
+
+    ISO dates (``YYYY-MM-DD``) are cast directly by NumPy. Anything NumPy cannot cast (e.g. timestamps
+    with a time component or non-ISO strings) falls back to one ``pd.to_datetime`` call over the
+    flattened array, using ``date_format`` as the format hint. Missing or unparseable values become ``NaT``.
+
+    :param dates: array-like of dates (strings, datetime64 or pandas timestamps)
+    :param date_format: format hint passed to pd.to_datetime on the fallback path
+    :return: 2d array of dtype datetime64[D]
+    """
+    values = np.asarray(dates)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[D]")
+
+    if values.dtype == object:
+        # NumPy casts None to NaT but chokes on float NaN, so normalize missing values first
+        missing = pd.isna(values)
+        if missing.any():
+            values = np.where(missing, None, values)
+
+    if date_format == "ISO8601":
+        try:
+            return values.astype("datetime64[D]")
+        except (ValueError, TypeError):
+            pass
+
+    parsed = pd.to_datetime(pd.Series(values.ravel()), format=date_format, errors="coerce")
+    return parsed.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]").reshape(values.shape)
+
+
+class DeltaDateTransformer(BaseEstimator, TransformerMixin):
+    """
+    Transform dates into the delta in days between each date and the most recent date seen at fit time
+    (one reference date per column).
+
+    Learning the reference date during fit makes the feature independent of the inference batch, so a
+    single-row prediction gets the same value it would get inside a large batch. Missing dates are
+    replaced by ``fill_value`` (if given) before computing the delta. The deltas are returned with
+    dtype ``dtype``.
+    """
+
+    def __init__(self, date_format="ISO8601", fill_value=None, dtype=np.float64):
+        self.date_format = date_format
+        self.fill_value = fill_value
+        self.dtype = dtype
+
+    def _parse(self, X):
+        parsed = parse_dates(X, self.date_format)
+        if self.fill_value is not None:
+            parsed = np.where(np.isnat(parsed), np.datetime64(self.fill_value, "D"), parsed)
+        return parsed
+
+    def fit(self, X, y=None):
+        days = self._parse(X).view("int64")
+        # NaT is stored as the minimum int64, so it never wins the max
+        self.reference_date_ = days.max(axis=0)
+        return self
+
+    def transform(self, X):
+        parsed = self._parse(X)
+        deltas = (self.reference_date_ - parsed.view("int64")).astype(self.dtype)
+        deltas[np.isnat(parsed)] = np.nan
+        return deltas
+
+    def get_feature_names_out(self, input_features=None):
+        if input_features is None:
+            return np.array([f"delta_date{i}" for i in range(len(self.reference_date_))], dtype=object)
+        return np.asarray(input_features, dtype=object)
 
 
 def delta_date_feature(dates):
@@ -7,5 +83,4 @@ def delta_date_feature(dates):
     Given a 2d array containing dates (in any format recognized by pd.to_datetime), it returns the delta in days
     between each date and the most recent date in its column
     """
-    date_sanitized = pd.DataFrame(dates).apply(pd.to_datetime)
-    return date_sanitized.apply(lambda d: (d.max() -d).dt.days, axis=0).to_numpy()
+    return DeltaDateTransformer().fit_transform(dates)
@@ -0,0 +1,109 @@
+"""
+Latency-budgeted export of the random forest. Sub-forests of the trained forest (its first trees, with
+the trees truncated at a depth) are benchmarked on the validation set: MAE of the whole set, and
+latency of single-row predictions through the preprocessor and the compact forest (see
+compact_forest.py). The smallest sub-forest meeting the p99 latency budget with an MAE within a
+tolerance of the full forest is the one exported
+"""
+import logging
+import time
+
+import numpy as np
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from compact_forest import CompactForest
+
+
+logger = logging.getLogger(__name__)
+
+
+def _latencies(fn, n_rows):
+    # Wall time in seconds of fn(i) for every row i
+    fn(0)
+    latencies = np.empty(n_rows)
+    for i in range(n_rows):
+        start = time.perf_counter()
+        fn(i)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+
+def benchmark_sub_forests(forest, preprocessor, X_val, features, y_val, budget_config, random_seed=42):
+    """
+    Benchmark the sub-forests of a fitted forest on the validation set
+
+    :param forest: fitted RandomForestRegressor
+    :param preprocessor: fitted preprocessor of the inference pipeline
+    :param X_val: validation DataFrame, from which the single rows are sampled
+    :param features: preprocessed validation matrix
+    :param y_val: validation target
+    :param budget_config: dict with the candidate sizes n_estimators and max_depth (lists, the full
+                          forest is always a candidate) and n_samples, the number of single-row
+                          predictions timed per candidate
+    :param random_seed: seed of the sampling of the timed rows
+    :return: list of {"n_estimators", "max_depth" (None for no truncation), "n_nodes", "size_mb", "r2",
+             "mae", "p50_ms", "p99_ms", "forest_p99_ms" (p99 of the forest alone, without the
+             preprocessing)}, from the smallest sub-forest to the full forest
+    """
+    n_total = len(forest.estimators_)
+    full_depth = max(estimator.tree_.max_depth for estimator in forest.estimators_)
+    sizes = sorted({n for n in budget_config.get("n_estimators", []) if 0 < n < n_total} | {n_total})
+    depths = sorted({d for d in budget_config.get("max_depth", []) if 0 < d < full_depth}) + [None]
+
+    # The rows timed one at a time. Preprocessing them does not depend on the sub-forest, so it is timed once
+    rng = np.random.default_rng(random_seed)
+    rows = rng.choice(len(X_val), min(int(budget_config.get("n_samples", 500)), len(X_val)), replace=False)
+    samples = [X_val.iloc[[row]] for row in rows]
+    preprocess = _latencies(lambda i: preprocessor.transform(samples[i]), len(rows))
+    sample_features = [features[row:row + 1] for row in rows]
+
+    results = []
+    for n_estimators in sizes:
+        for max_depth in depths:
+            sub_forest = CompactForest.from_sklearn(forest, n_estimators, max_depth)
+            y_pred = sub_forest.predict(features)
+            forest_latencies = _latencies(lambda i: sub_forest.predict(sample_features[i]), len(rows)) * 1000
+            latencies = preprocess * 1000 + forest_latencies
+            results.append({
+                "n_estimators": n_estimators,
+                "max_depth": max_depth,
+                "n_nodes": sub_forest.n_nodes,
+                "size_mb": sub_forest.nbytes / 1024 ** 2,
+                "r2": float(r2_score(y_val, y_pred)),
+                "mae": float(mean_absolute_error(y_val, y_pred)),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "forest_p99_ms": float(np.percentile(forest_latencies, 99)),
+            })
+
+    return sorted(results, key=lambda result: result["n_nodes"])
+
+
+def select_sub_forest(results, p99_ms, mae_tolerance):
+    """
+    Pick the smallest sub-forest whose p99 latency is within the budget and whose MAE is at most
+    (1 + mae_tolerance) times the MAE of the full forest. If none meets the budget (e.g. when the
+    preprocessing alone exceeds it), the smallest one within the MAE tolerance is picked
+
+    :param results: output of benchmark_sub_forests. Every entry gets the within_budget and
+                    within_tolerance flags
+    :param p99_ms: latency budget of a single-row prediction (p99, in milliseconds)
+    :param mae_tolerance: relative MAE tolerance
+    :return: the selected entry of results
+    """
+    full = max(results, key=lambda result: (result["n_estimators"], result["max_depth"] is None))
+    for result in results:
+        result["within_tolerance"] = result["mae"] <= full["mae"] * (1 + mae_tolerance)
+        result["within_budget"] = result["p99_ms"] <= p99_ms
+
+    accepted = [result for result in results if result["within_tolerance"] and result["within_budget"]]
+    if accepted:
+        return min(accepted, key=lambda result: (result["n_nodes"], result["p99_ms"]))
+
+    # The full forest is always within the tolerance
+    best = min((result for result in results if result["within_tolerance"]), key=lambda result: result["n_nodes"])
+    logger.warning(
+        f"No sub-forest within the MAE tolerance meets the p99 budget of {p99_ms} ms, exporting the smallest "
+        f"one ({best['p99_ms']:.2f} ms, of which {best['forest_p99_ms']:.2f} ms in the forest)"
+    )
+    return best
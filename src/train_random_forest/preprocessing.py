@@ -0,0 +1,342 @@
+"""
+Preprocessing stage of the random forest pipeline.
+
+The transformed feature matrices of the train/validation folds are materialized once as the
+trainval_features artifact, keyed by the digest of the dataset and by the preprocessing configuration
+(TF-IDF size, fold layout and preprocessing code). Training runs, sweeps and the validation scoring
+load them memory-mapped instead of refitting the encoders, imputers and TF-IDF.
+
+Every fold holds the fitted preprocessor and, for the training and validation parts, a dense block with
+the numeric and categorical features (.npy, memory-mapped when loaded) and the TF-IDF block as a
+compressed sparse matrix (.npz)
+"""
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import joblib
+import numpy as np
+import scipy.sparse
+import sklearn
+import wandb
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.impute import SimpleImputer
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import FunctionTransformer, OrdinalEncoder
+
+from engines import ENGINES, SPARSE_ENGINES
+from feature_engineering import DeltaDateTransformer
+from wandb_utils.artifact_cache import resolve_artifact, use_artifact, use_artifact_file
+from wandb_utils.dataset_io import read_dataset
+from wandb_utils.log_artifact import log_artifact
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+FEATURES_ARTIFACT = "trainval_features"
+
+# Source files whose content changes the transformed features
+_CODE_FILES = ["preprocessing.py", "feature_engineering.py"]
+
+# Default dtype of the features. float32 (opt-in) halves the memory of the features and of the loaded
+# dataset, and is the precision the random forest is trained with anyway
+DEFAULT_DTYPE = "float64"
+
+# The preprocessor outputs a CSR matrix when the density of the features is below this threshold,
+# a dense array otherwise. A float32 CSR matrix takes 8 bytes per stored value (value and int32
+# column index) against 4 bytes per dense cell, so it only saves memory below 50% density, i.e. when
+# the TF-IDF vocabulary is large compared to the 10 dense features
+SPARSE_THRESHOLD = 0.5
+
+FeatureFold = collections.namedtuple("FeatureFold", ["preprocessor", "X_train", "y_train", "X_val", "y_val"])
+
+
+def get_preprocessor(max_tfidf_features, dtype=DEFAULT_DTYPE, sparse_threshold=SPARSE_THRESHOLD):
+    """
+    Build the (unfitted) preprocessor of the inference pipeline
+
+    Every block is produced with the same dtype, so that the output has a single dtype whether it is
+    a dense array or a CSR matrix (see SPARSE_THRESHOLD)
+
+    :param max_tfidf_features: maximum number of words of the TF-IDF applied to the name column
+    :param dtype: dtype of the features, "float32" or "float64"
+    :param sparse_threshold: density below which the output is a CSR matrix (0 always outputs a
+                             dense array, for the engines that do not accept sparse input)
+    :return: (ColumnTransformer, names of the processed features)
+    """
+    dtype = np.dtype(dtype).type
+
+    ordinal_categorical = ["room_type"]
+    non_ordinal_categorical = ["neighbourhood_group"]
+
+    ordinal_categorical_preproc = OrdinalEncoder(dtype=dtype)
+
+    non_ordinal_categorical_preproc = make_pipeline(
+        SimpleImputer(strategy="most_frequent"),
+        OrdinalEncoder(dtype=dtype)
+    )
+
+    zero_imputed = [
+        "minimum_nights",
+        "number_of_reviews",
+        "reviews_per_month",
+        "calculated_host_listings_count",
+        "availability_365",
+        "longitude",
+        "latitude"
+    ]
+    # SimpleImputer keeps the dtype of its input
+    zero_imputer = make_pipeline(
+        SimpleImputer(strategy="constant", fill_value=0),
+        FunctionTransformer(np.asarray, kw_args={"dtype": dtype}),
+    )
+
+    # Accepts both ISO strings (CSV artifacts) and datetime64 columns (Parquet artifacts)
+    date_imputer = DeltaDateTransformer(date_format="ISO8601", fill_value="2010-01-01", dtype=dtype)
+
+    reshape_to_1d = FunctionTransformer(np.reshape, kw_args={"newshape": -1})
+    name_tfidf = make_pipeline(
+        SimpleImputer(strategy="constant", fill_value=""),
+        reshape_to_1d,
+        TfidfVectorizer(binary=False, max_features=max_tfidf_features, stop_words='english', dtype=dtype),
+    )
+
+    # The TF-IDF block must stay the last one, it is stored separately from the dense block
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ("ordinal_cat", ordinal_categorical_preproc, ordinal_categorical),
+            ("non_ordinal_cat", non_ordinal_categorical_preproc, non_ordinal_categorical),
+            ("impute_zero", zero_imputer, zero_imputed),
+            ("transform_date", date_imputer, ["last_review"]),
+            ("transform_name", name_tfidf, ["name"]),
+        ],
+        remainder="drop",
+        sparse_threshold=sparse_threshold,
+    )
+
+    processed_features = ordinal_categorical + non_ordinal_categorical + zero_imputed + ["last_review", "name"]
+
+    return preprocessor, processed_features
+
+
+def train_val_split(X, val_size, stratify_by="none", random_seed=42):
+    """
+    Positional (train indices, validation indices) of the train/validation split of the training step
+    """
+    positions = np.arange(len(X))
+    train_idx, val_idx = train_test_split(
+        positions, test_size=val_size, stratify=X[stratify_by] if stratify_by != "none" else None,
+        random_state=random_seed
+    )
+    return train_idx, val_idx
+
+
+def split_config(args):
+    """
+    Preprocessing configuration of the train/validation split of the training step
+    """
+    return {
+        "max_tfidf_features": args.max_tfidf_features,
+        "val_size": args.val_size,
+        "random_seed": args.random_seed,
+        "stratify_by": args.stratify_by,
+        "dtype": args.dtype,
+        "sparse_threshold": SPARSE_THRESHOLD if args.engine in SPARSE_ENGINES else 0.0,
+    }
+
+
+def features_key(data_digest, preprocessing_config):
+    """
+    Key of the feature matrices of a dataset: hash of its digest, of the preprocessing configuration,
+    of the preprocessing code and of the scikit-learn version the preprocessors are pickled with
+    """
+    md5 = hashlib.md5()
+    for name in _CODE_FILES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), "rb") as fp:
+            md5.update(fp.read())
+
+    key = {
+        "data": data_digest,
+        "config": preprocessing_config,
+        "code": md5.hexdigest(),
+        "sklearn": sklearn.__version__,
+    }
+    return hashlib.md5(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def matrix_nbytes(X):
+    """
+    Memory taken by a dense array or a sparse matrix, in bytes
+    """
+    if scipy.sparse.issparse(X):
+        X = X.tocsr()
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+
+def _save_matrix(out_dir, prefix, X, n_dense):
+    if scipy.sparse.issparse(X):
+        X = X.tocsr()
+        dense, tfidf = X[:, :n_dense].toarray(), X[:, n_dense:]
+    else:
+        dense, tfidf = X[:, :n_dense], scipy.sparse.csr_matrix(X[:, n_dense:])
+
+    np.save(os.path.join(out_dir, f"{prefix}_dense.npy"), np.ascontiguousarray(dense))
+    scipy.sparse.save_npz(os.path.join(out_dir, f"{prefix}_tfidf.npz"), tfidf, compressed=True)
+
+
+def _load_matrix(features_dir, prefix, sparse_output):
+    dense = np.load(os.path.join(features_dir, f"{prefix}_dense.npy"), mmap_mode="r")
+    tfidf = scipy.sparse.load_npz(os.path.join(features_dir, f"{prefix}_tfidf.npz"))
+    if tfidf.shape[1] == 0:
+        return scipy.sparse.csr_matrix(dense) if sparse_output else dense
+    if sparse_output:
+        return scipy.sparse.hstack([scipy.sparse.csr_matrix(dense), tfidf], format="csr")
+    return np.hstack([dense, tfidf.toarray()])
+
+
+def save_fold(out_dir, fold, preprocessor, X_train, y_train, X_val, y_val):
+    """
+    Fit a copy of the preprocessor on the training part of a fold and store it together with the
+    transformed training and validation matrices and targets
+
+    :param out_dir: directory of the feature matrices
+    :param fold: index of the fold
+    :param preprocessor: unfitted preprocessor (see get_preprocessor)
+    :return: whether the preprocessor output is a sparse matrix
+    """
+    preprocessor = clone(preprocessor)
+    X_train_processed = preprocessor.fit_transform(X_train, y_train)
+    X_val_processed = preprocessor.transform(X_val)
+
+    n_dense = preprocessor.output_indices_["transform_name"].start
+    _save_matrix(out_dir, f"fold{fold}_X_train", X_train_processed, n_dense)
+    _save_matrix(out_dir, f"fold{fold}_X_val", X_val_processed, n_dense)
+    np.save(os.path.join(out_dir, f"fold{fold}_y_train.npy"), np.asarray(y_train))
+    np.save(os.path.join(out_dir, f"fold{fold}_y_val.npy"), np.asarray(y_val))
+    joblib.dump(preprocessor, os.path.join(out_dir, f"fold{fold}_preprocessor.joblib"))
+
+    return scipy.sparse.issparse(X_train_processed)
+
+
+def load_fold(features_dir, fold, with_preprocessor=True):
+    """
+    Load the feature matrices of a fold. The dense blocks and the targets are memory-mapped
+
+    :param features_dir: directory of the trainval_features artifact
+    :param fold: index of the fold
+    :param with_preprocessor: also load the fitted preprocessor (None otherwise)
+    :return: FeatureFold
+    """
+    with open(os.path.join(features_dir, "features.json")) as fp:
+        sparse_output = json.load(fp)["sparse_output"][fold]
+
+    preprocessor = None
+    if with_preprocessor:
+        preprocessor = joblib.load(os.path.join(features_dir, f"fold{fold}_preprocessor.joblib"))
+
+    return FeatureFold(
+        preprocessor,
+        _load_matrix(features_dir, f"fold{fold}_X_train", sparse_output),
+        np.load(os.path.join(features_dir, f"fold{fold}_y_train.npy"), mmap_mode="r"),
+        _load_matrix(features_dir, f"fold{fold}_X_val", sparse_output),
+        np.load(os.path.join(features_dir, f"fold{fold}_y_val.npy"), mmap_mode="r"),
+    )
+
+
+def get_feature_folds(run, data_artifact, X, y, folds, preprocessing_config):
+    """
+    Return the directory of the feature matrices of the folds of a dataset. They are computed and
+    logged as the trainval_features artifact (with the features key as alias) only if no artifact
+    exists for the same dataset digest and preprocessing configuration
+
+    :param run: current Weights & Biases run
+    :param data_artifact: name of the dataset artifact X and y come from
+    :param X: features
+    :param y: target
+    :param folds: list of positional (train indices, validation indices)
+    :param preprocessing_config: dict with max_tfidf_features, dtype, sparse_threshold and the parameters
+                                 defining the folds
+    :return: path of the directory holding the features (see load_fold)
+    """
+    key = features_key(resolve_artifact(run, data_artifact).digest, preprocessing_config)
+
+    try:
+        features_dir = use_artifact(run, f"{FEATURES_ARTIFACT}:{key}")
+        logger.info(f"Using the cached feature matrices {FEATURES_ARTIFACT}:{key}")
+        return features_dir
+    except (wandb.errors.CommError, ValueError):
+        logger.info(f"Computing the feature matrices of {data_artifact} ({len(folds)} fold(s))")
+
+    preprocessor, _ = get_preprocessor(
+        preprocessing_config["max_tfidf_features"], preprocessing_config["dtype"], preprocessing_config["sparse_threshold"]
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sparse_output = [
+            save_fold(tmp_dir, i, preprocessor, X.iloc[train_idx], y.iloc[train_idx], X.iloc[val_idx], y.iloc[val_idx])
+            for i, (train_idx, val_idx) in enumerate(folds)
+        ]
+
+        with open(os.path.join(tmp_dir, "features.json"), "w") as fp:
+            json.dump({"key": key, "config": preprocessing_config, "n_folds": len(folds),
+                       "sparse_output": sparse_output}, fp)
+
+        log_artifact(
+            FEATURES_ARTIFACT,
+            "feature_matrix",
+            f"Preprocessed feature matrices of {data_artifact}",
+            tmp_dir,
+            run,
+            aliases=["latest", key],
+        )
+
+    return use_artifact(run, f"{FEATURES_ARTIFACT}:{key}")
+
+
+def go(args):
+    run = wandb.init(job_type="preprocessing")
+    run.config.update(args)
+
+    X = read_dataset(use_artifact_file(run, args.trainval_artifact), downcast=args.dtype == "float32")
+    y = X.pop("price")
+
+    split = train_val_split(X, args.val_size, args.stratify_by, args.random_seed)
+    get_feature_folds(run, args.trainval_artifact, X, y, [split], split_config(args))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize the preprocessed train/validation features")
+
+    parser.add_argument("--trainval_artifact", type=str, help="Artifact containing the training dataset", required=True)
+
+    parser.add_argument(
+        "--val_size", type=float, help="Size of the validation split. Fraction of the dataset, or number of items"
+    )
+
+    parser.add_argument("--random_seed", type=int, help="Seed for random number generator", default=42)
+
+    parser.add_argument("--stratify_by", type=str, help="Column to use for stratification", default="none")
+
+    parser.add_argument(
+        "--max_tfidf_features", type=int, help="Maximum number of words to consider for the TFIDF", default=10
+    )
+
+    parser.add_argument(
+        "--dtype", type=str, choices=["float32", "float64"], help="Precision of the features", default=DEFAULT_DTYPE
+    )
+
+    parser.add_argument(
+        "--engine", type=str, choices=ENGINES, help="Model engine the features are for", default="random_forest"
+    )
+
+    args = parser.parse_args()
+
+    go(args)
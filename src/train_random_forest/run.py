@@ -5,7 +5,9 @@ This script trains a Random Forest
 import argparse
 import logging
 import os
+import resource
 import shutil
+import time
 import matplotlib.pyplot as plt
 
 import mlflow
@@ -13,25 +15,23 @@ import json
 
 import pandas as pd
 import numpy as np
-from sklearn.compose import ColumnTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.impute import SimpleImputer
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import OrdinalEncoder, FunctionTransformer
-from sklearn.pipeline import Pipeline, make_pipeline
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_absolute_error
+import scipy.sparse
+from sklearn.pipeline import Pipeline
 
 import wandb
 
-
-def delta_date_feature(dates):
-    """
-    Given a 2D array containing dates (in any format recognized by pd.to_datetime), it returns the delta in days
-    between each date and the most recent date in its column.
-    """
-    date_sanitized = pd.DataFrame(dates).apply(pd.to_datetime)
-    return date_sanitized.apply(lambda d: (d.max() - d).dt.days, axis=0).to_numpy()
+from compact_forest import CompactForest, save_compact_model
+from evaluation import GROUP_COLUMNS, evaluate_pipeline, prediction_metrics
+from engines import ENGINES, SPARSE_ENGINES, feature_importances, get_model
+from latency_budget import benchmark_sub_forests, select_sub_forest
+from preprocessing import (
+    DEFAULT_DTYPE, SPARSE_THRESHOLD, get_feature_folds, get_preprocessor, load_fold, matrix_nbytes, split_config,
+    train_val_split
+)
+from sweep import grow_forest, kfold_indices, run_sweep
+from wandb_utils.artifact_cache import use_artifact_file
+from wandb_utils.dataset_io import read_dataset
+from wandb_utils.metrics import metrics_table
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
@@ -43,12 +43,22 @@ def validate_and_correct_types(df):
     Ensures all columns in the dataframe have types compatible with MLflow.
     """
     for col in df.columns:
-        if df[col].dtype == "object":
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            # Categories coming from Parquet artifacts are exposed to MLflow as plain strings
+            df[col] = df[col].astype(str)
+        elif pd.api.types.is_datetime64_any_dtype(df[col]):
+            # Missing dates become "nan", as the missing strings of CSV artifacts do below
+            df[col] = df[col].dt.strftime("%Y-%m-%d").astype(str)
+        elif df[col].dtype == "object":
             # Attempt conversion to string
             try:
                 df[col] = df[col].astype(str)
             except Exception as e:
                 raise ValueError(f"Cannot convert column '{col}' to string. Error: {e}")
+        elif df[col].dtype.name in ["int32", "float32"]:
+            # Columns loaded with compact dtypes: the signature keeps the wide dtypes, so the model
+            # accepts datasets loaded without downcasting
+            df[col] = df[col].astype(df[col].dtype.name.replace("32", "64"))
         elif df[col].dtype.name not in ["int64", "float64", "bool"]:
             raise ValueError(f"Column '{col}' has unsupported type '{df[col].dtype}' for MLflow.")
     return df
@@ -58,41 +68,94 @@ def go(args):
     run = wandb.init(job_type="train_random_forest")
     run.config.update(args)
 
-    # Load Random Forest configuration
-    with open(args.rf_config) as fp:
-        rf_config = json.load(fp)
-    run.config.update(rf_config)
+    # Load the configuration of the model engine
+    with open(args.rf_config if args.engine == "random_forest" else args.hgb_config) as fp:
+        model_config = json.load(fp)
+    run.config.update(model_config)
 
     # Fix the random seed for reproducibility
-    rf_config['random_state'] = args.random_seed
+    model_config['random_state'] = args.random_seed
+
+    if args.engine != "random_forest" and args.n_estimators_step > 0:
+        raise ValueError("Growing the model incrementally (n_estimators_step) requires the random_forest engine")
+    if args.engine != "random_forest" and args.export_format == "compact":
+        raise ValueError("The compact export format requires the random_forest engine")
+
+    budget_config = {}
+    if args.latency_budget_config != "none":
+        with open(args.latency_budget_config) as fp:
+            budget_config = json.load(fp)
+    if budget_config.get("p99_ms", 0) > 0 and args.export_format != "compact":
+        raise ValueError("A latency budget requires the compact export format")
 
     # Load the training dataset artifact
-    trainval_local_path = run.use_artifact(args.trainval_artifact).file()
-    X = pd.read_csv(trainval_local_path)
+    trainval_local_path = use_artifact_file(run, args.trainval_artifact)
+    # With float32 features the dataset is also loaded with compact dtypes
+    X = read_dataset(trainval_local_path, downcast=args.dtype == "float32")
     y = X.pop("price")
 
     logger.info(f"Minimum price: {y.min()}, Maximum price: {y.max()}")
 
     # Train-test split
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=args.val_size, stratify=X[args.stratify_by] if args.stratify_by != "none" else None, random_state=args.random_seed
-    )
+    split = train_val_split(X, args.val_size, args.stratify_by, args.random_seed)
+    X_train, X_val, y_val = X.take(split[0]), X.take(split[1]), y.take(split[1])
+
+    # Preprocessed train/validation matrices, computed once per dataset and preprocessing configuration
+    features_dir = get_feature_folds(run, args.trainval_artifact, X, y, [split], split_config(args))
+
+    # Hyperparameter sweep: the best candidate overrides the random forest configuration
+    if args.sweep_config != "none":
+        with open(args.sweep_config) as fp:
+            sweep_config = json.load(fp)
+        if sweep_config.get("method", "none") != "none":
+            if args.engine != "random_forest":
+                raise ValueError("Hyperparameter sweeps require the random_forest engine")
+            model_config = tune_random_forest(run, sweep_config, model_config, X, y, features_dir, args)
 
     logger.info("Preparing sklearn pipeline")
-    sk_pipe, processed_features = get_inference_pipeline(rf_config, args.max_tfidf_features)
+    sk_pipe, processed_features = get_inference_pipeline(
+        model_config, args.max_tfidf_features, args.dtype, args.engine
+    )
+
+    # The preprocessor was fitted on the training split together with the feature matrices
+    fold = load_fold(features_dir, 0)
+    sk_pipe.set_params(preprocessor=fold.preprocessor)
+
+    layout = "csr" if scipy.sparse.issparse(fold.X_train) else "dense"
+    features_mb = matrix_nbytes(fold.X_train) / 1024 ** 2
+    logger.info(f"Training features: {layout} {fold.X_train.dtype} {fold.X_train.shape}, {features_mb:.1f} MB")
+    run.summary["features_layout"] = layout
+    run.summary["features_mb"] = features_mb
 
     # Fit the pipeline
-    logger.info("Fitting")
-    sk_pipe.fit(X_train, y_train)
+    logger.info(f"Fitting the {args.engine} model")
+    start = time.perf_counter()
+    if args.n_estimators_step > 0:
+        model_config = grow_random_forest(run, sk_pipe, model_config, fold, args)
+    else:
+        sk_pipe[-1].fit(fold.X_train, fold.y_train)
+    train_time = time.perf_counter() - start
+    logger.info(f"Training time: {train_time:.1f}s")
 
     # Evaluate the model
     logger.info("Scoring")
-    r_squared = sk_pipe.score(X_val, y_val)
-    y_pred = sk_pipe.predict(X_val)
-    mae = mean_absolute_error(y_val, y_pred)
+    # One timed prediction pass over the validation set, every metric is computed from it
+    y_pred, metrics, timings = evaluate_pipeline(sk_pipe, X_val, y_val)
+    r_squared, mae = metrics["r2"], metrics["mae"]
 
     logger.info(f"Score: {r_squared}")
     logger.info(f"MAE: {mae}")
+    logger.info(f"RMSE: {metrics['rmse']}")
+    logger.info(f"Validation time: preprocess {timings['preprocess_s']:.2f}s, predict {timings['predict_s']:.2f}s")
+
+    # Latency budget: the exported model is the smallest sub-forest meeting it, scored instead of the full forest
+    forest = None
+    if budget_config.get("p99_ms", 0) > 0:
+        forest, model_config = fit_latency_budget(run, sk_pipe, fold, X_val, y_val, budget_config, model_config, args)
+        y_pred = forest.predict(fold.X_val)
+        metrics = prediction_metrics(y_pred, X_val, y_val)
+        r_squared, mae = metrics["r2"], metrics["mae"]
+        logger.info(f"Exported sub-forest score: {r_squared}, MAE: {mae}")
 
     # Ensure column types are valid for MLflow
     logger.info("Validating data types for MLflow")
@@ -104,18 +167,36 @@ def go(args):
         shutil.rmtree("random_forest_dir")
 
     signature = mlflow.models.infer_signature(X_val, y_pred)
-    mlflow.sklearn.save_model(
-        sk_pipe,
-        "random_forest_dir",
-        signature=signature,
-        input_example=X_train.iloc[:5],
-    )
+    # The pipeline references DeltaDateTransformer, so ship its module with the model
+    code_paths = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature_engineering.py")]
+    # The columns the predictions depend on, e.g. for the prediction cache of the scoring server
+    metadata = {"feature_columns": processed_features}
+    if args.export_format == "compact":
+        # Pyfunc model predicting from the node arrays of the forest (see compact_forest.py)
+        save_compact_model(
+            sk_pipe, "random_forest_dir", code_paths, forest, signature=signature, input_example=X_train.iloc[:5],
+            metadata=metadata,
+        )
+    else:
+        mlflow.sklearn.save_model(
+            sk_pipe,
+            "random_forest_dir",
+            signature=signature,
+            input_example=X_train.iloc[:5],
+            code_paths=code_paths,
+            metadata=metadata,
+        )
+
+    model_size = sum(
+        os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk("random_forest_dir") for f in files
+    ) / 1024 ** 2
+    logger.info(f"Model size: {model_size:.1f} MB")
 
     artifact = wandb.Artifact(
         args.output_artifact,
         type='model_export',
-        description='Trained Random Forest model',
-        metadata=rf_config
+        description=f'Trained {args.engine} model',
+        metadata={**model_config, "engine": args.engine, "export_format": args.export_format}
     )
     artifact.add_dir('random_forest_dir')
     run.log_artifact(artifact)
@@ -126,16 +207,129 @@ def go(args):
     # Log metrics and feature importance visualization to W&B
     run.summary['r2'] = r_squared
     run.summary['mae'] = mae
-    run.log({"feature_importance": wandb.Image(fig_feat_imp)})
+    run.summary['rmse'] = metrics['rmse']
+    for stage, seconds in timings.items():
+        run.summary[f"val_{stage}"] = seconds
+    for column in GROUP_COLUMNS:
+        if f"by_{column}" in metrics:
+            names, rows = metrics_table(metrics, column)
+            run.log({f"residuals_by_{column}": wandb.Table(columns=names, data=rows)})
+    run.summary['train_time_s'] = train_time
+    run.summary['model_size_mb'] = model_size
+    # Peak resident memory of the step (ru_maxrss is in KB on Linux)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.info(f"Peak memory: {peak_rss_mb:.0f} MB")
+    run.summary['peak_rss_mb'] = peak_rss_mb
+    if fig_feat_imp is not None:
+        run.log({"feature_importance": wandb.Image(fig_feat_imp)})
 
     run.finish()
 
 
+def grow_random_forest(run, sk_pipe, rf_config, fold, args):
+    """
+    Fit the forest of the pipeline growing it with warm_start, n_estimators_step trees at a time up to
+    rf_config["n_estimators"], and log its learning curve. The forest stops growing early when the
+    validation MAE plateaus
+
+    :param fold: FeatureFold with the preprocessed training and validation matrices
+    :return: rf_config with the number of trees actually grown
+    """
+    n_estimators = rf_config.get("n_estimators", 100)
+    checkpoints = list(range(args.n_estimators_step, n_estimators, args.n_estimators_step)) + [n_estimators]
+    forest, curve = grow_forest(
+        rf_config, checkpoints, fold.X_train, fold.y_train, fold.X_val, fold.y_val, args.patience, args.tol
+    )
+    sk_pipe.set_params(random_forest=forest)
+
+    table = wandb.Table(columns=list(curve[0]))
+    for point in curve:
+        logger.info(f"{point['n_estimators']} trees: r2={point['r2']}, MAE={point['mae']}")
+        run.log({f"learning_curve/{key}": value for key, value in point.items()})
+        table.add_data(*point.values())
+    run.log({"learning_curve": table})
+
+    return {**rf_config, "n_estimators": forest.n_estimators}
+
+
+def fit_latency_budget(run, sk_pipe, fold, X_val, y_val, budget_config, rf_config, args):
+    """
+    Benchmark the sub-forests of the fitted forest, log the latency/accuracy trade-off to W&B and pick the
+    smallest one meeting the latency budget (see latency_budget.py)
+
+    :param fold: FeatureFold with the preprocessed validation matrix
+    :return: (selected CompactForest, rf_config with its n_estimators and max_depth)
+    """
+    results = benchmark_sub_forests(
+        sk_pipe[-1], sk_pipe["preprocessor"], X_val, fold.X_val, y_val, budget_config, args.random_seed
+    )
+    best = select_sub_forest(results, budget_config["p99_ms"], budget_config.get("mae_tolerance", 0.0))
+
+    table = wandb.Table(columns=list(results[0]) + ["selected"])
+    for result in results:
+        logger.info(
+            f"{result['n_estimators']} trees, max_depth {result['max_depth']}: {result['n_nodes']} nodes, "
+            f"MAE={result['mae']:.3f}, p99={result['p99_ms']:.2f} ms (forest {result['forest_p99_ms']:.2f} ms)"
+        )
+        table.add_data(*result.values(), result is best)
+    run.log({"latency_budget": table})
+
+    logger.info(f"Selected {best['n_estimators']} trees with max_depth {best['max_depth']}")
+    run.summary["latency_p99_ms"] = best["p99_ms"]
+    run.summary["latency_p50_ms"] = best["p50_ms"]
+
+    forest = CompactForest.from_sklearn(sk_pipe[-1], best["n_estimators"], best["max_depth"])
+    max_depth = best["max_depth"] if best["max_depth"] is not None else rf_config.get("max_depth")
+    return forest, {**rf_config, "n_estimators": best["n_estimators"], "max_depth": max_depth}
+
+
+def tune_random_forest(run, sweep_config, rf_config, X, y, features_dir, args):
+    """
+    Run the hyperparameter sweep, log every candidate to W&B and return the random forest
+    configuration updated with the best candidate
+
+    :param features_dir: feature matrices of the train/validation split, used when the sweep has
+                         a single fold
+    """
+    n_folds = int(sweep_config.get("n_folds", 1))
+    if n_folds > 1:
+        folds = kfold_indices(X, n_folds, args.stratify_by, args.random_seed)
+        preprocessing_config = {**split_config(args), "n_folds": n_folds}
+        del preprocessing_config["val_size"]
+        features_dir = get_feature_folds(run, args.trainval_artifact, X, y, folds, preprocessing_config)
+
+    n_workers = int(sweep_config.get("n_workers", 1))
+    if n_workers < 1:
+        n_workers = os.cpu_count()
+
+    results, best = run_sweep(
+        features_dir, max(n_folds, 1), rf_config, sweep_config, n_workers, args.random_seed,
+        patience=args.patience, tol=args.tol,
+    )
+
+    param_names = sorted(sweep_config.get("parameters", {}))
+    table = wandb.Table(columns=["candidate"] + param_names + ["r2", "mae"])
+    for i, result in enumerate(results):
+        logger.info(f"Candidate {i} {result['params']}: r2={result['r2']}, MAE={result['mae']}")
+        run.log({"candidate": i, **result["params"], "r2": result["r2"], "mae": result["mae"]})
+        table.add_data(i, *[result["params"].get(name) for name in param_names], result["r2"], result["mae"])
+    run.log({"sweep": table})
+
+    logger.info(f"Best candidate: {best['params']}")
+    run.summary["best_params"] = best["params"]
+    return {**rf_config, **best["params"]}
+
+
 def plot_feature_importance(pipe, feat_names):
+    importances = feature_importances(pipe[-1])
+    if importances is None:
+        logger.info("The model does not provide feature importances, skipping the plot")
+        return None
+
     # Collect the feature importance for all non-NLP features
-    feat_imp = pipe["random_forest"].feature_importances_[:len(feat_names) - 1]
+    feat_imp = importances[:len(feat_names) - 1]
     # NLP feature importance
-    nlp_importance = sum(pipe["random_forest"].feature_importances_[len(feat_names) - 1:])
+    nlp_importance = sum(importances[len(feat_names) - 1:])
     feat_imp = np.append(feat_imp, nlp_importance)
 
     fig_feat_imp, sub_feat_imp = plt.subplots(figsize=(10, 10))
@@ -146,59 +340,18 @@ def plot_feature_importance(pipe, feat_names):
     return fig_feat_imp
 
 
-def get_inference_pipeline(rf_config, max_tfidf_features):
-    ordinal_categorical = ["room_type"]
-    non_ordinal_categorical = ["neighbourhood_group"]
-
-    ordinal_categorical_preproc = OrdinalEncoder()
-
-    non_ordinal_categorical_preproc = make_pipeline(
-        SimpleImputer(strategy="most_frequent"),
-        OrdinalEncoder()
-    )
-
-    zero_imputed = [
-        "minimum_nights",
-        "number_of_reviews",
-        "reviews_per_month",
-        "calculated_host_listings_count",
-        "availability_365",
-        "longitude",
-        "latitude"
-    ]
-    zero_imputer = SimpleImputer(strategy="constant", fill_value=0)
-
-    date_imputer = make_pipeline(
-        SimpleImputer(strategy='constant', fill_value='2010-01-01'),
-        FunctionTransformer(delta_date_feature, check_inverse=False, validate=False)
-    )
-
-    reshape_to_1d = FunctionTransformer(np.reshape, kw_args={"newshape": -1})
-    name_tfidf = make_pipeline(
-        SimpleImputer(strategy="constant", fill_value=""),
-        reshape_to_1d,
-        TfidfVectorizer(binary=False, max_features=max_tfidf_features, stop_words='english'),
-    )
-
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ("ordinal_cat", ordinal_categorical_preproc, ordinal_categorical),
-            ("non_ordinal_cat", non_ordinal_categorical_preproc, non_ordinal_categorical),
-            ("impute_zero", zero_imputer, zero_imputed),
-            ("transform_date", date_imputer, ["last_review"]),
-            ("transform_name", name_tfidf, ["name"]),
-        ],
-        remainder="drop",
-    )
-
-    processed_features = ordinal_categorical + non_ordinal_categorical + zero_imputed + ["last_review", "name"]
+def get_inference_pipeline(model_config, max_tfidf_features, dtype=DEFAULT_DTYPE, engine="random_forest"):
+    # Engines that do not accept sparse input get a dense preprocessor output
+    sparse_threshold = SPARSE_THRESHOLD if engine in SPARSE_ENGINES else 0.0
+    preprocessor, processed_features = get_preprocessor(max_tfidf_features, dtype, sparse_threshold)
 
-    random_forest = RandomForestRegressor(**rf_config)
+    model = get_model(engine, model_config)
 
+    # The model step is named after the engine
     sk_pipe = Pipeline(
         steps=[
             ("preprocessor", preprocessor),
-            ("random_forest", random_forest),
+            (engine, model),
         ]
     )
 
@@ -244,6 +397,21 @@ if __name__ == "__main__":
         default="{}",
     )
 
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=ENGINES,
+        help="Model engine: random_forest or hist_gradient_boosting",
+        default="random_forest",
+    )
+
+    parser.add_argument(
+        "--hgb_config",
+        help="HistGradientBoosting configuration. A JSON dict that will be passed to the "
+             "scikit-learn constructor for HistGradientBoostingRegressor.",
+        default="{}",
+    )
+
     parser.add_argument(
         "--max_tfidf_features",
         help="Maximum number of words to consider for the TFIDF",
@@ -251,6 +419,62 @@ if __name__ == "__main__":
         type=int
     )
 
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        choices=["float32", "float64"],
+        help="Precision of the features. With float32 the dataset is also loaded with compact dtypes",
+        default=DEFAULT_DTYPE,
+    )
+
+    parser.add_argument(
+        "--n_estimators_step",
+        type=int,
+        help="Grow the forest this many trees at a time, scoring it at each checkpoint (0 fits all the "
+             "trees at once)",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--patience",
+        type=int,
+        help="Stop growing the forest once the validation MAE improved by less than tol for this many "
+             "consecutive checkpoints (0 never stops early)",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--tol",
+        type=float,
+        help="Minimum relative improvement of the validation MAE between checkpoints",
+        default=0.0,
+    )
+
+    parser.add_argument(
+        "--sweep_config",
+        type=str,
+        help="Hyperparameter sweep specification. A path to a JSON file, or 'none' to train the "
+             "random forest configuration as is",
+        default="none",
+    )
+
+    parser.add_argument(
+        "--latency_budget_config",
+        type=str,
+        help="Latency budget of the exported model. A path to a JSON file, or 'none' to export the whole "
+             "forest",
+        default="none",
+    )
+
+    parser.add_argument(
+        "--export_format",
+        type=str,
+        choices=["sklearn", "compact"],
+        help="Format of the exported model: the scikit-learn pipeline, or a pyfunc model storing the "
+             "random forest as compact node arrays",
+        default="sklearn",
+    )
+
     parser.add_argument(
         "--output_artifact",
         type=str,
@@ -0,0 +1,205 @@
+"""
+Hyperparameter sweep of the random forest. The candidate forests are trained in parallel on a process
+pool, every worker memory-mapping the feature matrices of the folds (see preprocessing.py) instead of
+refitting the preprocessing
+"""
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import KFold, ParameterGrid, ParameterSampler, StratifiedKFold
+from sklearn.utils import check_array
+
+from preprocessing import load_fold
+
+
+logger = logging.getLogger(__name__)
+
+# Metrics that can be used to pick the best candidate, and whether higher is better
+METRICS = {"r2": True, "mae": False}
+
+
+def candidates(sweep_config, random_seed=42):
+    """
+    Expand the search space of a sweep into the list of candidate parameter dicts
+
+    :param sweep_config: dict with the keys method ("grid" or "random"), parameters ({name: list of
+                         values}) and, for a random search, n_iter (number of candidates)
+    :param random_seed: seed of the random search
+    :return: list of dicts of RandomForestRegressor parameters
+    """
+    space = {name: list(values) for name, values in sweep_config.get("parameters", {}).items()}
+
+    if sweep_config["method"] == "grid":
+        return list(ParameterGrid(space))
+    if sweep_config["method"] == "random":
+        n_iter = min(int(sweep_config.get("n_iter", 10)), len(ParameterGrid(space)))
+        return list(ParameterSampler(space, n_iter, random_state=random_seed))
+
+    raise ValueError(f"Unknown sweep method {sweep_config['method']}")
+
+
+def kfold_indices(X, n_folds, stratify_by="none", random_seed=42):
+    """
+    Positional (train, validation) indices of a (stratified) K-fold cross-validation
+    """
+    if stratify_by != "none":
+        splitter = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=random_seed)
+        return list(splitter.split(X, X[stratify_by].astype(str)))
+
+    splitter = KFold(n_splits=n_folds, shuffle=True, random_state=random_seed)
+    return list(splitter.split(X))
+
+
+def grow_forest(rf_config, checkpoints, X_train, y_train, X_val, y_val, patience=0, tol=0.0):
+    """
+    Grow one forest with warm_start, adding trees up to each checkpoint and scoring it there. The
+    validation predictions are accumulated tree by tree, so every checkpoint only predicts with the
+    trees it added
+
+    :param rf_config: RandomForestRegressor configuration (n_estimators is given by the checkpoints)
+    :param checkpoints: numbers of trees at which the forest is scored
+    :param X_train: training features
+    :param y_train: training target
+    :param X_val: validation features
+    :param y_val: validation target
+    :param patience: stop once the validation MAE improved by less than tol (relative) for this many
+                     consecutive checkpoints (0 never stops early)
+    :param tol: minimum relative improvement of the validation MAE
+    :return: (fitted forest, learning curve as a list of {"n_estimators", "r2", "mae", "predict_time_s"
+             (validation prediction time of the forest at that size)[, "oob_score"]})
+    """
+    model = RandomForestRegressor(**{**rf_config, "warm_start": True})
+    X_val = check_array(X_val, accept_sparse="csr", dtype=np.float32)
+
+    curve = []
+    pred_sum = np.zeros(X_val.shape[0])
+    best_mae, stale = np.inf, 0
+    predict_time = 0.0
+    for n_estimators in sorted(set(checkpoints)):
+        n_trees = len(getattr(model, "estimators_", []))
+        model.set_params(n_estimators=n_estimators)
+        model.fit(X_train, y_train)
+
+        start = time.perf_counter()
+        for tree in model.estimators_[n_trees:]:
+            pred_sum += tree.predict(X_val, check_input=False)
+        y_pred = pred_sum / n_estimators
+        # Cumulated over the trees added so far: the time a prediction with the whole forest takes
+        predict_time += time.perf_counter() - start
+
+        point = {
+            "n_estimators": n_estimators,
+            "r2": float(r2_score(y_val, y_pred)),
+            "mae": float(mean_absolute_error(y_val, y_pred)),
+            "predict_time_s": predict_time,
+        }
+        if model.oob_score:
+            point["oob_score"] = float(model.oob_score_)
+        curve.append(point)
+
+        if patience:
+            if point["mae"] < best_mae * (1 - tol):
+                best_mae, stale = point["mae"], 0
+            else:
+                stale += 1
+                if stale >= patience:
+                    logger.info(f"Validation MAE plateaued, stopping at {n_estimators} trees")
+                    break
+
+    model.set_params(warm_start=False)
+    return model, curve
+
+
+def score_candidates(rf_config, checkpoints, features_dir, n_folds, patience=0, tol=0.0):
+    """
+    Score the candidates that only differ by n_estimators by growing one forest per fold through the
+    checkpoints. Metrics are averaged over the folds; a checkpoint is scored only if it was reached
+    in every fold
+
+    :return: dict {n_estimators: {"r2": ..., "mae": ...}}
+    """
+    curves = []
+    for i in range(n_folds):
+        fold = load_fold(features_dir, i, with_preprocessor=False)
+        curves.append(
+            grow_forest(rf_config, checkpoints, fold.X_train, fold.y_train, fold.X_val, fold.y_val, patience, tol)[1]
+        )
+
+    reached = set.intersection(*[{point["n_estimators"] for point in curve} for curve in curves])
+    scores = {}
+    for n_estimators in sorted(reached):
+        points = [point for curve in curves for point in curve if point["n_estimators"] == n_estimators]
+        scores[n_estimators] = {metric: float(np.mean([point[metric] for point in points])) for metric in METRICS}
+    return scores
+
+
+def _forest_key(rf_config, candidate, n_workers):
+    # Configuration of the forest grown for a candidate (all but n_estimators), with its key
+    config = {**rf_config, **candidate}
+    n_estimators = config.pop("n_estimators", 100)
+    if n_workers > 1:
+        # The parallelism comes from the pool, so each forest is trained on a single core
+        config["n_jobs"] = 1
+    return json.dumps(config, sort_keys=True), config, n_estimators
+
+
+def run_sweep(features_dir, n_folds, rf_config, sweep_config, n_workers=1, random_seed=42, patience=0, tol=0.0):
+    """
+    Train and score every candidate of the sweep. Candidates that only differ by n_estimators share
+    one forest grown incrementally (see grow_forest), so e.g. 100, 200 and 400 trees cost 400 trees
+
+    :param features_dir: directory of the feature matrices of the folds (see preprocessing.get_feature_folds)
+    :param n_folds: number of folds
+    :param rf_config: base RandomForestRegressor configuration, updated with each candidate
+    :param sweep_config: sweep specification (see candidates). Its metric key ("r2" or "mae",
+                         default "mae") selects the best candidate
+    :param n_workers: number of candidates trained in parallel
+    :param random_seed: seed of the random search
+    :param patience: stop growing a forest once its validation MAE plateaus for this many
+                     checkpoints. The candidates with more trees are then left out of the results
+    :param tol: minimum relative improvement of the validation MAE
+    :return: (list of {"params": candidate, "r2": ..., "mae": ...} in candidate order, best entry)
+    """
+    metric = sweep_config.get("metric", "mae")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown sweep metric {metric}")
+
+    params = candidates(sweep_config, random_seed)
+
+    # Group the candidates by everything but n_estimators
+    groups = {}
+    for candidate in params:
+        key, config, n_estimators = _forest_key(rf_config, candidate, n_workers)
+        groups.setdefault(key, (config, set()))[1].add(n_estimators)
+    configs, checkpoints = zip(*groups.values())
+
+    logger.info(
+        f"Sweeping {len(params)} candidate(s) ({len(configs)} forest(s) grown incrementally) over "
+        f"{n_folds} fold(s) with {n_workers} worker(s)"
+    )
+
+    n = len(configs)
+    args = (configs, checkpoints, [features_dir] * n, [n_folds] * n, [patience] * n, [tol] * n)
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            scores = dict(zip(groups, pool.map(score_candidates, *args)))
+    else:
+        scores = dict(zip(groups, map(score_candidates, *args)))
+
+    results = []
+    for candidate in params:
+        key, _, n_estimators = _forest_key(rf_config, candidate, n_workers)
+        score = scores[key].get(n_estimators)
+        if score is None:
+            logger.info(f"Candidate {candidate} skipped: the validation MAE plateaued before {n_estimators} trees")
+            continue
+        results.append({"params": candidate, **score})
+
+    sign = 1 if METRICS[metric] else -1
+    best = max(results, key=lambda result: sign * result[metric])
+    return results, best
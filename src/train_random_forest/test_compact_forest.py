@@ -0,0 +1,106 @@
+import mlflow
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+import compact_forest
+from compact_forest import CompactForest, save_compact_model
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, 6)).astype(np.float32)
+    # Ties and exact zeros, as in the count and TF-IDF features
+    X[:, 4] = rng.integers(0, 5, size=2000)
+    X[rng.random(2000) < 0.7, 5] = 0
+    y = X[:, 0] * 3 + np.sin(X[:, 1]) + X[:, 4] + rng.normal(scale=0.1, size=2000)
+    return X, y
+
+
+@pytest.fixture(scope="module")
+def forest(data):
+    return RandomForestRegressor(n_estimators=20, max_depth=10, min_samples_leaf=2, random_state=0).fit(*data)
+
+
+def test_predictions_match_sklearn(forest, data):
+    X, _ = data
+    compact = CompactForest.from_sklearn(forest)
+
+    np.testing.assert_allclose(compact.predict(X), forest.predict(X), rtol=1e-6, atol=1e-6)
+    assert compact.n_nodes == sum(estimator.tree_.node_count for estimator in forest.estimators_)
+
+
+def test_predictions_match_sklearn_on_the_thresholds(forest, data):
+    X, _ = data
+    # Rows whose values sit exactly on (the float32 rounding of) the split thresholds
+    thresholds = np.concatenate([estimator.tree_.threshold for estimator in forest.estimators_])
+    thresholds = thresholds[thresholds != -2].astype(np.float32)
+    X_edges = np.resize(thresholds, X[:1000].size).reshape(1000, X.shape[1])
+
+    compact = CompactForest.from_sklearn(forest)
+
+    np.testing.assert_allclose(compact.predict(X_edges), forest.predict(X_edges), rtol=1e-6, atol=1e-6)
+
+
+def test_sparse_and_batched_input(forest, data, monkeypatch):
+    X, _ = data
+    compact = CompactForest.from_sklearn(forest)
+    expected = compact.predict(X)
+    monkeypatch.setattr(compact_forest, "BATCH_SIZE", 300)
+
+    np.testing.assert_array_equal(compact.predict(scipy.sparse.csr_matrix(X)), expected)
+    np.testing.assert_array_equal(compact.predict(X.astype(np.float64)), expected)
+
+
+def test_sub_forest(forest, data):
+    X, _ = data
+
+    first_trees = CompactForest.from_sklearn(forest, n_estimators=5)
+    expected = np.mean([estimator.predict(X) for estimator in forest.estimators_[:5]], axis=0)
+    np.testing.assert_allclose(first_trees.predict(X), expected, rtol=1e-6, atol=1e-6)
+
+    # Truncated trees predict the value of the node reached at max_depth
+    truncated = CompactForest.from_sklearn(forest, max_depth=3)
+    values = []
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        paths = estimator.decision_path(X).toarray().astype(bool)
+        depth = compact_forest._node_depths(tree.children_left, tree.children_right)
+        # Deepest node of each path, down to max_depth
+        nodes = np.where(paths & (depth <= 3), depth, -1).argmax(axis=1)
+        values.append(tree.value[nodes, 0, 0])
+    np.testing.assert_allclose(truncated.predict(X), np.mean(values, axis=0), rtol=1e-6, atol=1e-6)
+    assert truncated.max_depth == 3
+    assert truncated.n_nodes < CompactForest.from_sklearn(forest).n_nodes
+
+
+@pytest.mark.parametrize("mmap_mode", [None, "r"])
+def test_save_and_load(forest, data, tmp_path, mmap_mode):
+    X, _ = data
+    compact = CompactForest.from_sklearn(forest)
+    compact.save(str(tmp_path / "forest"))
+
+    loaded = CompactForest.load(str(tmp_path / "forest"), mmap_mode=mmap_mode)
+
+    assert loaded.max_depth == compact.max_depth
+    assert isinstance(loaded.threshold, np.memmap) == (mmap_mode == "r")
+    np.testing.assert_array_equal(loaded.predict(X), compact.predict(X))
+
+
+def test_pyfunc_model_matches_the_pipeline(data, tmp_path):
+    X, y = data
+    df = pd.DataFrame(X, columns=[f"x{i}" for i in range(X.shape[1])])
+    sk_pipe = Pipeline([
+        ("preprocessor", StandardScaler()),
+        ("random_forest", RandomForestRegressor(n_estimators=5, random_state=0)),
+    ]).fit(df, y)
+
+    save_compact_model(sk_pipe, str(tmp_path / "model"), code_paths=[])
+    model = mlflow.pyfunc.load_model(str(tmp_path / "model"))
+
+    np.testing.assert_allclose(model.predict(df), sk_pipe.predict(df), rtol=1e-6, atol=1e-6)
@@ -0,0 +1,71 @@
+"""
+Runs of the training step in-process, against a local artifact store
+"""
+import json
+import os
+import shutil
+
+import mlflow
+import numpy as np
+import pytest
+
+import step_runner
+from wandb_utils.dataset_io import read_dataset, write_dataset
+
+
+STEP_DIR = os.path.dirname(os.path.abspath(__file__))
+CLEAN_SAMPLE = os.path.join(STEP_DIR, "..", "basic_cleaning", "clean_sample.csv")
+
+
+@pytest.fixture
+def step_dir(tmp_path):
+    # The step exports the model in its own directory
+    return shutil.copytree(STEP_DIR, tmp_path / "train_random_forest", ignore=shutil.ignore_patterns("__pycache__"))
+
+
+def train(step_dir, tmp_path, trainval_artifact, **parameters):
+    rf_config = tmp_path / "rf_config.json"
+    rf_config.write_text(json.dumps({"n_estimators": 10, "max_depth": 6, "n_jobs": 1}))
+
+    step_runner.run_step("train_random_forest", str(step_dir), {
+        "trainval_artifact": trainval_artifact,
+        "val_size": 0.2,
+        "random_seed": 42,
+        "stratify_by": "neighbourhood_group",
+        "rf_config": str(rf_config),
+        "engine": "random_forest",
+        "hgb_config": "none",
+        "max_tfidf_features": 5,
+        "dtype": "float32",
+        "n_estimators_step": 0,
+        "patience": 0,
+        "tol": 0.0,
+        "sweep_config": "none",
+        "export_format": "sklearn",
+        "latency_budget_config": "none",
+        "output_artifact": "random_forest_export",
+        **parameters,
+    })
+    return os.path.join(step_dir, "random_forest_dir")
+
+
+@pytest.mark.parametrize("export_format", ["sklearn", "compact"])
+def test_train_from_parquet_with_missing_dates(local_store, step_dir, tmp_path, export_format):
+    df = read_dataset(CLEAN_SAMPLE).head(2000)
+    assert df["last_review"].isna().any()
+
+    # last_review is stored as a datetime column, the missing dates as NaT
+    data_path = str(tmp_path / "trainval_data.parquet")
+    write_dataset(df, data_path)
+    local_store.log_artifact("trainval_data.parquet", [data_path])
+
+    model_path = train(step_dir, tmp_path, "trainval_data.parquet:latest", export_format=export_format)
+
+    model = mlflow.pyfunc.load_model(model_path)
+    inputs = {spec.name: spec.type.name for spec in model.metadata.get_input_schema().inputs}
+    assert inputs["last_review"] == "string"
+
+    missing = df[df["last_review"].isna()].drop(columns=["price"])
+    y_pred = model.predict(missing)
+    assert len(y_pred) == len(missing)
+    assert np.isfinite(y_pred).all()
@@ -0,0 +1,211 @@
+"""
+Step-level result cache. Each step run is fingerprinted from its code, its parameters and the digests
+of its input artifacts. When a step already ran successfully with the same fingerprint, it is skipped
+and the output artifacts it produced back then are reused
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+
+import wandb
+
+from wandb_utils.artifact_cache import LOCAL_STORE_ENV, LocalArtifactStore
+from wandb_utils.sanitize_path import sanitize_path
+
+
+logger = logging.getLogger(__name__)
+
+# Files that define the behaviour of a step. Anything else in the step directory (e.g. the outputs
+# the step writes in its own directory) does not contribute to the fingerprint
+_CODE_FILES = (".py", ".yml", ".yaml", "MLproject")
+
+
+def _md5_file(path, md5=None):
+    md5 = md5 or hashlib.md5()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            md5.update(block)
+    return md5
+
+
+def code_hash(code_location):
+    """
+    Hash the code of a step. For a local directory this is the hash of its source files; for a remote
+    project (e.g. a git URI) it is the hash of the URI itself, so use force to pick up remote changes
+    """
+    md5 = hashlib.md5()
+    if not os.path.isdir(code_location):
+        md5.update(code_location.encode())
+        return md5.hexdigest()
+
+    for root, dirs, files in os.walk(code_location):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d != "__pycache__")
+        for f in sorted(files):
+            if f.endswith(_CODE_FILES):
+                path = os.path.join(root, f)
+                md5.update(os.path.relpath(path, code_location).encode())
+                _md5_file(path, md5)
+    return md5.hexdigest()
+
+
+class ArtifactResolver:
+    """
+    Resolve artifact digests and versions without downloading them, either from W&B or from the
+    local stand-in store (see wandb_utils.artifact_cache)
+    """
+
+    def __init__(self):
+        if os.environ.get(LOCAL_STORE_ENV):
+            self.store = LocalArtifactStore(os.environ[LOCAL_STORE_ENV])
+            self.api = None
+        else:
+            self.store = None
+            self.api = wandb.Api()
+
+    def _qualified(self, name):
+        name = name if ":" in name else f"{name}:latest"
+        project = os.environ.get("WANDB_PROJECT")
+        return f"{project}/{name}" if project else name
+
+    def digest(self, name):
+        if self.store is not None:
+            return self.store.use_artifact(name).digest
+        return self.api.artifact(self._qualified(name)).digest
+
+    def version(self, name):
+        if self.store is not None:
+            return os.path.basename(self.store.use_artifact(name).path)
+        return self.api.artifact(self._qualified(name)).version
+
+    def promote(self, name, version):
+        """
+        Point the latest alias of artifact name back to version, so downstream steps use it
+        """
+        base = name.split(":")[0]
+        if self.store is not None:
+            aliases_path = os.path.join(self.store.root, base, "aliases.json")
+            with open(aliases_path) as fp:
+                aliases = json.load(fp)
+            aliases["latest"] = version
+            with open(aliases_path, "w") as fp:
+                json.dump(aliases, fp)
+            return
+
+        artifact = self.api.artifact(self._qualified(f"{base}:{version}"))
+        if "latest" not in artifact.aliases:
+            artifact.aliases.append("latest")
+            artifact.save()
+
+    def publish(self, staged_name, name):
+        """
+        Log the content of the latest version of artifact staged_name as a new version of artifact
+        name, e.g. to publish the outputs a step logged under a staging name
+
+        :return: the new version of name
+        """
+        if self.store is not None:
+            staged = self.store.use_artifact(staged_name)
+            paths = [os.path.join(staged.path, f) for f in sorted(os.listdir(staged.path))]
+            return self.store.log_artifact(name, paths)
+
+        # The promotion is a run of its own, so the lineage goes from the staged artifact to the published one
+        run = wandb.init(job_type="promote_artifact")
+        staged = run.use_artifact(staged_name if ":" in staged_name else f"{staged_name}:latest")
+        artifact = wandb.Artifact(name, type=staged.type, description=staged.description, metadata=staged.metadata)
+        artifact.add_dir(staged.download())
+        run.log_artifact(artifact)
+        artifact.wait()
+        run.finish()
+        return artifact.version
+
+
+class StepCache:
+    """
+    Persistent record of the successful step runs, stored as a JSON file:
+    {step: {fingerprint: {output artifact name: version}}}
+
+    :param path: path of the JSON file
+    """
+
+    def __init__(self, path):
+        self.path = sanitize_path(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._resolver = None
+
+    @property
+    def resolver(self):
+        if self._resolver is None:
+            self._resolver = ArtifactResolver()
+        return self._resolver
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # Steps running in parallel update the same file
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                records = {}
+                if os.path.exists(self.path):
+                    with open(self.path) as fp:
+                        records = json.load(fp)
+                yield records
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def fingerprint(self, step, code_location, parameters, inputs):
+        """
+        Compute the fingerprint of a step run
+
+        :param step: name of the step
+        :param code_location: local directory (or remote URI) of the step code
+        :param parameters: dict of step parameters. Parameters pointing to local files (e.g. the
+                           random forest configuration) contribute with the file content
+        :param inputs: names of the input artifacts, including version or alias
+        :return: hex digest
+        """
+        resolved = {}
+        for key, value in sorted(parameters.items()):
+            if isinstance(value, str) and os.path.isfile(value):
+                value = _md5_file(value).hexdigest()
+            resolved[key] = value
+
+        fingerprint = {
+            "step": step,
+            "code": code_hash(code_location),
+            "parameters": resolved,
+            "inputs": {name: self.resolver.digest(name) for name in inputs},
+        }
+        return hashlib.md5(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+    def lookup(self, step, fingerprint):
+        """
+        Return the output versions {output artifact name: version} recorded for a run of step with
+        this fingerprint, or None if the step did not run with it
+        """
+        with self._locked() as records:
+            return records.get(step, {}).get(fingerprint)
+
+    def restore(self, step, outputs):
+        """
+        Make the recorded output versions of a run of step (see lookup) the latest version of each
+        output artifact
+        """
+        for name, version in outputs.items():
+            if self.resolver.version(name) != version:
+                logger.info(f"Reusing {name}:{version} produced by a previous run of {step}")
+                self.resolver.promote(name, version)
+
+    def record(self, step, fingerprint, outputs):
+        """
+        Record a successful run of step, together with the current version of its output artifacts
+        """
+        versions = {name: self.resolver.version(name) for name in outputs}
+        with self._locked() as records:
+            records.setdefault(step, {})[fingerprint] = versions
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as fp:
+                json.dump(records, fp, indent=2)
+            os.replace(tmp_path, self.path)
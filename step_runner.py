@@ -0,0 +1,95 @@
+"""
+Run the pipeline steps inside the current process instead of one MLflow project (and one conda
+environment) per step. Each step module is imported from its directory and its go(args) is called
+with the same parameters the MLflow entry point would receive
+"""
+import argparse
+import contextlib
+import importlib.util
+import logging
+import os
+import sys
+
+import pytest
+import wandb
+
+from wandb_utils import dataset_io
+
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def _step_context(step_dir):
+    """
+    Mimic what `mlflow run` does for a local project: run from the step directory, with the step
+    directory importable (e.g. for train_random_forest/feature_engineering.py)
+    """
+    old_cwd = os.getcwd()
+    sys.path.insert(0, step_dir)
+    os.chdir(step_dir)
+    try:
+        yield
+    finally:
+        os.chdir(old_cwd)
+        sys.path.remove(step_dir)
+        # Each step opens its own W&B run, as it would in its own process
+        wandb.finish()
+
+
+def _load_step_module(step_name, step_dir):
+    spec = importlib.util.spec_from_file_location(f"{step_name}_run", os.path.join(step_dir, "run.py"))
+    module = importlib.util.module_from_spec(spec)
+    # Registered like an imported module, so that the functions of the step can be pickled (e.g. to
+    # send them to the process pool of basic_cleaning)
+    sys.modules[spec.name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[spec.name]
+        raise
+    return module
+
+
+def run_step(step_name, step_dir, parameters):
+    """
+    Import the run.py of a step and call its go function in this process
+
+    :param step_name: name of the step (used for logging and to namespace the module)
+    :param step_dir: directory of the step, containing run.py
+    :param parameters: dict of parameters, with the same names as the MLproject parameters
+    :return: None
+    """
+    logger.info(f"Running {step_name} in-process")
+    with _step_context(step_dir):
+        module = _load_step_module(step_name, step_dir)
+        try:
+            module.go(argparse.Namespace(**parameters))
+        finally:
+            sys.modules.pop(module.__name__, None)
+
+
+def run_pytest_step(step_name, step_dir, parameters, tests="."):
+    """
+    Run a step implemented as a pytest suite (e.g. data_check) in this process
+
+    :param step_name: name of the step
+    :param step_dir: directory containing the tests
+    :param parameters: dict of options, passed to pytest as --<name> <value>
+    :param tests: test file (or directory) of the step, relative to step_dir, as in its MLproject
+    :return: None
+    """
+    logger.info(f"Running {step_name} in-process")
+    options = [item for name, value in parameters.items() for item in (f"--{name}", str(value))]
+    with _step_context(step_dir):
+        exit_code = pytest.main([os.path.join(step_dir, tests), "-vv", "-p", "no:cacheprovider", *options])
+
+    if exit_code != 0:
+        raise RuntimeError(f"Step {step_name} failed (pytest exit code {exit_code})")
+
+
+def enable_in_memory_datasets():
+    """
+    Let steps running in this process hand DataFrames to each other without parsing them again
+    """
+    dataset_io.share_in_memory(True)
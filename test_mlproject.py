@@ -0,0 +1,38 @@
+import glob
+import os
+import shlex
+
+import pytest
+import yaml
+from mlflow.projects import _project_spec
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MLPROJECTS = sorted(
+    os.path.relpath(path, ROOT) for path in glob.glob(os.path.join(ROOT, "**", "MLproject"), recursive=True)
+)
+
+
+@pytest.mark.parametrize("mlproject", MLPROJECTS)
+def test_mlproject_is_valid_yaml(mlproject):
+    with open(os.path.join(ROOT, mlproject)) as fp:
+        spec = yaml.safe_load(fp)
+
+    assert spec["entry_points"]
+    for entry_point in spec["entry_points"].values():
+        assert entry_point["command"]
+        # Descriptions are single strings, e.g. not split by a ": " in their text
+        assert all(isinstance(parameter, dict) for parameter in entry_point.get("parameters", {}).values())
+
+
+def test_json_parameters_are_passed_as_one_argument():
+    project = _project_spec.load_project(os.path.join(ROOT, "components", "test_regression_model"))
+    entry_point = project.get_entry_point("memory_benchmark")
+
+    command = entry_point.compute_command(
+        {"mlflow_model": "model", "dataset": "sample.csv", "model_config": '{"mmap": false}'}, storage_dir=None
+    )
+
+    # The shell joins the continuation lines of the command
+    argv = shlex.split(command.replace("\\\n", " "))
+    assert argv[argv.index("--model_config") + 1] == '{"mmap": false}'
@@ -0,0 +1,167 @@
+import os
+import time
+
+import pytest
+
+from scheduler import StepGraph
+
+
+def step(log_dir, name, wait_for=None, fail=False, staged=False):
+    """
+    Test step: marks itself as started, waits for the step wait_for to finish, then fails or marks
+    itself as done. Staged steps return their staged result
+    """
+    open(os.path.join(log_dir, f"{name}.started"), "w").close()
+    if wait_for is not None:
+        deadline = time.monotonic() + 10
+        while not os.path.exists(os.path.join(log_dir, f"{wait_for}.done")):
+            if time.monotonic() > deadline:
+                raise TimeoutError(wait_for)
+            time.sleep(0.01)
+    if fail:
+        raise RuntimeError(f"{name} failed")
+    open(os.path.join(log_dir, f"{name}.done"), "w").close()
+    return f"{name} staged" if staged else None
+
+
+def slow_step(log_dir, name, staged=False):
+    open(os.path.join(log_dir, f"{name}.started"), "w").close()
+    time.sleep(30)
+    open(os.path.join(log_dir, f"{name}.done"), "w").close()
+
+
+def step_after(log_dir, name, marker, staged=False):
+    # Fails unless the marker file (e.g. "train.promoted") exists when the step starts
+    if not os.path.exists(os.path.join(log_dir, marker)):
+        raise RuntimeError(f"{name} started before {marker}")
+    open(os.path.join(log_dir, f"{name}.done"), "w").close()
+
+
+def status(log_dir, name):
+    for state in ("done", "started"):
+        if os.path.exists(os.path.join(log_dir, f"{name}.{state}")):
+            return state
+    return None
+
+
+# data -> check (gate of train), data -> train -> test
+DEPENDENCIES = {"data": [], "check": ["data"], "train": ["data"], "test": ["train"]}
+GATES = {"train": ["check"]}
+
+
+@pytest.fixture
+def promoted(tmp_path):
+    calls = []
+
+    def promote(name, result):
+        calls.append((name, result))
+        open(os.path.join(tmp_path, f"{name}.promoted"), "w").close()
+
+    promote.calls = calls
+    return promote
+
+
+def test_sequential_run_follows_dependencies_and_gates(tmp_path):
+    order = []
+    dag = StepGraph(DEPENDENCIES, GATES)
+    # Added in reverse order
+    for name in ["test", "train", "check", "data"]:
+        dag.add(name, order.append, name)
+
+    dag.run(max_workers=1)
+
+    assert order.index("data") < order.index("check") < order.index("train") < order.index("test")
+
+
+def test_independent_steps_run_in_parallel(tmp_path):
+    dag = StepGraph({"a": [], "b": []})
+    # Each step waits for the other one: they only both finish if they run at the same time
+    dag.add("a", step, str(tmp_path), "a", wait_for="b")
+    dag.add("b", step, str(tmp_path), "b")
+
+    dag.run(max_workers=2)
+
+    assert status(tmp_path, "a") == status(tmp_path, "b") == "done"
+
+
+def test_failure_skips_dependents(tmp_path):
+    dag = StepGraph(DEPENDENCIES)
+    dag.add("data", step, str(tmp_path), "data", fail=True)
+    dag.add("train", step, str(tmp_path), "train")
+    dag.add("test", step, str(tmp_path), "test")
+
+    with pytest.raises(RuntimeError, match=r"\['data', 'test', 'train'\]"):
+        dag.run(max_workers=2)
+
+    assert status(tmp_path, "train") is None
+    assert status(tmp_path, "test") is None
+
+
+def test_gate_failure_cancels_running_gated_step(tmp_path, promoted):
+    dag = StepGraph(DEPENDENCIES, GATES)
+    dag.add("data", step, str(tmp_path), "data")
+    # The gate fails once the gated step started
+    dag.add("check", step, str(tmp_path), "check", fail=True)
+    dag.add("train", slow_step, str(tmp_path), "train")
+    dag.add("test", step, str(tmp_path), "test")
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match=r"\['check', 'test', 'train'\]"):
+        dag.run(max_workers=3, promote=promoted)
+
+    assert time.monotonic() - start < 20
+    assert status(tmp_path, "train") in ("started", None)
+    assert status(tmp_path, "test") is None
+    assert promoted.calls == []
+
+
+def test_gated_step_finished_before_its_gate_fails_is_not_promoted(tmp_path, promoted):
+    dag = StepGraph(DEPENDENCIES, GATES)
+    dag.add("data", step, str(tmp_path), "data")
+    dag.add("check", step, str(tmp_path), "check", wait_for="train", fail=True)
+    dag.add("train", step, str(tmp_path), "train")
+    dag.add("test", step, str(tmp_path), "test")
+
+    with pytest.raises(RuntimeError, match=r"\['check', 'test', 'train'\]"):
+        dag.run(max_workers=3, promote=promoted)
+
+    # The gated step ran to completion, staged, but its outputs were discarded
+    assert status(tmp_path, "train") == "done"
+    assert promoted.calls == []
+    assert status(tmp_path, "test") is None
+
+
+def test_gated_step_is_promoted_once_its_gate_succeeds(tmp_path, promoted):
+    dag = StepGraph(DEPENDENCIES, GATES)
+    dag.add("data", step, str(tmp_path), "data")
+    dag.add("check", step, str(tmp_path), "check", wait_for="train")
+    dag.add("train", step, str(tmp_path), "train")
+    # Its dependent only starts once the outputs are published
+    dag.add("test", step_after, str(tmp_path), "test", "train.promoted")
+
+    dag.run(max_workers=3, promote=promoted)
+
+    assert promoted.calls == [("train", "train staged")]
+    assert status(tmp_path, "test") == "done"
+
+
+def test_gated_step_waits_for_its_gates_without_speculation(tmp_path, promoted):
+    dag = StepGraph(DEPENDENCIES, GATES)
+    dag.add("data", step, str(tmp_path), "data")
+    dag.add("check", step, str(tmp_path), "check")
+    dag.add("train", step_after, str(tmp_path), "train", "check.done")
+
+    dag.run(max_workers=3, speculative=False, promote=promoted)
+
+    assert status(tmp_path, "train") == "done"
+    # Not staged, so there is nothing to promote
+    assert promoted.calls == []
+
+
+def test_cycle_is_rejected():
+    dag = StepGraph({"a": ["b"], "b": ["a"]})
+    dag.add("a", print)
+    dag.add("b", print)
+
+    with pytest.raises(ValueError, match="Cycle"):
+        dag.run()
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from step_cache import ArtifactResolver, StepCache
+
+
+@pytest.fixture
+def step(tmp_path, local_store):
+    """
+    Code directory, parameters and input artifact of a step
+    """
+    code_dir = tmp_path / "step"
+    code_dir.mkdir()
+    (code_dir / "run.py").write_text("print('v1')\n")
+    (code_dir / "MLproject").write_text("name: step\n")
+
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"n_estimators": 100}))
+
+    data = tmp_path / "data.csv"
+    data.write_text("x\n1\n")
+    local_store.log_artifact("data.csv", [str(data)])
+
+    return {
+        "code_dir": code_dir,
+        "config": config,
+        "data": data,
+        "parameters": {"min_price": 10, "config": str(config)},
+    }
+
+
+@pytest.fixture
+def cache(tmp_path, local_store):
+    return StepCache(str(tmp_path / "step_cache.json"))
+
+
+def fingerprint(cache, step):
+    return cache.fingerprint("step", str(step["code_dir"]), step["parameters"], ["data.csv:latest"])
+
+
+def test_fingerprint_is_stable(cache, step):
+    assert fingerprint(cache, step) == fingerprint(cache, step)
+
+
+def test_fingerprint_changes_with_the_code(cache, step):
+    before = fingerprint(cache, step)
+    (step["code_dir"] / "run.py").write_text("print('v2')\n")
+
+    assert fingerprint(cache, step) != before
+
+
+def test_fingerprint_ignores_files_that_are_not_code(cache, step):
+    before = fingerprint(cache, step)
+    (step["code_dir"] / "clean_sample.csv").write_text("x\n1\n")
+    (step["code_dir"] / "__pycache__").mkdir()
+    (step["code_dir"] / "__pycache__" / "run.cpython-310.pyc").write_bytes(b"\0")
+
+    assert fingerprint(cache, step) == before
+
+
+def test_fingerprint_changes_with_the_parameters(cache, step):
+    before = fingerprint(cache, step)
+    step["parameters"]["min_price"] = 20
+
+    assert fingerprint(cache, step) != before
+
+
+def test_fingerprint_changes_with_the_content_of_parameter_files(cache, step):
+    before = fingerprint(cache, step)
+    step["config"].write_text(json.dumps({"n_estimators": 200}))
+
+    assert fingerprint(cache, step) != before
+
+
+def test_fingerprint_changes_with_the_inputs(cache, step, local_store):
+    before = fingerprint(cache, step)
+    step["data"].write_text("x\n2\n")
+    local_store.log_artifact("data.csv", [str(step["data"])])
+
+    assert fingerprint(cache, step) != before
+
+
+def test_restore_the_recorded_outputs(cache, step, local_store, tmp_path):
+    output = tmp_path / "clean.csv"
+    output.write_text("x\n1\n")
+    local_store.log_artifact("clean.csv", [str(output)])
+
+    key = fingerprint(cache, step)
+    assert cache.lookup("step", key) is None
+    cache.record("step", key, ["clean.csv"])
+    assert cache.lookup("step", key) == {"clean.csv": "v0"}
+    assert cache.lookup("other_step", key) is None
+
+    # Another run (e.g. with other parameters) produced a newer version in the meantime
+    output.write_text("x\n2\n")
+    local_store.log_artifact("clean.csv", [str(output)])
+
+    cache.restore("step", cache.lookup("step", key))
+    assert local_store.use_artifact("clean.csv:latest").path == local_store.use_artifact("clean.csv:v0").path
+    # The record persists across instances
+    assert StepCache(cache.path).lookup("step", key) == {"clean.csv": "v0"}
+
+
+def test_publish_staged_artifact(local_store, tmp_path):
+    output = tmp_path / "model.pkl"
+    output.write_text("published")
+    local_store.log_artifact("model", [str(output)])
+    output.write_text("staged")
+    local_store.log_artifact("model_staging", [str(output)])
+
+    version = ArtifactResolver().publish("model_staging", "model")
+
+    assert version == "v1"
+    latest = local_store.use_artifact("model:latest")
+    assert latest.digest == local_store.use_artifact("model_staging:latest").digest